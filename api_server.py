@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+"""
+Headless HTTP/JSON scheduling service for many concurrent users.
+
+A single asyncio event loop serves every connection (HTTP/1.1 keep-alive,
+no third-party framework). Each user's deck is held in a Session: its own
+FSRS6Scheduler over a memory-mapped CardStore, kept in an LRU cache of hot
+users. Scheduling runs on the event loop, since grading one card takes
+microseconds; everything that touches the disk runs elsewhere:
+
+    - loading and evicting sessions run on a thread pool
+    - graded reviews are queued on one WriteBehindSaver shared by all
+      users, whose background thread journals them in batches
+
+so a grade's reply is sent before its review reaches the disk, exactly as
+in the desktop app. An evicted user's reviews are flushed and their deck
+snapshot saved before that user can be loaded again. If the flush fails,
+the snapshot is left as it was and the reviews stay queued on the saver,
+which keeps retrying; loading that user again waits for them. On
+shutdown, sessions still loading are awaited and saved with the rest, and
+requests needing a new session are refused.
+
+Endpoints (parameters as JSON body fields or query string):
+    POST /login     user                 create the user if needed, load the deck
+    GET  /next      user[, over_limit]   the next card to practise, or null
+    POST /grade     user, card_id, again grade a card (with next: and get the next one)
+    GET  /stats     user                 deck statistics
+    GET  /forecast  user[, days]         cards falling due on each of the next days
+    POST /logout    user                 save and drop the user's session
+
+Usage:
+    python3 api_server.py --port 8765
+    python3 loadgen.py --port 8765 --users 50     # see loadgen.py
+"""
+import argparse
+import asyncio
+import json
+import signal
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Optional
+from urllib.parse import parse_qsl, urlsplit
+from fsrs import FSRS6Scheduler
+from models import Card, CardStore, DeckMetadata, today_ordinal
+from persistence import PersistenceManager
+from practice_queue import build_queue
+from replay import open_backend
+from sqlite_persistence import SqlitePersistenceManager
+from user_settings import UserSettings
+from write_behind import WriteBehindSaver
+
+DEFAULT_PORT = 8765
+# Largest request body accepted
+MAX_BODY_BYTES = 1 << 16
+# Due cards queued for a session at a time. Each refill ranks every due card
+# (see practice_queue.build_queue), so larger chunks refill less often.
+QUEUE_CHUNK = 1000
+# Most days a forecast may cover
+MAX_FORECAST_DAYS = 365
+
+
+class ApiError(Exception):
+    """A request that cannot be served; sent to the client as an error reply."""
+    
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class Session:
+    """One user's loaded deck and scheduler."""
+    user: str
+    settings: UserSettings
+    scheduler: FSRS6Scheduler
+    cards: CardStore
+    deck_metadata: DeckMetadata
+    rows_by_id: dict = field(repr=False)
+    params: list = field(repr=False)  # scheduler.log_parameters(), logged with each review
+    queue: deque = field(default_factory=deque, repr=False)  # Rows to serve next
+    queue_day: int = 0  # Day the queue was built for
+    
+    def card(self, card_id) -> Card:
+        """Get a card of the deck by ID."""
+        try:
+            row = self.rows_by_id[int(card_id)]
+        except (KeyError, TypeError, ValueError):
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown card ID {card_id!r}") from None
+        return self.cards[row]
+    
+    def next_card(self) -> Optional[Card]:
+        """Take the next due card, refilling the queue from the due index when it runs out."""
+        today = today_ordinal()
+        if self.queue_day != today:
+            self.queue.clear()
+            self.queue_day = today
+        next_due = self.cards.next_due
+        for refill in (True, False):
+            while self.queue:
+                row = self.queue.popleft()
+                # Skip cards graded since they were queued
+                if next_due[row] <= today:
+                    return self.cards[row]
+            if refill:
+                limit = QUEUE_CHUNK
+                metadata = self.deck_metadata
+                if not metadata.allow_over_limit_today:
+                    limit = max(0, min(limit, metadata.max_per_day - metadata.get_today_count()))
+                self.queue.extend(build_queue(
+                    self.cards, self.scheduler.due_rows(self.cards, today), limit,
+                    ordering=self.settings.practice_order,
+                    new_ratio=self.settings.new_card_ratio,
+                    today=today
+                ))
+        return None
+
+
+def _card_json(card: Card) -> dict:
+    return {
+        'id': card.card_id,
+        'front': card.front,
+        'back': card.back,
+        'state': card.state,
+        'stability': card.stability,
+        'difficulty': card.difficulty,
+        'interval_days': card.interval_days,
+        'next_due_day': card.next_due_day
+    }
+
+
+def _flag(value) -> bool:
+    """Read a boolean parameter from JSON or a query string."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def _username(params: dict) -> str:
+    """Get and check the user parameter (it names a directory)."""
+    user = params.get('user')
+    if not isinstance(user, str) or not user:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Missing user")
+    # Same rule as the login screen
+    if len(user) > 64 or not user.replace('_', '').replace('-', '').isalnum():
+        raise ApiError(HTTPStatus.BAD_REQUEST,
+                       "Username can only contain letters, numbers, hyphens, and underscores")
+    return user
+
+
+class SchedulingService:
+    """Request handlers over an LRU cache of user sessions."""
+    
+    def __init__(self, persistence: PersistenceManager, base_dir: str = "data/users",
+                 csv_path: str = "hiragana.csv", deck_name: str = "hiragana",
+                 max_sessions: int = 256, io_threads: int = 4,
+                 debounce_seconds: float = 0.5):
+        """
+        Set up the service; users' sessions are loaded on first use.
+        
+        Args:
+            persistence: Storage backend shared by all users
+            base_dir: User data directory (for settings and fitted parameters)
+            csv_path: Deck CSV every user studies
+            deck_name: Deck name
+            max_sessions: Most users kept loaded (at least 1); the least
+                          recently used one is saved and dropped beyond that
+            io_threads: Threads for loading and saving sessions
+            debounce_seconds: How long graded reviews wait to be written in batches
+        """
+        self.persistence = persistence
+        self.base_dir = base_dir
+        self.csv_path = csv_path
+        self.deck_name = deck_name
+        self.max_sessions = max(1, max_sessions)
+        self.executor = ThreadPoolExecutor(io_threads, thread_name_prefix="api-io")
+        self.saver = WriteBehindSaver(persistence, debounce_seconds, on_error=self._save_failed)
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        # Sessions being loaded or saved, so each user has one at a time
+        self._loading: dict[str, asyncio.Future] = {}
+        self._closing: dict[str, asyncio.Future] = {}
+        # Set by close(); no session is loaded after that
+        self._stopping = False
+        self.grades = 0
+        
+        self.routes = {
+            ('POST', '/login'): self.login,
+            ('GET', '/next'): self.next_card,
+            ('POST', '/grade'): self.grade,
+            ('GET', '/stats'): self.stats,
+            ('GET', '/forecast'): self.forecast,
+            ('POST', '/logout'): self.logout,
+        }
+    
+    @staticmethod
+    def _save_failed(error: Exception):
+        print(f"Failed to save reviews: {error}", file=sys.stderr)
+    
+    async def _in_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    # Sessions
+    
+    async def session(self, user: str, create: bool = False) -> Session:
+        """Get a user's session, loading it (on the thread pool) if it is not cached."""
+        while True:
+            session = self.sessions.get(user)
+            if session is not None:
+                self.sessions.move_to_end(user)
+                return session
+            loading = self._loading.get(user)
+            if loading is None:
+                if self._stopping:
+                    raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "Server is shutting down")
+                loading = asyncio.ensure_future(self._load(user, create))
+                self._loading[user] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(user, None))
+            await asyncio.shield(loading)
+            # Another load may have evicted the session (unmapping its deck)
+            # before this request resumed; if so, load it again
+    
+    async def _load(self, user: str, create: bool) -> Session:
+        closing = self._closing.get(user)
+        if closing is not None:
+            await closing
+        session = await self._in_thread(self._load_session, user, create)
+        self.sessions[user] = session
+        while len(self.sessions) > self.max_sessions:
+            self._evict(next(iter(self.sessions)))
+        return session
+    
+    def _load_session(self, user: str, create: bool) -> Session:
+        """Load a user's settings and deck (runs on the thread pool)."""
+        if not self.persistence.user_exists(user):
+            if not create:
+                raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown user '{user}'")
+            self.persistence.create_user(user)
+        settings = UserSettings(user, base_dir=self.base_dir)
+        scheduler = FSRS6Scheduler(settings.effective_intensity(), settings.request_retention)
+        scheduler.load_parameters(settings.params_file)
+        scheduler.load_balance = settings.load_balance
+        # This user's reviews still queued from an earlier session must be read back
+        if not self.saver.flush(key=(user, self.deck_name)):
+            raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "Pending reviews could not be saved")
+        cards = self.persistence.open_deck_snapshot(self.csv_path, user, self.deck_name)
+        scheduler.index_cards(cards)
+        return Session(
+            user=user,
+            settings=settings,
+            scheduler=scheduler,
+            cards=cards,
+            deck_metadata=self.persistence.load_deck_metadata(user, self.deck_name),
+            rows_by_id={card_id: row for row, card_id in enumerate(cards.ids)},
+            params=scheduler.log_parameters()
+        )
+    
+    def _evict(self, user: str) -> asyncio.Future:
+        """Drop a session from the cache and save it on the thread pool."""
+        session = self.sessions.pop(user)
+        closing = asyncio.ensure_future(self._in_thread(self._save_session, session))
+        self._closing[user] = closing
+        closing.add_done_callback(lambda _: self._closing.pop(user, None))
+        return closing
+    
+    def _save_session(self, session: Session):
+        """Write a dropped session's state and unmap its deck (runs on the thread pool)."""
+        try:
+            if not self.saver.flush(key=(session.user, self.deck_name)):
+                # Already reported by the saver, which keeps the reviews queued
+                # and retries; a snapshot now would not match the saved progress
+                return
+            self.persistence.save_deck_metadata(session.user, self.deck_name,
+                                                session.deck_metadata)
+            # Like FlashcardApp.save_deck_summary: lets the next load skip the CSV
+            self.persistence.wait_for_compaction(session.user, self.deck_name)
+            with self.persistence.write_group():
+                self.persistence.save_deck_snapshot(
+                    self.csv_path, session.user, self.deck_name, session.cards)
+                self.persistence.save_deck_header(
+                    self.csv_path, session.user, self.deck_name, session.cards)
+        except OSError as e:
+            self._save_failed(e)  # The reviews were flushed; only the login cache is stale
+        finally:
+            session.cards.close()
+    
+    async def close(self):
+        """Save every session and stop the background workers."""
+        self._stopping = True
+        # Sessions still loading are registered when done, so they are saved too
+        await asyncio.gather(*self._loading.values(), return_exceptions=True)
+        closing = [self._evict(user) for user in list(self.sessions)]
+        await asyncio.gather(*closing, *self._closing.values())
+        await self._in_thread(self.saver.close)
+        self.executor.shutdown()
+    
+    # Handlers: each takes the request parameters and returns the JSON reply
+    
+    async def login(self, params: dict) -> dict:
+        session = await self.session(_username(params), create=True)
+        return {
+            'user': session.user,
+            'deck': self.deck_name,
+            'cards': len(session.cards),
+            'due': session.scheduler.count_due_cards(session.cards),
+            'reviewed_today': session.deck_metadata.get_today_count(),
+            'max_per_day': session.deck_metadata.max_per_day
+        }
+    
+    @staticmethod
+    def _next_reply(session: Session, params: dict) -> dict:
+        metadata = session.deck_metadata
+        # The app's "continue reviewing anyway?" answer
+        if _flag(params.get('over_limit', False)) and not metadata.allow_over_limit_today:
+            metadata.allow_over_limit_today = True
+            metadata.dirty = True
+        if not metadata.can_review_more():
+            return {'card': None, 'limit_reached': True}
+        card = session.next_card()
+        return {'card': _card_json(card) if card is not None else None, 'limit_reached': False}
+    
+    async def next_card(self, params: dict) -> dict:
+        session = await self.session(_username(params))
+        return self._next_reply(session, params)
+    
+    async def grade(self, params: dict) -> dict:
+        """Grade a card; with next, the reply also carries /next's, saving a round trip."""
+        session = await self.session(_username(params))
+        if 'card_id' not in params or 'again' not in params:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Missing card_id or again")
+        card = session.card(params['card_id'])
+        grade_again = _flag(params['again'])
+        session.scheduler.schedule_card(card, grade_again)
+        session.deck_metadata.increment_today_count()
+        self.saver.record_review(session.user, self.deck_name, card, grade_again,
+                                 session.deck_metadata, params=session.params)
+        self.grades += 1
+        reply = {'card': _card_json(card),
+                 'reviewed_today': session.deck_metadata.get_today_count()}
+        if _flag(params.get('next', False)):
+            reply['next'] = self._next_reply(session, params)
+        return reply
+    
+    async def stats(self, params: dict) -> dict:
+        session = await self.session(_username(params))
+        stats = session.scheduler.deck_stats
+        return {
+            'total_cards': stats.total_cards,
+            'due': session.scheduler.count_due_cards(session.cards),
+            'state_counts': list(stats.state_counts),
+            'average_stability': stats.average_stability,
+            'average_difficulty': stats.average_difficulty,
+            'total_lapses': stats.total_lapses,
+            'reviewed_today': session.deck_metadata.get_today_count(),
+            'max_per_day': session.deck_metadata.max_per_day
+        }
+    
+    async def forecast(self, params: dict) -> dict:
+        session = await self.session(_username(params))
+        try:
+            days = int(params.get('days', 30))
+        except (TypeError, ValueError):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "days must be a whole number") from None
+        if not 1 <= days <= MAX_FORECAST_DAYS:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"days must be 1-{MAX_FORECAST_DAYS}")
+        return {'today': today_ordinal(),
+                'forecast': session.scheduler.forecast(session.cards, days)}
+    
+    async def logout(self, params: dict) -> dict:
+        user = _username(params)
+        if user in self.sessions:
+            await self._evict(user)
+        return {'user': user}
+    
+    async def dispatch(self, method: str, target: str, body: bytes) -> tuple:
+        """
+        Route one request.
+        
+        Returns:
+            (HTTPStatus, JSON-serialisable reply)
+        """
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        try:
+            if handler is None:
+                if any(path == url.path for _, path in self.routes):
+                    raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed")
+                raise ApiError(HTTPStatus.NOT_FOUND, f"No such endpoint {url.path}")
+            params = dict(parse_qsl(url.query))
+            if body:
+                try:
+                    payload = json.loads(body)
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    raise ApiError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}") from None
+                if not isinstance(payload, dict):
+                    raise ApiError(HTTPStatus.BAD_REQUEST, "Request body must be a JSON object")
+                params.update(payload)
+            return HTTPStatus.OK, await handler(params)
+        except ApiError as e:
+            return e.status, {'error': str(e)}
+        except Exception as e:
+            print(f"{method} {url.path} failed: {e!r}", file=sys.stderr)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Internal error"}
+
+
+def _response(status: HTTPStatus, reply, keep_alive: bool) -> bytes:
+    body = json.dumps(reply, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n")
+    if not keep_alive:
+        head += "Connection: close\r\n"
+    return (head + "\r\n").encode('latin-1') + body
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[tuple]:
+    """
+    Read one HTTP request.
+    
+    Returns:
+        (method, target, version, headers, body), or None at the end of the connection
+    
+    Raises:
+        ApiError: If the request is malformed or too large
+    """
+    # The whole head in one read; the stream limit (64 KiB) caps its size
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Truncated request") from None
+    except asyncio.LimitOverrunError:
+        raise ApiError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                       "Request head too large") from None
+    request_line, *lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = request_line.split()
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Malformed request line") from None
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Bad Content-Length") from None
+    if not 0 <= length <= MAX_BODY_BYTES:
+        raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method, target, version, headers, body
+
+
+class ApiServer:
+    """asyncio HTTP/1.1 front end for a SchedulingService."""
+    
+    def __init__(self, service: SchedulingService):
+        self.service = service
+        self.server: Optional[asyncio.AbstractServer] = None
+    
+    async def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> int:
+        """
+        Start listening.
+        
+        Returns:
+            The bound port (useful with port 0)
+        """
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+    
+    async def close(self):
+        """Stop accepting connections, then save every session."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.service.close()
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except ApiError as e:
+                    writer.write(_response(e.status, {'error': str(e)}, keep_alive=False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                method, target, version, headers, body = request
+                connection = headers.get('connection', '').lower()
+                keep_alive = (connection == 'keep-alive' if version == 'HTTP/1.0'
+                              else connection != 'close')
+                status, reply = await self.service.dispatch(method, target, body)
+                writer.write(_response(status, reply, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Client went away
+        finally:
+            writer.close()
+
+
+async def serve(service: SchedulingService, host: str, port: int):
+    """Run the service until interrupted or terminated, then save every session."""
+    server = ApiServer(service)
+    port = await server.start(host, port)
+    print(f"Serving on http://{host}:{port} (Ctrl+C to stop)")
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        pass  # Windows: Ctrl+C only
+    try:
+        await stop.wait()
+    finally:
+        await server.close()
+
+
+def main():
+    """Run the scheduling service."""
+    parser = argparse.ArgumentParser(description="HTTP/JSON spaced repetition service")
+    parser.add_argument('--host', default="127.0.0.1", help="Address to bind (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--data', default="data/users",
+                        help="JSON user data directory (default: data/users)")
+    parser.add_argument('--db', default=None, help="SQLite database to use instead of JSON files")
+    parser.add_argument('--csv', default="hiragana.csv", help="Deck CSV (default: hiragana.csv)")
+    parser.add_argument('--deck', default="hiragana", help="Deck name (default: hiragana)")
+    parser.add_argument('--max-sessions', type=int, default=256,
+                        help="Most users kept in memory (default: 256)")
+    parser.add_argument('--io-threads', type=int, default=4,
+                        help="Threads for loading and saving decks (default: 4)")
+    args = parser.parse_args()
+    
+    persistence = open_backend(args.data, args.db)
+    service = SchedulingService(persistence, args.data, args.csv, args.deck,
+                                max_sessions=args.max_sessions, io_threads=args.io_threads)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if isinstance(persistence, SqlitePersistenceManager):
+            persistence.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the flashcard application.
+
+Usage:
+    python3 benchmarks.py              # run every benchmark
+    python3 benchmarks.py batch        # run selected benchmarks by name
+"""
+import argparse
+import asyncio
+import random
+import sys
+import os
+import tempfile
+import time
+import tracemalloc
+from array import array
+from datetime import datetime, timedelta
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from deck_import import import_deck_csv
+from durable import DurabilityPolicy
+from models import Card, CardStore, DeckMetadata, ReviewEvent
+from fsrs import FSRS6Scheduler
+from grading import grade_many
+from loadgen import run_local_load
+from optimizer import ReviewHistory, fit_parameters
+from persistence import PersistenceManager, deck_content_cache
+from replay import replay_users
+from sqlite_persistence import SqlitePersistenceManager
+from workload import simulate_workload
+
+
+def _timed(func, *args, **kwargs) -> float:
+    """Run func once and return elapsed wall time in seconds."""
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def _random_cards(count: int, seed: int = 1) -> list[Card]:
+    """Build a synthetic deck with a realistic mix of states."""
+    rng = random.Random(seed)
+    return [
+        Card(front=f"card{i}", back=f"back{i}", state=rng.randint(0, 3),
+             stability=rng.uniform(0.4, 120.0), difficulty=rng.uniform(1.0, 10.0),
+             interval_days=rng.randint(1, 90), lapses=rng.randint(0, 4))
+        for i in range(count)
+    ]
+
+
+def bench_batch_scheduling(sizes=(10_000, 100_000, 300_000)):
+    """Compare per-card schedule_card against schedule_batch throughput."""
+    print("Batch scheduling (cards/second)")
+    scheduler = FSRS6Scheduler()
+    for size in sizes:
+        cards = _random_cards(size)
+        rng = random.Random(size)
+        grades = array('b', (rng.random() < 0.2 for _ in range(size)))
+        
+        states = array('b', (c.state for c in cards))
+        stabilities = array('d', (c.stability for c in cards))
+        difficulties = array('d', (c.difficulty for c in cards))
+        intervals = array('l', (c.interval_days for c in cards))
+        lapses = array('l', (c.lapses for c in cards))
+        
+        def scalar():
+            schedule = scheduler.schedule_card
+            for card, grade in zip(cards, grades):
+                schedule(card, bool(grade))
+        
+        scalar_time = _timed(scalar)
+        batch_time = _timed(scheduler.schedule_batch, states, stabilities,
+                            difficulties, intervals, lapses, grades)
+        print(f"  {size:>9,} cards: scalar {size / scalar_time:>12,.0f}/s   "
+              f"batch {size / batch_time:>12,.0f}/s   "
+              f"speedup {scalar_time / batch_time:.1f}x")
+
+
+def bench_due_index(sizes=(10_000, 50_000, 200_000)):
+    """Compare a linear due scan against the due-date index."""
+    print("Due queries (ms per call)")
+    today = datetime.now()
+    for size in sizes:
+        rng = random.Random(size)
+        cards = _random_cards(size)
+        for card in cards:
+            card.state = 2
+            card.last_seen = (today - timedelta(days=rng.randint(0, 60))).toordinal()
+            card.interval_days = rng.randint(1, 365)
+            card.refresh_due_day()
+        
+        scan = FSRS6Scheduler()
+        indexed = FSRS6Scheduler()
+        build_time = _timed(indexed.index_cards, cards)
+        
+        scan_time = _timed(scan.count_due_cards, cards)
+        count_time = _timed(indexed.count_due_cards, cards)
+        list_time = _timed(indexed.get_due_cards, cards)
+        forecast_time = _timed(indexed.forecast, cards, 30)
+        print(f"  {size:>9,} cards: scan {scan_time * 1000:8.2f}   "
+              f"index count {count_time * 1000:6.3f}   index list {list_time * 1000:7.2f}   "
+              f"forecast {forecast_time * 1000:6.3f}   (build {build_time * 1000:.0f})")
+
+
+def _legacy_is_card_due(card, last_seen: str) -> bool:
+    """Due check as it was with 'YYYY-MM-DD' strings, for comparison."""
+    if card.state == 0 or not last_seen:
+        return True
+    try:
+        last_seen_date = datetime.strptime(last_seen, '%Y-%m-%d')
+        return datetime.now() >= last_seen_date + timedelta(days=card.interval_days)
+    except (ValueError, TypeError):
+        return True
+
+
+def bench_due_check(size=1_000_000):
+    """Compare string-date due checks against day-ordinal due checks."""
+    print(f"Due check over {size:,} cards")
+    cards = _random_cards(size)
+    today = datetime.now()
+    rng = random.Random(3)
+    strings = []
+    for card in cards:
+        seen = today - timedelta(days=rng.randint(0, 120))
+        strings.append(seen.strftime('%Y-%m-%d'))
+        card.last_seen = seen.toordinal()
+        card.refresh_due_day()
+    
+    scheduler = FSRS6Scheduler()
+    before = _timed(lambda: sum(_legacy_is_card_due(c, s) for c, s in zip(cards, strings)))
+    after = _timed(scheduler.count_due_cards, cards)
+    print(f"  strptime per card: {before:7.3f} s   ({before / size * 1e9:6.0f} ns/card)")
+    print(f"  day ordinals:      {after:7.3f} s   ({after / size * 1e9:6.0f} ns/card)")
+    print(f"  speedup {before / after:.1f}x")
+
+
+def _traced_bytes(build) -> tuple:
+    """Return (result, bytes still allocated) for a build function."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def bench_card_memory(size=200_000, users=3):
+    """Measure per-card memory of list[Card] against CardStore with tracemalloc."""
+    print(f"Card memory for {users} users x {size:,} cards")
+    # Shared deck text, as read from one CSV by every user on a host
+    fronts = [f"front-{i}" for i in range(size)]
+    backs = [f"back-{i}" for i in range(size)]
+    
+    def user_cards(seed):
+        rng = random.Random(seed)
+        for f, b in zip(fronts, backs):
+            yield Card(front=f, back=b, state=2, last_seen=740000 + rng.randint(0, 400),
+                       stability=rng.uniform(0.4, 120.0), difficulty=rng.uniform(1.0, 10.0),
+                       interval_days=rng.randint(300, 900), lapses=rng.randint(0, 3))
+    
+    def build_lists():
+        return [list(user_cards(user)) for user in range(users)]
+    
+    def build_stores():
+        return [CardStore(user_cards(user)) for user in range(users)]
+    
+    lists, list_bytes = _traced_bytes(build_lists)
+    del lists
+    stores, store_bytes = _traced_bytes(build_stores)
+    del stores
+    cards = size * users
+    print(f"  list[Card]: {list_bytes / cards:6.1f} bytes/card")
+    print(f"  CardStore:  {store_bytes / cards:6.1f} bytes/card")
+    print(f"  reduction {list_bytes / store_bytes:.1f}x")
+
+
+def bench_grade_io(sizes=(1_000, 10_000, 100_000), grades=50):
+    """Compare per-grade snapshot rewrites against journal appends."""
+    print("Per-grade persistence (ms per grade)")
+    scheduler = FSRS6Scheduler()
+    for size in sizes:
+        cards = _random_cards(size)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pm = PersistenceManager(base_dir=tmpdir, compact_threshold_bytes=1 << 40)
+            
+            def snapshot():
+                for card in cards[:grades]:
+                    scheduler.schedule_card(card, False)
+                    pm.save_card_metadata("bench", "deck", cards, full=True)
+            
+            def journal():
+                for card in cards[:grades]:
+                    scheduler.schedule_card(card, False)
+                    pm.append_review("bench", "deck", card, False)
+            
+            snapshot_time = _timed(snapshot)
+            journal_time = _timed(journal)
+        print(f"  {size:>9,} cards: snapshot {snapshot_time / grades * 1000:8.2f}   "
+              f"journal {journal_time / grades * 1000:6.3f}")
+
+
+def bench_storage_backends(sizes=(1_000, 10_000, 100_000, 1_000_000)):
+    """Compare the JSON and SQLite backends for full saves, loads and dirty-only saves."""
+    print("Storage backends (seconds)")
+    print(f"  {'cards':>9}  {'backend':<7} {'save all':>9} {'save 10':>9} {'load':>9}  bytes/save 10")
+    scheduler = FSRS6Scheduler()
+    for size in sizes:
+        cards = _random_cards(size)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            backends = [
+                ('json', PersistenceManager(base_dir=tmpdir)),
+                ('sqlite', SqlitePersistenceManager(os.path.join(tmpdir, "bench.db"))),
+            ]
+            for name, pm in backends:
+                save_all = _timed(pm.save_card_metadata, "bench", "deck", cards, full=True)
+                for card in cards[:10]:
+                    scheduler.schedule_card(card, False)
+                save_some = _timed(pm.save_card_metadata, "bench", "deck", cards)
+                save_some_bytes = pm.last_save.bytes
+                if name == 'sqlite':
+                    pm.close()
+                    pm = SqlitePersistenceManager(os.path.join(tmpdir, "bench.db"))
+                load = _timed(pm.load_card_metadata, "bench", "deck")
+                if name == 'sqlite':
+                    pm.close()
+                print(f"  {size:>9,}  {name:<7} {save_all:9.3f} {save_some:9.4f} {load:9.3f}"
+                      f"  {save_some_bytes:>8,}")
+
+
+def bench_snapshot(sizes=(10_000, 100_000, 1_000_000)):
+    """Compare opening a deck from CSV + JSON against mapping its binary snapshot."""
+    print("Deck open (seconds)")
+    print(f"  {'cards':>9}  {'csv+json':>9} {'snapshot':>9} {'first 20':>9}")
+    for size in sizes:
+        cards = _random_cards(size)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "deck.csv")
+            pm = PersistenceManager(base_dir=tmpdir)
+            pm.save_deck_to_csv(csv_path, cards)
+            pm.save_card_metadata("bench", "deck", cards, full=True)
+            
+            csv_json = _timed(pm.load_card_store, csv_path, "bench", "deck")
+            pm.open_deck_snapshot(csv_path, "bench", "deck").close()  # build it once
+            start = time.perf_counter()
+            store = pm.open_deck_snapshot(csv_path, "bench", "deck")
+            opened = time.perf_counter() - start
+            first = _timed(lambda: [store[row].to_metadata() for row in range(20)])
+            store.close()
+        print(f"  {size:>9,}  {csv_json:9.3f} {opened:9.5f} {first:9.5f}")
+
+
+def bench_login(sizes=(10_000, 100_000, 1_000_000)):
+    """Compare time-to-main-menu for eager loading against the lazy deck header."""
+    print("Time to main menu (seconds)")
+    print(f"  {'cards':>9}  {'eager':>8} {'header':>9}")
+    for size in sizes:
+        cards = _random_cards(size)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "deck.csv")
+            pm = PersistenceManager(base_dir=tmpdir)
+            pm.save_deck_to_csv(csv_path, cards)
+            pm.save_card_metadata("bench", "deck", cards, full=True)
+            pm.save_deck_header(csv_path, "bench", "deck", cards)
+            scheduler = FSRS6Scheduler()
+            
+            def eager():
+                deck = pm.load_deck_from_csv(csv_path, "bench", "deck")
+                pm.load_deck_metadata("bench", "deck")
+                scheduler.index_cards(deck)
+                return scheduler.count_due_cards(deck)
+            
+            def lazy():
+                pm.load_deck_metadata("bench", "deck")
+                return pm.load_deck_header(csv_path, "bench", "deck").due_count()
+            
+            eager_time = _timed(eager)
+            lazy_time = _timed(lazy)
+        print(f"  {size:>9,}  {eager_time:8.3f} {lazy_time:9.5f}")
+
+
+def _scanned_stats(cards) -> tuple:
+    """The per-open scans the stats screen used to make."""
+    total = len(cards)
+    states = [sum(1 for c in cards if c.state == state) for state in range(4)]
+    avg_difficulty = sum(c.difficulty for c in cards) / total if total > 0 else 0
+    avg_stability = (sum(c.stability for c in cards if c.stability > 0)
+                     / max(1, sum(1 for c in cards if c.stability > 0)))
+    return states, avg_difficulty, avg_stability, sum(c.lapses for c in cards)
+
+
+def bench_practice_queue(sizes=(10_000, 100_000, 300_000), limit=100):
+    """Measure practice-queue construction when every card is due."""
+    print(f"Building a {limit}-card practice queue (ms per call)")
+    today = datetime.now().toordinal()
+    for size in sizes:
+        rng = random.Random(size)
+        cards = CardStore()
+        for card in _random_cards(size):
+            card.state = 2
+            card.stability = rng.uniform(0.5, 60.0)
+            card.interval_days = rng.randint(1, 60)
+            card.last_seen = today - card.interval_days - rng.randint(0, 30)
+            card.refresh_due_day()
+            cards.append(card)
+        scheduler = FSRS6Scheduler()
+        scheduler.index_cards(cards)
+        times = [_timed(scheduler.practice_queue, cards, limit, ordering, today=today)
+                 for ordering in ('deck', 'overdue', 'retrievability')]
+        print(f"  {size:>9,} due: deck {times[0] * 1000:7.1f}   overdue {times[1] * 1000:7.1f}   "
+              f"retrievability {times[2] * 1000:7.1f}")
+
+
+def bench_analytics(sizes=(100_000, 1_000_000)):
+    """Measure whole-deck retrievability analytics, cold and cached."""
+    print("Deck analytics (ms per call)")
+    today = datetime.now().toordinal()
+    for size in sizes:
+        rng = random.Random(size)
+        cards = CardStore()
+        for card in _random_cards(size):
+            if card.state:
+                card.stability = rng.uniform(0.5, 400.0)
+                card.last_seen = today - rng.randint(0, 90)
+            cards.append(card)
+        scheduler = FSRS6Scheduler()
+        cold = _timed(scheduler.analytics, cards, today)
+        cached = _timed(scheduler.analytics, cards, today)
+        print(f"  {size:>9,} cards: cold {cold * 1000:8.1f}   cached {cached * 1000:6.3f}")
+
+
+def bench_stats(sizes=(10_000, 100_000, 1_000_000), grades=1_000):
+    """Compare opening the stats screen by scanning the deck against running totals."""
+    print("Stats screen figures (seconds to open; microseconds per grade to maintain)")
+    print(f"  {'cards':>9}  {'scan':>8} {'totals':>9} {'per grade':>10}")
+    for size in sizes:
+        cards = _random_cards(size)
+        scheduler = FSRS6Scheduler()
+        scheduler.index_cards(cards)
+        stats = scheduler.deck_stats
+        scan_time = _timed(_scanned_stats, cards)
+        totals_time = _timed(lambda: (stats.state_counts, stats.average_difficulty,
+                                      stats.average_stability, stats.total_lapses))
+        grade_time = _timed(lambda: [scheduler.schedule_card(cards[i * 7919 % size], i % 3 == 0)
+                                     for i in range(grades)])
+        scheduler.deck_stats = None
+        plain_time = _timed(lambda: [scheduler.schedule_card(cards[i * 7919 % size], i % 3 == 0)
+                                     for i in range(grades)])
+        per_grade = (grade_time - plain_time) / grades * 1e6
+        print(f"  {size:>9,}  {scan_time:8.3f} {totals_time:9.6f} {per_grade:10.2f}")
+
+
+def bench_replay(users=100, days=365, reviews_per_day=20, deck_size=2_000, target_users=10_000):
+    """Measure review-log replay throughput and project it to target_users users."""
+    print(f"Replaying {days} days x {reviews_per_day} reviews for {users} users")
+    rng = random.Random(7)
+    scheduler = FSRS6Scheduler()
+    params = scheduler.log_parameters()
+    start_day = datetime(2024, 1, 1).toordinal()
+    card = Card(front="", back="")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pm = PersistenceManager(base_dir=tmpdir)
+        user_names = [f"user{u}" for u in range(users)]
+        for user in user_names:
+            records = []
+            for day in range(days):
+                for _ in range(reviews_per_day):
+                    card.card_id = rng.randrange(deck_size)
+                    records.append(pm.review_record(card, rng.random() < 0.2,
+                                                    timestamp=float(start_day + day),
+                                                    params=params))
+                    records[-1][8] = start_day + day
+            pm.append_reviews(user, "deck", records)
+            pm.compact(user, "deck")  # Archive the year to the review history
+        
+        events = users * days * reviews_per_day
+        processes = os.cpu_count() or 1
+        elapsed = _timed(replay_users, user_names, "deck", tmpdir, processes=processes)
+    rate = events / elapsed
+    projected = target_users * days * reviews_per_day / rate
+    print(f"  {events:,} reviews in {elapsed:.2f}s on {processes} process(es): "
+          f"{rate:,.0f} reviews/s")
+    # Users are independent, so the CPU time divides across worker processes
+    print(f"  projected for {target_users:,} users: {projected:.0f}s on {processes} "
+          f"process(es), {projected * processes / 60:.0f} CPU-minutes")
+
+
+def _simulated_history(reviews: int, scheduler: FSRS6Scheduler, seed: int = 3) -> list:
+    """Review events of a learner whose memory follows the scheduler's model."""
+    rng = random.Random(seed)
+    cards = [Card(front=f"card{i}", back="") for i in range(max(1, reviews // 20))]
+    due = [0] * len(cards)
+    events = []
+    day = datetime(2024, 1, 1).toordinal()
+    while len(events) < reviews:
+        day += 1
+        for i, card in enumerate(cards):
+            if due[i] > day or len(events) >= reviews:
+                continue
+            if card.last_seen is None:
+                grade_again = rng.random() < 0.3
+            else:
+                recall = 0.9 ** ((day - card.last_seen) / max(card.stability, 1e-9))
+                grade_again = rng.random() > recall
+            scheduler.schedule_card(card, grade_again, today=day)
+            events.append(ReviewEvent(card.card_id, float(day), day, grade_again))
+            due[i] = day + max(1, int(card.interval_days * rng.uniform(0.5, 2.0)))
+    return events
+
+
+def bench_optimize(sizes=(10_000, 100_000)):
+    """Measure per-user parameter fitting time as the review history grows."""
+    print("Fitting scheduler constants to simulated review histories")
+    truth = FSRS6Scheduler()
+    truth.apply_parameters({'initial_stability_again': 0.8, 'initial_stability_good': 5.0,
+                            'stability_factor_again': 0.6, 'stability_factor_good': 3.5,
+                            'difficulty_decay': -0.3, 'difficulty_increase': 0.6})
+    print(f"  {'reviews':>9}  {'seconds':>8}  {'log-loss':>17}")
+    for size in sizes:
+        history = ReviewHistory.from_events(_simulated_history(size, truth))
+        result = fit_parameters(history)
+        print(f"  {size:>9,}  {result.seconds:8.2f}  "
+              f"{result.baseline_log_loss:7.3f} -> {result.log_loss:5.3f}")
+
+
+def bench_workload(deck_size=10_000, days=90, trials=16, max_per_day=500):
+    """Measure Monte Carlo workload projection throughput."""
+    print(f"Projecting {days} days x {trials} trials for a {deck_size:,}-card deck")
+    rng = random.Random(11)
+    start_day = datetime(2025, 1, 1).toordinal()
+    cards = CardStore()
+    for card in _random_cards(deck_size):
+        if card.state:
+            card.last_seen = start_day - rng.randint(0, card.interval_days)
+            card.refresh_due_day()
+        cards.append(card)
+    for processes in sorted({1, os.cpu_count() or 1}):
+        report = simulate_workload(cards, days=days, trials=trials, max_per_day=max_per_day,
+                                   start_day=start_day, processes=processes)
+        reviews = report.mean_reviews * days * trials
+        print(f"  {processes} process(es): {report.seconds:.2f}s, "
+              f"{reviews / report.seconds:,.0f} simulated reviews/s; "
+              f"{report.mean_reviews:.0f} reviews/day ({report.mean_minutes:.0f} min)")
+
+
+def bench_load_balance(cohorts=((10, 200, 3), (5, 1_000, 7)), days=90, trials=8):
+    """Compare simulated daily load with and without interval load balancing."""
+    print(f"Cohort decks over {days} days x {trials} trials (reviews per day)")
+    fitted = {'initial_stability_again': 0.8, 'initial_stability_good': 5.0,
+              'stability_factor_again': 0.6, 'stability_factor_good': 3.5,
+              'difficulty_decay': -0.3, 'difficulty_increase': 0.6}
+    start_day = datetime(2025, 1, 1).toordinal()
+    print(f"  {'deck':>22}  {'balance':>7}  {'mean':>6}  {'p90':>5}  {'sd':>6}")
+    for count, size, gap in cohorts:
+        # Cohorts learned together every `gap` days, reviewed up to the start
+        rng = random.Random(size)
+        history = FSRS6Scheduler()
+        history.apply_parameters(fitted)
+        cards = CardStore()
+        for cohort in range(count):
+            for i in range(size):
+                card = Card(front=f"{cohort}-{i}", back="")
+                history.schedule_card(card, rng.random() < 0.3,
+                                      today=start_day - (count - cohort) * gap)
+                while card.next_due_day < start_day:
+                    recall = 0.9 ** ((card.next_due_day - card.last_seen) / card.stability)
+                    history.schedule_card(card, rng.random() >= recall, today=card.next_due_day)
+                cards.append(card)
+        for load_balance in (False, True):
+            scheduler = FSRS6Scheduler()
+            scheduler.apply_parameters(fitted)
+            scheduler.load_balance = load_balance
+            report = simulate_workload(cards, scheduler, days=days, trials=trials,
+                                       start_day=start_day, processes=1)
+            mean = report.mean_reviews
+            spread = (sum((day - mean) ** 2 for day in report.daily_reviews)
+                      / len(report.daily_reviews)) ** 0.5
+            label = f"{count} x {size:,} every {gap}d"
+            print(f"  {label:>22}  {'on' if load_balance else 'off':>7}  "
+                  f"{mean:6.1f}  {report.p90_reviews:5.0f}  {spread:6.1f}")
+
+
+def bench_bulk_grading(deck_size=100_000, sizes=(10_000, 100_000), single=2_000):
+    """Compare grading one card at a time against grade_many, per backend."""
+    print(f"Bulk grading into a {deck_size:,}-card deck (grades per second)")
+    now = time.time()
+    for name in ('json', 'sqlite'):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if name == 'json':
+                pm = PersistenceManager(base_dir=tmpdir, compact_threshold_bytes=1 << 40)
+            else:
+                pm = SqlitePersistenceManager(os.path.join(tmpdir, "bench.db"))
+            cards = CardStore(_random_cards(deck_size))
+            scheduler = FSRS6Scheduler()
+            scheduler.index_cards(cards)
+            
+            def one_at_a_time():
+                for row in range(single):
+                    card = cards[row]
+                    scheduler.schedule_card(card, False)
+                    pm.append_review("bench", "deck", card, False,
+                                     params=scheduler.log_parameters())
+            
+            print(f"  {name:<6} one at a time {single / _timed(one_at_a_time):>10,.0f}")
+            rng = random.Random(5)
+            for size in sizes:
+                grades = [(cards.ids[rng.randrange(deck_size)], rng.random() < 0.1,
+                           now - rng.random() * 86400) for _ in range(size)]
+                report = grade_many(pm, scheduler, cards, "bench", "deck", grades)
+                print(f"  {name:<6} {size:>13,} {report.grades_per_second:>10,.0f}"
+                      f"  ({report.batches} batches)")
+            if name == 'sqlite':
+                pm.close()
+
+
+def bench_api(users=(10, 100, 500), grades=200, deck_size=1_000):
+    """Load the HTTP service with concurrent users (client and server in one process)."""
+    print(f"HTTP service, {grades} grades per user on a {deck_size:,}-card deck")
+    print(f"  {'users':>6} {'grades/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for count in users:
+        report = asyncio.run(run_local_load(count, grades, deck_size, max_sessions=count))
+        print(f"  {count:>6} {report.grades_per_second:>10,.0f} {report.latency_ms(50):>8.2f} "
+              f"{report.latency_ms(99):>8.2f}")
+
+
+def bench_import(sizes=(100_000, 300_000, 1_000_000)):
+    """Measure streaming import time and peak traced memory as the CSV grows."""
+    print("Streaming CSV import into SQLite")
+    print(f"  {'rows':>9}  {'seconds':>8} {'peak MB':>8}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "deck.csv")
+            with open(csv_path, 'w', encoding='utf-8') as f:
+                f.write("front,back,state,lastSeen\n")
+                for i in range(size):
+                    f.write(f"card{i},back{i},2,2025-01-01\n")
+            pm = SqlitePersistenceManager(os.path.join(tmpdir, "bench.db"), base_dir=tmpdir)
+            # The file is its own deck; the deck is already loaded in the app
+            deck_content_cache.rows(csv_path)
+            
+            tracemalloc.start()
+            elapsed = _timed(import_deck_csv, pm, csv_path, csv_path, "bench", "deck")
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            pm.close()
+            deck_content_cache.clear()
+        print(f"  {size:>9,}  {elapsed:8.2f} {peak / 1e6:8.1f}")
+
+
+def bench_durability(grades=200, every_n=10):
+    """Measure per-grade save cost (journal append + deck metadata) at each durability level."""
+    print(f"Durability levels (ms per grade, {grades} grades)")
+    scheduler = FSRS6Scheduler()
+    cards = _random_cards(grades)
+    for level in DurabilityPolicy.LEVELS:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pm = PersistenceManager(base_dir=tmpdir, compact_threshold_bytes=1 << 40,
+                                    durability=DurabilityPolicy(level, every_n))
+            deck_meta = DeckMetadata()
+            
+            def grade_all():
+                for card in cards:
+                    scheduler.schedule_card(card, False)
+                    deck_meta.increment_today_count()
+                    with pm.write_group():
+                        pm.append_reviews("bench", "deck", [pm.review_record(card, False)])
+                        pm.save_deck_metadata("bench", "deck", deck_meta)
+                pm.sync()
+            
+            elapsed = _timed(grade_all)
+        print(f"  {level:<12} {elapsed / grades * 1000:7.3f}")
+
+
+BENCHMARKS = {
+    'batch': bench_batch_scheduling,
+    'due': bench_due_index,
+    'queue': bench_practice_queue,
+    'duecheck': bench_due_check,
+    'memory': bench_card_memory,
+    'gradeio': bench_grade_io,
+    'storage': bench_storage_backends,
+    'durability': bench_durability,
+    'snapshot': bench_snapshot,
+    'import': bench_import,
+    'login': bench_login,
+    'stats': bench_stats,
+    'analytics': bench_analytics,
+    'replay': bench_replay,
+    'optimize': bench_optimize,
+    'workload': bench_workload,
+    'balance': bench_load_balance,
+    'grading': bench_bulk_grading,
+    'api': bench_api,
+}
+
+
+def main():
+    """Run the requested benchmarks."""
+    parser = argparse.ArgumentParser(description="Flashcard app benchmarks")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f"Benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
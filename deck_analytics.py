@@ -0,0 +1,108 @@
+"""
+Whole-deck memory analytics: per-card retrievability, the expected number of
+cards remembered today, and stability/difficulty/retrievability histograms.
+
+Everything is computed from the scheduling columns in one pass per column,
+using C-level iteration where the standard library allows it: a single
+comprehension for retrievability, and itertools.compress plus bytes.count
+for the histograms. That is roughly 1 s per million cards, which is still
+far more than a frame. FSRS6Scheduler.analytics therefore caches the result
+until the next grade or day rollover, and the app computes a stale result
+on a background thread (see FlashcardApp.handle_analytics).
+"""
+import math
+import time
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import compress
+from typing import Iterable, Optional
+from models import Card, CardStore, today_ordinal
+
+# Lower bounds (days) of the stability histogram bins after the first (<1 day)
+STABILITY_EDGES = (1, 2, 4, 7, 14, 30, 60, 120, 240, 365)
+STABILITY_LABELS = ('<1d', '1d', '2d', '4d', '1w', '2w', '1m', '2m', '4m', '8m', '1y+')
+# Difficulty 1-10 in unit-wide bins: [1, 2), [2, 3), ..., [9, 10]
+DIFFICULTY_EDGES = (2, 3, 4, 5, 6, 7, 8, 9)
+DIFFICULTY_LABELS = ('1', '2', '3', '4', '5', '6', '7', '8', '9')
+# Retrievability in tenths: [0, 0.1), ..., [0.9, 1.0]
+RETRIEVABILITY_BINS = 10
+
+
+@dataclass
+class DeckAnalytics:
+    """Memory analytics for a deck on one day (see analyze_deck)."""
+    today: int
+    total_cards: int
+    reviewed_cards: int  # Cards past the New state
+    retrievability: array = field(repr=False)  # Per card, by deck row; 0 for new cards
+    expected_remembered: float  # Sum of retrievability: expected recalls if all were asked
+    retrievability_histogram: list
+    stability_histogram: list
+    difficulty_histogram: list
+    seconds: float = 0.0
+    
+    @property
+    def average_retrievability(self) -> float:
+        """Mean recall probability over reviewed cards."""
+        return self.expected_remembered / self.reviewed_cards if self.reviewed_cards else 0.0
+
+
+def _counts(codes: bytes, bins: int) -> list[int]:
+    """Count the occurrences of each bin index 0..bins-1 in a byte string."""
+    return [codes.count(i) for i in range(bins)]
+
+
+def analyze_deck(cards: Iterable[Card], today: Optional[int] = None) -> DeckAnalytics:
+    """
+    Compute memory analytics for a card list or CardStore.
+    
+    Retrievability matches FSRS6Scheduler.retrievability: 0.9^(t/S) for t
+    days since the last review (never above 1), and 0 for new cards or
+    cards without a review date or stability. Histograms cover reviewed
+    cards only; a new card has no stability or difficulty of its own yet.
+    
+    Args:
+        cards: The deck
+        today: Day ordinal to evaluate retrievability on (default: today)
+    """
+    start = time.perf_counter()
+    if today is None:
+        today = today_ordinal()
+    if isinstance(cards, CardStore):
+        # Column reads; no per-card views
+        states, stabilities = cards.states, cards.stabilities
+        difficulties, last_seen = cards.difficulties, cards.last_seen
+    else:
+        rows = [(card.state, card.stability, card.difficulty, card.last_seen) for card in cards]
+        states, stabilities, difficulties, last_seen = zip(*rows) if rows else ((),) * 4
+    
+    retrievability = array('d', [
+        (0.9 ** ((today - seen) / stability) if seen < today else 1.0)
+        if state and seen and stability > 0 else 0.0
+        for state, stability, seen in zip(states, stabilities, last_seen)
+    ])
+    
+    # Bin indices as bytes so bytes.count does the tallying in C
+    recall_codes = bytes([int(r * RETRIEVABILITY_BINS)
+                          for r in compress(retrievability, states)])
+    recall_histogram = _counts(recall_codes, RETRIEVABILITY_BINS + 1)
+    reviewed_today = recall_histogram.pop()
+    recall_histogram[-1] += reviewed_today  # R = 1.0 joins the top bin
+    stability_codes = bytes(map(partial(bisect_right, STABILITY_EDGES),
+                                compress(stabilities, states)))
+    difficulty_codes = bytes(map(partial(bisect_right, DIFFICULTY_EDGES),
+                                 compress(difficulties, states)))
+    
+    return DeckAnalytics(
+        today=today,
+        total_cards=len(states),
+        reviewed_cards=len(recall_codes),
+        retrievability=retrievability,
+        expected_remembered=math.fsum(retrievability),
+        retrievability_histogram=recall_histogram,
+        stability_histogram=_counts(stability_codes, len(STABILITY_LABELS)),
+        difficulty_histogram=_counts(difficulty_codes, len(DIFFICULTY_LABELS)),
+        seconds=time.perf_counter() - start
+    )
@@ -0,0 +1,274 @@
+"""
+Streaming import of deck CSV files into a storage backend.
+
+Rows are read, validated, matched against the deck's cards and written in
+fixed-size chunks by a pipeline of generators, so memory stays bounded no
+matter how large the file is: beyond the current chunk, only an index of
+the deck's cards and a byte per card (to catch rows repeating a card) are
+held.
+"""
+import csv
+import itertools
+import os
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Optional
+from models import Card, make_card_id, parse_day
+from persistence import PersistenceManager, deck_content_cache
+
+
+# Columns every deck CSV must have (state and lastSeen are optional)
+REQUIRED_COLUMNS = ('front', 'back')
+
+# Rows written per backend call
+CHUNK_ROWS = 10_000
+
+# Cap on individually reported errors/duplicates (the counts are always exact)
+MAX_REPORTED = 100
+
+
+class DeckImportError(ValueError):
+    """Raised when a file cannot be read as a deck CSV (e.g. missing columns, not UTF-8)."""
+
+
+@dataclass
+class ImportReport:
+    """Progress and outcome of a deck import."""
+    total_bytes: int = 0
+    bytes_read: int = 0
+    rows: int = 0
+    imported: int = 0
+    error_count: int = 0
+    duplicate_count: int = 0
+    unknown_count: int = 0
+    # (line number, message) / (line number, front), first MAX_REPORTED only
+    errors: list = field(default_factory=list)
+    duplicates: list = field(default_factory=list)
+    unknown: list = field(default_factory=list)
+    
+    @property
+    def fraction(self) -> float:
+        """Share of the file read so far (0.0-1.0)."""
+        return self.bytes_read / self.total_bytes if self.total_bytes else 1.0
+    
+    def add_error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED:
+            self.errors.append((line, message))
+    
+    def add_duplicate(self, line: int, front: str):
+        self.duplicate_count += 1
+        if len(self.duplicates) < MAX_REPORTED:
+            self.duplicates.append((line, front))
+    
+    def add_unknown(self, line: int, front: str):
+        self.unknown_count += 1
+        if len(self.unknown) < MAX_REPORTED:
+            self.unknown.append((line, front))
+
+
+class DeckRows:
+    """
+    Lookup of a deck's cards by content, for matching imported rows.
+    
+    Holds a row number per card ID and one byte per card marking cards
+    already imported, so memory follows the size of the deck (already
+    loaded by the app), not of the file being imported.
+    """
+    
+    def __init__(self, rows: list[dict]):
+        """
+        Args:
+            rows: Parsed deck rows with 'id', 'front' and 'back' (see DeckContentCache)
+        """
+        self._rows = rows
+        self._index = {row['id']: i for i, row in enumerate(rows)}
+        self._imported = bytearray(len(rows))
+    
+    def match(self, front: str, back: str) -> tuple[Optional[int], bool]:
+        """
+        Find the first card with this front and back not yet imported.
+        
+        Repeated fronts are separate cards (see make_card_id), so each
+        occurrence is tried in turn.
+        
+        Returns:
+            (card ID or None, whether a matching card was already imported)
+        """
+        repeated = False
+        for occurrence in itertools.count():
+            i = self._index.get(make_card_id(front, occurrence))
+            if i is None:
+                return None, repeated
+            if self._rows[i]['back'] == back:
+                if not self._imported[i]:
+                    self._imported[i] = 1
+                    return self._rows[i]['id'], repeated
+                repeated = True
+
+
+def _lines(f, report: ImportReport) -> Iterator[str]:
+    """Decode a binary file line by line, counting bytes for progress."""
+    for number, raw in enumerate(f):
+        report.bytes_read += len(raw)
+        try:
+            line = raw.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise DeckImportError(f"Deck CSV is not UTF-8 (line {number + 1})") from e
+        yield line.lstrip('\ufeff') if number == 0 else line
+
+
+def _records(lines: Iterator[str]) -> Iterator[tuple[int, list]]:
+    """Split lines into CSV records, yielding (line number, values)."""
+    reader = csv.reader(lines)
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            raise DeckImportError(f"Deck CSV is malformed (line {reader.line_num}): {e}") from e
+        yield reader.line_num, values
+
+
+def read_deck_rows(f, report: ImportReport, deck: DeckRows) -> Iterator[Card]:
+    """
+    Parse and validate deck CSV rows one at a time.
+    
+    Each row must match a card of the deck by front and back; only its
+    progress is imported, as deck content comes from the deck itself.
+    Invalid rows, rows matching no card and rows repeating a card already
+    imported are recorded on the report and skipped.
+    
+    Args:
+        f: Deck CSV opened in binary mode
+        report: Receives progress, errors, duplicates and unknown rows
+        deck: The deck's cards
+    
+    Raises:
+        DeckImportError: If the header lacks a required column, or the file
+            is not UTF-8 or not valid CSV
+    """
+    records = _records(_lines(f, report))
+    _, header = next(records, (0, None))
+    if header is None:
+        raise DeckImportError("Deck CSV is empty")
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise DeckImportError(f"Deck CSV is missing column(s): {', '.join(missing)}")
+    front_col = header.index('front')
+    back_col = header.index('back')
+    state_col = header.index('state') if 'state' in header else None
+    seen_col = header.index('lastSeen') if 'lastSeen' in header else None
+    
+    for line, values in records:
+        if not values:
+            continue  # Blank line
+        report.rows += 1
+        if len(values) != len(header):
+            report.add_error(line, f"expected {len(header)} fields, got {len(values)}")
+            continue
+        front = values[front_col]
+        if not front:
+            report.add_error(line, "empty front")
+            continue
+        try:
+            state = int(values[state_col]) if state_col is not None and values[state_col] else 0
+            if not 0 <= state <= 3:
+                raise ValueError(f"invalid state {state}")
+            seen = values[seen_col] if seen_col is not None else ''
+            last_seen = parse_day(seen) if seen else None
+            if seen and last_seen is None:
+                raise ValueError(f"invalid lastSeen {seen!r}")
+        except ValueError as e:
+            report.add_error(line, str(e))
+            continue
+        back = values[back_col]
+        card_id, repeated = deck.match(front, back)
+        if card_id is None:
+            if repeated:
+                report.add_duplicate(line, front)
+            else:
+                report.add_unknown(line, front)
+            continue
+        yield Card(front=front, back=back, state=state, last_seen=last_seen, card_id=card_id)
+
+
+def format_report(report: ImportReport) -> str:
+    """Summarize an import for display."""
+    lines = [f"Imported {report.imported:,} of {report.rows:,} rows."]
+    if report.unknown_count:
+        line, front = report.unknown[0]
+        lines.append(f"Skipped {report.unknown_count:,} rows matching no card in the deck "
+                     f"(first on line {line}: {front!r}).")
+    if report.duplicate_count:
+        lines.append(f"Skipped {report.duplicate_count:,} rows repeating a card already "
+                     f"imported (first on line {report.duplicates[0][0]}).")
+    if report.error_count:
+        line, message = report.errors[0]
+        lines.append(f"Skipped {report.error_count:,} invalid rows "
+                     f"(first on line {line}: {message}).")
+    return "\n".join(lines)
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Group an iterable into lists of at most size items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_deck_csv(persistence: PersistenceManager, deck_path: str, csv_path: str, user: str,
+                    deck_name: str, chunk_rows: int = CHUNK_ROWS,
+                    progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+    """
+    Stream a deck CSV (front, back[, state, lastSeen]) into a user's deck.
+    
+    Each chunk of valid rows is written with one backend call: a journal
+    append for the JSON backend, one transaction for SQLite. Imported rows
+    replace any progress already saved for the same card. The journal is
+    left for the next regular save to compact.
+    
+    Args:
+        persistence: Active storage backend
+        deck_path: The deck's shared CSV, whose cards the rows must match
+        csv_path: File to import
+        user: Username
+        deck_name: Deck to import into
+        chunk_rows: Rows per write
+        progress: Called with the report after each chunk (on the calling thread)
+    
+    Returns:
+        Report of rows read, imported, rejected, unmatched and duplicated
+    
+    Raises:
+        DeckImportError: If the file cannot be read as a deck CSV; chunks
+            written before the failing line stay imported
+    """
+    report = ImportReport(total_bytes=os.path.getsize(csv_path))
+    deck = DeckRows(deck_content_cache.rows(deck_path))
+    if not persistence.user_exists(user):
+        persistence.create_user(user)
+    persistence.ensure_user_deck_dir(user, deck_name)
+    
+    with open(csv_path, 'rb') as f:
+        try:
+            for chunk in chunked(read_deck_rows(f, report, deck), chunk_rows):
+                records = [persistence.review_record(card, None) for card in chunk]
+                persistence.append_reviews(user, deck_name, records)
+                report.imported += len(chunk)
+                if progress is not None:
+                    progress(report)
+        except DeckImportError as e:
+            if not report.imported:
+                raise
+            raise DeckImportError(f"{e}; {report.imported:,} rows were imported "
+                                  f"before it") from e
+    
+    if progress is not None:
+        progress(report)
+    return report
@@ -0,0 +1,226 @@
+"""
+Binary deck snapshot format for fast startup.
+
+A snapshot holds one user's merged view of a deck (content plus progress)
+as fixed-width numeric columns followed by a string table, so it can be
+memory-mapped and served lazily: opening it reads only the header, and
+card fields are decoded from the mapped pages when they are first used.
+
+Layout (little-endian, version 2):
+    header        64 bytes, see HEADER
+    ids           count x int64 (stable card IDs)
+    stabilities   count x float64
+    difficulties  count x float64
+    intervals     count x int32
+    lapses        count x int32
+    last_seen     count x int32 (0 = never seen)
+    next_due      count x int32
+    states        count x int8
+    padding       to a multiple of 8 bytes
+    offsets       (2 * count + 1) x uint64 into the string blob; row r's
+                  front is blob[offsets[2r]:offsets[2r+1]] and its back is
+                  blob[offsets[2r+1]:offsets[2r+2]]
+    blob          UTF-8 text of every front and back
+
+The header also records a fingerprint of the source files the snapshot was
+built from, so stale snapshots can be detected without reading them.
+"""
+import mmap
+import struct
+import sys
+from array import array
+from typing import Iterable, Optional, Sequence
+from models import Card, CardStore
+
+
+MAGIC = b'FCDS'
+VERSION = 2
+
+# magic, version, reserved, count, blob size, 5-field source fingerprint
+HEADER = struct.Struct('<4sHHQQqqqqq')
+
+# (CardStore attribute, array typecode) in file order
+COLUMNS = (
+    ('ids', 'q'),
+    ('stabilities', 'd'),
+    ('difficulties', 'd'),
+    ('intervals', 'i'),
+    ('lapses', 'i'),
+    ('last_seen', 'i'),
+    ('next_due', 'i'),
+    ('states', 'b'),
+)
+
+
+def _layout(count: int) -> tuple[dict, int, int]:
+    """Get the byte offsets of each column, the string offsets and the blob."""
+    offsets = {}
+    position = HEADER.size
+    for name, code in COLUMNS:
+        offsets[name] = position
+        position += count * struct.calcsize('<' + code)
+    position += -position % 8
+    strings_offset = position
+    blob_offset = strings_offset + (2 * count + 1) * 8
+    return offsets, strings_offset, blob_offset
+
+
+def encode_snapshot(cards: Iterable[Card], source: Sequence[int] = (0, 0, 0, 0, 0)) -> bytes:
+    """
+    Serialize a deck to the snapshot format.
+    
+    Args:
+        cards: A CardStore or any iterable of cards
+        source: Fingerprint of the files the deck was loaded from
+    """
+    store = cards if isinstance(cards, CardStore) else CardStore(cards)
+    count = len(store)
+    
+    string_offsets = array('Q', [0])
+    blob = bytearray()
+    for row in range(count):
+        for text in (store.fronts[row], store.backs[row]):
+            blob += text.encode('utf-8')
+            string_offsets.append(len(blob))
+    
+    column_offsets, strings_offset, blob_offset = _layout(count)
+    data = bytearray(blob_offset + len(blob))
+    data[:HEADER.size] = HEADER.pack(MAGIC, VERSION, 0, count, len(blob), *source)
+    for name, code in COLUMNS:
+        column = array(code, getattr(store, name))
+        if sys.byteorder != 'little':
+            column.byteswap()
+        raw = column.tobytes()
+        start = column_offsets[name]
+        data[start:start + len(raw)] = raw
+    if sys.byteorder != 'little':
+        string_offsets.byteswap()
+    data[strings_offset:blob_offset] = string_offsets.tobytes()
+    data[blob_offset:] = blob
+    return bytes(data)
+
+
+def read_source(path) -> Optional[tuple]:
+    """Read the source fingerprint from a snapshot header, or None if unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    fields = HEADER.unpack(header)
+    if fields[0] != MAGIC or fields[1] != VERSION:
+        return None
+    return tuple(fields[5:])
+
+
+class _MappedStrings:
+    """Read-only sequence of strings decoded on access from the string table."""
+    
+    def __init__(self, offsets, blob, parity: int):
+        self._offsets = offsets
+        self._blob = blob
+        self._parity = parity
+    
+    def __len__(self) -> int:
+        return (len(self._offsets) - 1) // 2
+    
+    def __getitem__(self, row: int) -> str:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("string row out of range")
+        i = 2 * row + self._parity
+        return sys.intern(str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8'))
+    
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class MappedCardStore(CardStore):
+    """
+    CardStore served straight from a memory-mapped snapshot file.
+    
+    The file is mapped copy-on-write: scheduling cards updates the mapped
+    columns in memory only, and progress is persisted through the usual
+    journal. Only the pages that are touched are read from disk. The row
+    count is fixed, so cards cannot be appended.
+    """
+    
+    def __init__(self, path):
+        """
+        Map a snapshot file.
+        
+        Raises:
+            ValueError: If the file is not a snapshot of a supported version
+        """
+        self.path = path
+        self._map()
+        self.dirty_rows: set[int] = set()
+    
+    def _map(self):
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self._views = []
+        try:
+            self._map_columns()
+        except BaseException:
+            self.close()
+            raise
+    
+    def _map_columns(self):
+        if len(self._mmap) < HEADER.size:
+            raise ValueError(f"{self.path} is not a deck snapshot")
+        magic, version, _, count, blob_size, *source = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a deck snapshot")
+        if version != VERSION:
+            raise ValueError(f"Unsupported deck snapshot version {version} in {self.path}")
+        column_offsets, strings_offset, blob_offset = _layout(count)
+        if len(self._mmap) != blob_offset + blob_size:
+            raise ValueError(f"Truncated deck snapshot {self.path}")
+        self.source = tuple(source)
+        
+        for name, code in COLUMNS:
+            setattr(self, name, self._column(column_offsets[name], code, count))
+        offsets = self._column(strings_offset, 'Q', 2 * count + 1)
+        blob = self._view(blob_offset, blob_size)
+        self.fronts = _MappedStrings(offsets, blob, 0)
+        self.backs = _MappedStrings(offsets, blob, 1)
+    
+    def _view(self, offset: int, size: int) -> memoryview:
+        view = memoryview(self._mmap)[offset:offset + size]
+        self._views.append(view)
+        return view
+    
+    def _column(self, offset: int, code: str, count: int):
+        """Get a typed column over the mapping (copied only on big-endian hosts)."""
+        raw = self._view(offset, count * struct.calcsize('<' + code))
+        if sys.byteorder == 'little':
+            column = raw.cast(code)
+            self._views.append(column)
+            return column
+        column = array(code, bytes(raw))
+        column.byteswap()
+        return column
+    
+    def append(self, card: Card):
+        raise TypeError("MappedCardStore has a fixed number of rows")
+    
+    def close(self):
+        """Unmap the file. Views and cards from this store must not be used afterwards."""
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        self._mmap.close()
+    
+    def reopen(self):
+        """
+        Map the file again after it was replaced by a snapshot of the same rows.
+        
+        Views taken from the store stay valid; dirty rows are kept.
+        """
+        self.close()
+        self._map()
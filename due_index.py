@@ -0,0 +1,162 @@
+"""
+Due-date index for fast "what's due now" queries.
+
+Cards are filed into day buckets keyed by the date ordinal of their next
+review. A min-heap over the bucket days lets due queries visit only the
+buckets that are due, so non-due cards are never touched.
+"""
+import heapq
+from array import array
+from collections import Counter
+from typing import Optional
+from models import Card, CardStore, due_forecast, today_ordinal
+
+
+class DueIndex:
+    """Bucketed calendar of card rows keyed by next-review day."""
+    
+    def __init__(self, cards: list[Card]):
+        """
+        Build the index over a deck.
+        
+        Args:
+            cards: The deck's card list or CardStore. The index keeps a
+                   reference to it and stores row positions, so the deck
+                   must not be reordered.
+        """
+        self.cards = cards
+        if isinstance(cards, CardStore):
+            # Views already know their row; no lookup table needed
+            self._rows = None
+            self._days = array('l', cards.next_due)
+        else:
+            self._rows = {id(card): row for row, card in enumerate(cards)}
+            self._days = array('l', (self.due_day(card) for card in cards))
+        self._buckets: dict[int, dict[int, None]] = {}
+        for row, day in enumerate(self._days):
+            self._buckets.setdefault(day, {})[row] = None
+        self._heap = list(self._buckets)
+        heapq.heapify(self._heap)
+    
+    @staticmethod
+    def due_day(card: Card) -> int:
+        """Get the date ordinal on which a card becomes due."""
+        return card.next_due_day
+    
+    def __len__(self) -> int:
+        return len(self._days)
+    
+    def __contains__(self, card: Card) -> bool:
+        """Check whether a card is one of the indexed deck's cards. O(1)."""
+        return self._row_of(card) is not None
+    
+    def covers(self, cards: list[Card]) -> bool:
+        """
+        Check whether this index was built for the given card list.
+        
+        Cards appended to the list after indexing are not in the buckets,
+        so a list that has grown is no longer covered.
+        """
+        return cards is self.cards and len(cards) == len(self._days)
+    
+    def update(self, card: Card) -> bool:
+        """
+        Re-file a card after its schedule changed. O(log n).
+        
+        Returns:
+            True if the card belongs to this index, False otherwise
+        """
+        row = self._row_of(card)
+        if row is None:
+            return False
+        
+        old_day = self._days[row]
+        new_day = self.due_day(card)
+        if new_day == old_day:
+            return True
+        
+        old_bucket = self._buckets[old_day]
+        del old_bucket[row]
+        if not old_bucket:
+            # Stale heap entry is skipped lazily
+            del self._buckets[old_day]
+        
+        new_bucket = self._buckets.get(new_day)
+        if new_bucket is None:
+            new_bucket = self._buckets[new_day] = {}
+            heapq.heappush(self._heap, new_day)
+        new_bucket[row] = None
+        self._days[row] = new_day
+        
+        if len(self._heap) > 2 * len(self._buckets) + 64:
+            self._heap = list(self._buckets)
+            heapq.heapify(self._heap)
+        return True
+    
+    def _row_of(self, card: Card) -> Optional[int]:
+        """Get a card's row in the indexed deck, or None if not indexed."""
+        if self._rows is None:
+            return card.row if getattr(card, 'store', None) is self.cards else None
+        return self._rows.get(id(card))
+    
+    def _due_days(self, today: int) -> list[int]:
+        """Get the bucket days that are due, walking only due heap nodes."""
+        heap = self._heap
+        buckets = self._buckets
+        while heap and heap[0] not in buckets:
+            heapq.heappop(heap)
+        
+        days = []
+        seen = set()
+        stack = [0] if heap else []
+        while stack:
+            i = stack.pop()
+            day = heap[i]
+            if day > today:
+                continue  # Heap property: whole subtree is later
+            if day in buckets and day not in seen:
+                seen.add(day)
+                days.append(day)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    stack.append(child)
+        return days
+    
+    def count_on(self, day: int) -> int:
+        """Count cards falling due on exactly one day. O(1)."""
+        bucket = self._buckets.get(day)
+        return len(bucket) if bucket is not None else 0
+    
+    def day_counts(self) -> Counter:
+        """Count the cards falling due on each day ordinal."""
+        return Counter({day: len(rows) for day, rows in self._buckets.items()})
+    
+    def due_count(self, today: Optional[int] = None) -> int:
+        """Count cards due on the given day (default: today)."""
+        if today is None:
+            today = today_ordinal()
+        return sum(len(self._buckets[day]) for day in self._due_days(today))
+    
+    def due_rows(self, today: Optional[int] = None) -> list[int]:
+        """Get the deck rows of cards due on the given day (default: today), sorted."""
+        if today is None:
+            today = today_ordinal()
+        rows = []
+        for day in self._due_days(today):
+            rows.extend(self._buckets[day])
+        rows.sort()
+        return rows
+    
+    def due_cards(self, today: Optional[int] = None) -> list[Card]:
+        """Get cards due on the given day (default: today), in deck order."""
+        cards = self.cards
+        return [cards[row] for row in self.due_rows(today)]
+    
+    def forecast(self, days: int, today: Optional[int] = None) -> list[int]:
+        """
+        Count cards falling due on each of the next days (see due_forecast).
+        
+        O(days + buckets): only bucket sizes are read, never the cards.
+        """
+        return due_forecast(((day, len(rows)) for day, rows in self._buckets.items()),
+                            days, today)
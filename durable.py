@@ -0,0 +1,169 @@
+"""
+Crash-safe file writing shared by the persistence layer and user settings.
+
+Whole-file writes go to a temporary file that atomically replaces the
+target, so a crash leaves either the old or the new contents, never a
+truncated file. Several writes can be grouped so they share one sync
+barrier, and a DurabilityPolicy decides how often that barrier is paid.
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Union
+
+
+def _fsync_directory(directory: Path):
+    """Persist a directory entry change (rename/create). No-op where unsupported."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path: Union[str, Path], data: bytes, sync: bool = True):
+    """Atomically replace a file's contents, optionally waiting for the disk."""
+    with WriteGroup(sync=sync) as group:
+        group.write(path, data)
+
+
+class WriteGroup:
+    """
+    A set of file writes that become visible together after one barrier.
+    
+    Whole-file writes are staged in temporary files and renamed over their
+    targets only after every staged and appended file has been written (and
+    fsynced when sync is on). Each affected directory is fsynced once for
+    the whole group. Used as a context manager, the group commits on success
+    and discards staged files on error.
+    """
+    
+    def __init__(self, sync: bool = True):
+        self.sync = sync
+        self._staged: list[tuple[Path, Path]] = []
+        self._directories: set[Path] = set()
+        self._after_commit: list[Callable[[], None]] = []
+        self.paths: set[Path] = set()
+        self.bytes_written = 0
+        self.fsync_count = 0
+    
+    def _fsync_file(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+        self.fsync_count += 1
+    
+    def write(self, path: Union[str, Path], data: bytes):
+        """Stage a whole-file write."""
+        path = Path(path)
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                if self.sync:
+                    self._fsync_file(f)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        # A later write to the same file in this group replaces the earlier one
+        self._staged = [(temp, target) for temp, target in self._staged if target != path]
+        self._staged.append((temp_path, path))
+        self.paths.add(path)
+        self._directories.add(path.parent)
+        self.bytes_written += len(data)
+    
+    def append(self, path: Union[str, Path], data: bytes):
+        """Append to a file (appends are visible immediately)."""
+        path = Path(path)
+        with open(path, 'ab') as f:
+            f.write(data)
+            if self.sync:
+                self._fsync_file(f)
+        self.paths.add(path)
+        self._directories.add(path.parent)
+        self.bytes_written += len(data)
+    
+    def after_commit(self, callback: Callable[[], None]):
+        """Run a callback once the group's writes are in place."""
+        self._after_commit.append(callback)
+    
+    def commit(self):
+        """Rename staged files into place and persist the directory entries."""
+        staged, self._staged = self._staged, []
+        for temp_path, path in staged:
+            os.replace(temp_path, path)
+        if self.sync:
+            for directory in self._directories:
+                _fsync_directory(directory)
+                self.fsync_count += 1
+        self._directories.clear()
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
+    
+    def abort(self):
+        """Discard staged files."""
+        staged, self._staged = self._staged, []
+        for temp_path, _ in staged:
+            temp_path.unlink(missing_ok=True)
+        self._after_commit.clear()
+    
+    def __enter__(self) -> 'WriteGroup':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+
+def sync_paths(paths):
+    """fsync existing files and, once each, their directories."""
+    directories = set()
+    for path in paths:
+        path = Path(path)
+        try:
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            continue
+        directories.add(path.parent)
+    for directory in directories:
+        _fsync_directory(directory)
+
+
+class DurabilityPolicy:
+    """
+    How often saves wait for data to reach the disk.
+    
+    Writes are always atomic; the level only controls fsync frequency:
+        every_grade: every logical save is synced (safest, slowest)
+        every_n:     every Nth logical save is synced
+        session_end: only explicit syncs (session end, window close)
+    """
+    EVERY_GRADE = 'every_grade'
+    EVERY_N = 'every_n'
+    SESSION_END = 'session_end'
+    LEVELS = (EVERY_GRADE, EVERY_N, SESSION_END)
+    
+    def __init__(self, level: str = EVERY_GRADE, every_n: int = 10):
+        if level not in self.LEVELS:
+            raise ValueError(f"Unknown durability level '{level}' (expected one of {self.LEVELS})")
+        self.level = level
+        self.every_n = max(1, every_n)
+        self._saves = 0
+    
+    def next_save_syncs(self) -> bool:
+        """Count a logical save and say whether it should be synced."""
+        self._saves += 1
+        if self.level == self.EVERY_GRADE:
+            return True
+        if self.level == self.EVERY_N:
+            return self._saves % self.every_n == 0
+        return False
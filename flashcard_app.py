@@ -3,22 +3,51 @@
 Japanese Flashcard Application with FSRS-6 Scheduler
 Main entry point for the application.
 """
+import argparse
+import os
+import queue
+import threading
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import filedialog, messagebox
 import sys
 from pathlib import Path
+from typing import Optional
 
-from models import Card, DeckMetadata
+from deck_import import DeckImportError, format_report, import_deck_csv
+from deck_snapshot import MappedCardStore
+from durable import DurabilityPolicy
+from grading import GradeReport, GradingError, grade_many, read_results
+from models import Card, DeckHeader, DeckMetadata
 from fsrs import FSRS6Scheduler
 from persistence import PersistenceManager
+from sqlite_persistence import DEFAULT_DB_PATH, SqlitePersistenceManager
 from user_settings import UserSettings
-from gui import LoginScreen, MainMenu, PracticeView, StatsView
+from workload import simulate_workload
+from write_behind import WriteBehindSaver
+from gui import ImportProgressDialog, LoginScreen, MainMenu, PracticeView, StatsView
+
+
+def open_persistence(durability: Optional[DurabilityPolicy] = None) -> PersistenceManager:
+    """Open the active storage backend (SQLite once data has been migrated into it)."""
+    if Path(DEFAULT_DB_PATH).exists():
+        return SqlitePersistenceManager(DEFAULT_DB_PATH, durability=durability)
+    return PersistenceManager(durability=durability)
 
 
 class FlashcardApp:
     """Main application controller."""
     
-    def __init__(self):
+    # How often the Tk loop checks for background save errors
+    SAVE_ERROR_POLL_MS = 250
+    # How often the Tk loop checks on a running import or workload projection
+    IMPORT_POLL_MS = 100
+    # Workload projections simulate this many days, averaged over this many trials
+    PROJECTION_DAYS = 30
+    PROJECTION_TRIALS = 20
+    # Days of upcoming due load charted on the stats screen
+    FORECAST_DAYS = 30
+    
+    def __init__(self, durability: Optional[DurabilityPolicy] = None, lazy_load: bool = True):
         self.root = tk.Tk()
         self.root.title("Japanese Flashcard App - FSRS-6")
         self.root.geometry("700x600")
@@ -29,15 +58,23 @@ class FlashcardApp:
         
         # Initialize components
         self.scheduler = FSRS6Scheduler()
-        self.persistence = PersistenceManager()
+        self.persistence = open_persistence(durability)
         self.settings: UserSettings = None
         
+        # Reviews are written by a background worker, off the Tk thread
+        self.saver = WriteBehindSaver(self.persistence)
+        self.root.protocol("WM_DELETE_WINDOW", self.handle_close)
+        self.root.after(self.SAVE_ERROR_POLL_MS, self._poll_save_errors)
+        
         # Application state
         self.current_user: str = None
         self.deck_name = "hiragana"
         self.csv_path = "hiragana.csv"
-        self.cards: list[Card] = []
+        self.cards: Optional[list[Card]] = None  # None until hydrated
         self.deck_metadata: DeckMetadata = None
+        self.deck_header: Optional[DeckHeader] = None
+        # Read only the deck header at login and load cards on first use
+        self.lazy_load = lazy_load
         
         # Current view
         self.current_view = None
@@ -72,15 +109,80 @@ class FlashcardApp:
         intensity = self.settings.effective_intensity()
         retention = self.settings.request_retention
         self.scheduler.set_intensity(intensity, retention)
+        # Constants fitted to this user's history, if optimizer.py has run
+        self.scheduler.load_parameters(self.settings.params_file)
+        self.scheduler.load_balance = self.settings.load_balance
         
-        # Load deck
-        self.load_deck()
+        # Load deck (just its header when one is up to date)
+        self.load_deck_summary()
         
         # Show main menu
         self.show_main_menu()
     
+    def load_deck_summary(self):
+        """Read what the main menu needs; cards are loaded when first used."""
+        try:
+            self.deck_metadata = self.persistence.load_deck_metadata(
+                self.current_user,
+                self.deck_name
+            )
+            self.deck_header = None
+            if self.lazy_load:
+                self.deck_header = self.persistence.load_deck_header(
+                    self.csv_path,
+                    self.current_user,
+                    self.deck_name
+                )
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load deck: {e}")
+            sys.exit(1)
+        
+        self.close_cards()
+        if self.deck_header is None:
+            # No usable header (first login or a crash): load everything now
+            self.load_deck()
+    
+    def ensure_cards(self):
+        """Hydrate the deck's cards on first use (the practice queue)."""
+        if self.cards is not None:
+            return
+        try:
+            # Memory-mapped: only the rows that are touched are decoded
+            self.cards = self.persistence.open_deck_snapshot(
+                self.csv_path,
+                self.current_user,
+                self.deck_name
+            )
+            # The header's statistics describe the same saved data
+            self.scheduler.index_cards(self.cards, self.deck_header.stats)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load deck: {e}")
+            sys.exit(1)
+    
+    def save_deck_summary(self):
+        """Refresh the deck header and snapshot so the next login skips loading cards."""
+        if self.cards is None:
+            return  # Nothing changed since the header was written
+        try:
+            self.persistence.wait_for_compaction(self.current_user, self.deck_name)
+            with self.persistence.write_group():
+                self.persistence.save_deck_snapshot(
+                    self.csv_path, self.current_user, self.deck_name, self.cards)
+                self.persistence.save_deck_header(
+                    self.csv_path, self.current_user, self.deck_name, self.cards)
+        except OSError as e:
+            # Only a startup-time cache; the next login rebuilds it
+            print(f"Warning: could not save the deck summary: {e}", file=sys.stderr)
+    
+    def close_cards(self):
+        """Release the deck's cards (unmapping a snapshot-backed store)."""
+        if isinstance(self.cards, MappedCardStore):
+            self.cards.close()
+        self.cards = None
+    
     def load_deck(self):
-        """Load the deck from CSV and metadata."""
+        """Load the deck from CSV and metadata, releasing any cards already loaded."""
+        self.close_cards()
         try:
             self.cards = self.persistence.load_deck_from_csv(
                 self.csv_path, 
@@ -91,14 +193,15 @@ class FlashcardApp:
                 self.current_user, 
                 self.deck_name
             )
+            self.scheduler.index_cards(self.cards)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to load deck: {e}")
             sys.exit(1)
     
     def save_deck(self):
-        """Save the deck and metadata."""
+        """Save the user's progress (the shared deck CSV is never rewritten)."""
         try:
-            # Save card metadata
+            # Save card metadata (only cards changed since the last save)
             self.persistence.save_card_metadata(
                 self.current_user, 
                 self.deck_name, 
@@ -106,14 +209,12 @@ class FlashcardApp:
             )
             
             # Save deck metadata
-            self.persistence.save_deck_metadata(
-                self.current_user, 
-                self.deck_name, 
-                self.deck_metadata
-            )
-            
-            # Save CSV (optional, updates state and lastSeen)
-            self.persistence.save_deck_to_csv(self.csv_path, self.cards)
+            if self.deck_metadata.dirty:
+                self.persistence.save_deck_metadata(
+                    self.current_user, 
+                    self.deck_name, 
+                    self.deck_metadata
+                )
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save deck: {e}")
     
@@ -122,25 +223,31 @@ class FlashcardApp:
         if self.current_view:
             self.current_view.destroy()
         
-        due_cards = len(self.scheduler.get_due_cards(self.cards))
+        if self.cards is None:
+            due_cards = self.deck_header.due_count()
+            total_cards = self.deck_header.total_cards
+        else:
+            due_cards = self.scheduler.count_due_cards(self.cards)
+            total_cards = len(self.cards)
         
         self.current_view = MainMenu(
             self.root,
             username=self.current_user,
             on_practice=self.show_practice_view,
             on_stats=self.show_stats_view,
+            on_import=self.handle_import,
+            on_grade_results=self.handle_grade_results,
             deck_metadata=self.deck_metadata,
-            total_cards=len(self.cards),
+            total_cards=total_cards,
             due_cards=due_cards
         )
     
     def show_practice_view(self):
         """Display the practice view."""
-        # Get due cards
-        due_cards = self.scheduler.get_due_cards(self.cards)
+        self.ensure_cards()
         
         # Check daily limit
-        if not due_cards:
+        if not self.scheduler.count_due_cards(self.cards):
             messagebox.showinfo("No Cards Due", 
                               "No cards are due for review right now!")
             return
@@ -153,13 +260,21 @@ class FlashcardApp:
             )
             if response:
                 self.deck_metadata.allow_over_limit_today = True
+                self.deck_metadata.dirty = True
             else:
                 return
         
-        # Limit cards to review based on daily limit
+        # Limit cards to review based on daily limit, keeping the ones
+        # closest to being forgotten rather than the first rows in the deck
+        limit = None
         remaining = self.deck_metadata.max_per_day - self.deck_metadata.get_today_count()
         if remaining > 0 and not self.deck_metadata.allow_over_limit_today:
-            due_cards = due_cards[:remaining]
+            limit = remaining
+        due_cards = self.scheduler.practice_queue(
+            self.cards, limit,
+            ordering=self.settings.practice_order,
+            new_ratio=self.settings.new_card_ratio
+        )
         
         if self.current_view:
             self.current_view.destroy()
@@ -179,29 +294,92 @@ class FlashcardApp:
         # Increment daily count
         self.deck_metadata.increment_today_count()
         
-        # Save after each card
-        self.save_deck()
+        # Queue the review; the background saver journals it
+        self.saver.record_review(
+            self.current_user,
+            self.deck_name,
+            card,
+            grade_again,
+            self.deck_metadata,
+            params=self.scheduler.log_parameters()
+        )
+    
+    def grade_many(self, grades) -> GradeReport:
+        """
+        Apply many graded reviews (card_id, grade_again, timestamp) at once.
+        
+        Raises:
+            GradingError: If a grade is invalid; nothing is changed
+            OSError: If queued or new progress cannot be saved
+        """
+        # Queued single grades must be journaled before the batch
+        if not self.saver.flush():
+            raise OSError("Pending progress could not be saved")
+        self.ensure_cards()
+        return grade_many(self.persistence, self.scheduler, self.cards, self.current_user,
+                          self.deck_name, grades, self.deck_metadata)
+    
+    def handle_grade_results(self):
+        """Apply a CSV of graded results (e.g. an offline session) to the deck."""
+        path = filedialog.askopenfilename(
+            title="Import Results",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*")]
+        )
+        if not path:
+            return
+        try:
+            report = self.grade_many(read_results(path))
+        except GradingError as e:
+            messagebox.showerror("Import Failed", f"Nothing was graded: {e}")
+            return
+        except OSError as e:
+            messagebox.showerror("Import Failed", f"Failed to save the results: {e}")
+            return
+        self.show_main_menu()
+        messagebox.showinfo("Import Complete",
+                            f"Graded {report.grades:,} reviews of {report.cards:,} cards "
+                            f"({report.again:,} Again).")
     
     def handle_practice_done(self):
         """Handle completion of practice session."""
+        self.saver.flush()
+        self.save_deck()
+        self.persistence.sync()
         messagebox.showinfo("Session Complete", 
                           "Great job! You've completed this practice session.")
         self.show_main_menu()
     
     def show_stats_view(self):
-        """Display the statistics view."""
+        """Display the statistics view (from running totals; cards are not loaded)."""
         if self.current_view:
             self.current_view.destroy()
         
+        if self.cards is None:
+            deck_stats = self.deck_header.stats
+            forecast = self.deck_header.forecast(self.FORECAST_DAYS)
+        else:
+            deck_stats = self.scheduler.deck_stats
+            forecast = self.scheduler.forecast(self.cards, self.FORECAST_DAYS)
+        
+        analytics = None
+        if self.cards is not None:
+            analytics = self.scheduler.cached_analytics(self.cards)
+        
         self.current_view = StatsView(
             self.root,
-            cards=self.cards,
+            deck_stats=deck_stats,
             deck_metadata=self.deck_metadata,
             scheduler=self.scheduler,
             settings=self.settings,
             on_back=self.show_main_menu,
-            on_intensity_changed=self.handle_intensity_changed
+            on_intensity_changed=self.handle_intensity_changed,
+            on_project_load=self.handle_project_load,
+            forecast=forecast,
+            analytics=analytics
         )
+        if analytics is None:
+            # Let the screen draw before loading cards and starting the pass
+            self.root.after_idle(self.handle_analytics, self.current_view)
     
     def handle_intensity_changed(self):
         """Handle intensity change from settings."""
@@ -213,19 +391,203 @@ class FlashcardApp:
         # Return to main menu
         self.show_main_menu()
     
+    def handle_project_load(self, intensity: float):
+        """Simulate the daily workload at an intensity on a background thread."""
+        self.ensure_cards()
+        params = self.scheduler.log_parameters()
+        scheduler = FSRS6Scheduler.from_log_parameters([intensity, *params[1:]])
+        scheduler.load_balance = self.scheduler.load_balance
+        view = self.current_view
+        results = queue.Queue()
+        
+        def run():
+            # No practice session runs while the stats screen is shown, so the
+            # cards do not change under the simulation; one process keeps the
+            # Tk process from being forked
+            results.put(simulate_workload(
+                self.cards, scheduler, days=self.PROJECTION_DAYS,
+                trials=self.PROJECTION_TRIALS, max_per_day=self.deck_metadata.max_per_day,
+                ordering=self.settings.practice_order, new_ratio=self.settings.new_card_ratio,
+                processes=1))
+        
+        threading.Thread(target=run, name="workload", daemon=True).start()
+        self.root.after(self.IMPORT_POLL_MS, self._poll_projection, view, results)
+    
+    def _poll_projection(self, view: StatsView, results: queue.Queue):
+        """Show a finished projection if its stats screen is still open."""
+        if results.empty():
+            self.root.after(self.IMPORT_POLL_MS, self._poll_projection, view, results)
+        elif self.current_view is view:
+            view.show_projection(results.get_nowait())
+    
+    def handle_analytics(self, view: StatsView):
+        """Compute deck analytics on a background thread for an open stats screen."""
+        if self.current_view is not view:
+            return
+        self.ensure_cards()
+        results = queue.Queue()
+        
+        def run():
+            # No grading happens while the stats screen is open; if one did,
+            # the revision read before the pass would just mark this stale
+            results.put(self.scheduler.analytics(self.cards))
+        
+        threading.Thread(target=run, name="analytics", daemon=True).start()
+        self.root.after(self.IMPORT_POLL_MS, self._poll_analytics, view, results)
+    
+    def _poll_analytics(self, view: StatsView, results: queue.Queue):
+        """Show finished analytics if their stats screen is still open."""
+        if results.empty():
+            self.root.after(self.IMPORT_POLL_MS, self._poll_analytics, view, results)
+        elif self.current_view is view:
+            view.show_analytics(results.get_nowait())
+    
+    def handle_import(self):
+        """Import progress from a deck CSV on a background thread."""
+        path = filedialog.askopenfilename(
+            title="Import Progress",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*")]
+        )
+        if not path:
+            return
+        # Queued grades must land before the imported rows replace them
+        if not self.saver.flush():
+            messagebox.showerror("Error", "Pending progress could not be saved; try again.")
+            return
+        
+        dialog = ImportProgressDialog(self.root, os.path.basename(path))
+        updates = queue.Queue()
+        
+        def run():
+            imported = 0
+            
+            def relay(report):
+                nonlocal imported
+                imported = report.imported
+                updates.put(('progress', report.fraction, report.imported))
+            
+            try:
+                report = import_deck_csv(
+                    self.persistence, self.csv_path, path, self.current_user, self.deck_name,
+                    progress=relay
+                )
+                updates.put(('done', report))
+            except (OSError, DeckImportError) as e:
+                updates.put(('error', e, imported))
+        
+        threading.Thread(target=run, name="deck-import", daemon=True).start()
+        self.root.after(self.IMPORT_POLL_MS, self._poll_import, dialog, updates)
+    
+    def _poll_import(self, dialog: ImportProgressDialog, updates: queue.Queue):
+        """Relay import progress to the dialog on the Tk thread."""
+        while not updates.empty():
+            kind, *values = updates.get_nowait()
+            if kind == 'progress':
+                dialog.update_progress(*values)
+                continue
+            dialog.destroy()
+            if kind == 'error':
+                error, imported = values
+                if imported:
+                    # Chunks written before the failure are saved; show them
+                    self.load_deck()
+                    self.show_main_menu()
+                messagebox.showerror("Import Failed", str(error))
+            else:
+                self.load_deck()
+                self.show_main_menu()
+                messagebox.showinfo("Import Complete", format_report(values[0]))
+            return
+        self.root.after(self.IMPORT_POLL_MS, self._poll_import, dialog, updates)
+    
+    def _poll_save_errors(self):
+        """Report background save failures on the Tk thread."""
+        errors = []
+        while not self.saver.errors.empty():
+            errors.append(self.saver.errors.get_nowait())
+        if errors:
+            messagebox.showerror("Error", f"Failed to save progress: {errors[-1]}\n\n"
+                                 "The app will keep retrying.")
+        self.root.after(self.SAVE_ERROR_POLL_MS, self._poll_save_errors)
+    
+    def handle_close(self):
+        """Flush pending progress before closing the window."""
+        if not self.saver.flush():
+            if not messagebox.askyesno(
+                "Unsaved Progress",
+                "Some progress could not be saved.\n\nQuit anyway?"
+            ):
+                return
+        # The summary must match saved progress, so skip it if saving failed
+        if self.saver.close() and self.current_user:
+            self.save_deck_summary()
+        self.close_cards()
+        self.persistence.sync()
+        self.root.destroy()
+    
     def run(self):
         """Run the application."""
         self.root.mainloop()
 
 
+def export_progress(username: str, output_path: str):
+    """Export a user's merged deck (content plus progress) to a CSV file."""
+    persistence = open_persistence()
+    if not persistence.user_exists(username):
+        print(f"Error: unknown user '{username}'")
+        sys.exit(1)
+    count = persistence.export_deck_csv("hiragana.csv", username, "hiragana", output_path)
+    print(f"Exported {count} cards for {username} to {output_path}")
+
+
+def import_progress(username: str, input_path: str):
+    """Stream a deck CSV with progress into a user's deck, printing progress."""
+    persistence = open_persistence()
+    
+    def show(report):
+        print(f"\rImporting... {report.fraction:4.0%} ({report.imported:,} rows)",
+              end='', flush=True)
+    
+    try:
+        report = import_deck_csv(persistence, "hiragana.csv", input_path, username, "hiragana",
+                                 progress=show)
+    except (OSError, DeckImportError) as e:
+        print(f"\nError: {e}")
+        sys.exit(1)
+    print()
+    print(format_report(report))
+
+
 def main():
     """Main entry point."""
+    parser = argparse.ArgumentParser(description="Japanese Flashcard App - FSRS-6")
+    parser.add_argument('--export', nargs=2, metavar=('USER', 'OUTPUT_CSV'),
+                        help="Export a user's deck with progress to a CSV file and exit")
+    parser.add_argument('--import', dest='import_csv', nargs=2, metavar=('USER', 'INPUT_CSV'),
+                        help="Import progress for a user from a deck CSV and exit")
+    parser.add_argument('--durability', choices=DurabilityPolicy.LEVELS,
+                        default=DurabilityPolicy.EVERY_GRADE,
+                        help="How often saves are synced to disk (default: every_grade)")
+    parser.add_argument('--sync-every', type=int, default=10, metavar='N',
+                        help="Grades per sync with --durability every_n (default: 10)")
+    parser.add_argument('--eager-load', action='store_true',
+                        help="Load every card at login instead of on first use")
+    args = parser.parse_args()
+    
     # Check if hiragana.csv exists
     if not Path("hiragana.csv").exists():
         print("Error: hiragana.csv not found in current directory")
         sys.exit(1)
     
-    app = FlashcardApp()
+    if args.export:
+        export_progress(*args.export)
+        return
+    if args.import_csv:
+        import_progress(*args.import_csv)
+        return
+    
+    app = FlashcardApp(DurabilityPolicy(args.durability, args.sync_every),
+                       lazy_load=not args.eager_load)
     app.run()
 
 
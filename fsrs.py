@@ -2,14 +2,24 @@
 FSRS-6 (Free Spaced Repetition Scheduler) implementation.
 Simplified for binary grading (Again/Good).
 """
+import json
 import math
-from datetime import datetime, timedelta
-from models import Card
+from collections import Counter
+from typing import Callable, Optional
+from models import Card, DeckStats, due_forecast, today_ordinal
+from deck_analytics import DeckAnalytics, analyze_deck
+from due_index import DueIndex
+from practice_queue import build_queue
 
 
 class FSRS6Scheduler:
     """FSRS-6 scheduler with binary grading."""
     
+    # Constants a per-user fit can replace (see optimizer.py)
+    FITTED_PARAMETERS = ('initial_stability_again', 'initial_stability_good',
+                         'stability_factor_again', 'stability_factor_good',
+                         'difficulty_decay', 'difficulty_increase')
+    
     # FSRS-6 parameters (simplified default values)
     def __init__(self, intensity: float = 5.0, request_retention: float = 0.9):
         """
@@ -44,6 +54,22 @@ class FSRS6Scheduler:
         # Stability increase factors
         self.stability_factor_good = 2.5
         self.stability_factor_again = 0.5
+        
+        # True once apply_parameters has replaced the constants above
+        self.parameters_fitted = False
+        
+        # Spread intervals over a fuzz window to flatten the daily review
+        # load (see balance_interval); needs a due-date histogram
+        self.load_balance = False
+        
+        # Optional due-date index and statistics for one deck, kept current
+        # by schedule_card (see index_cards)
+        self.due_index: Optional[DueIndex] = None
+        self.deck_stats: Optional[DeckStats] = None
+        
+        # Bumped by every grade so cached analytics know when to recompute
+        self.revision = 0
+        self._analytics: Optional[tuple] = None  # (cards, revision, DeckAnalytics)
     
     def _calculate_stability_growth(self, intensity: float) -> float:
         """
@@ -113,7 +139,79 @@ class FSRS6Scheduler:
             'diffAdjust': self.diffAdjust,
             'request_retention': self.request_retention
         }
+    
+    def fitted_parameters(self) -> dict:
+        """Get the constants that a per-user fit can replace."""
+        return {name: getattr(self, name) for name in self.FITTED_PARAMETERS}
+    
+    def apply_parameters(self, params: dict):
+        """
+        Replace scheduler constants with fitted values.
+        
+        Raises:
+            ValueError: If a name is unknown or a value is out of range
+        """
+        for name, value in params.items():
+            if name not in self.FITTED_PARAMETERS:
+                raise ValueError(f"Unknown scheduler parameter '{name}'")
+            if name == 'difficulty_decay' and not value < 0:
+                raise ValueError("difficulty_decay must be negative")
+            if name != 'difficulty_decay' and not value > 0:
+                raise ValueError(f"{name} must be positive")
+        for name, value in params.items():
+            setattr(self, name, float(value))
+        self.parameters_fitted = True
+    
+    def load_parameters(self, path) -> bool:
+        """
+        Apply a parameter file written by optimizer.py, if there is one.
+        
+        Returns:
+            True if fitted parameters were applied
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.apply_parameters(json.load(f)['parameters'])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError, ValueError):
+            return False
+        return True
+    
+    def log_parameters(self) -> list:
+        """
+        Get the parameters recorded with each review so it can be replayed.
         
+        The layout is [intensity, request_retention, *fitted parameters],
+        the fitted ones only when fitted or load balancing. With load
+        balancing a trailing 1 follows: balanced intervals depend on the
+        rest of the deck, so a replay can only check them against the fuzz
+        window (see logged_load_balance).
+        """
+        params = [self.intensity, self.request_retention]
+        if self.parameters_fitted or self.load_balance:
+            params.extend(getattr(self, name) for name in self.FITTED_PARAMETERS)
+        if self.load_balance:
+            params.append(1)
+        return params
+    
+    @classmethod
+    def logged_load_balance(cls, params: Optional[list]) -> bool:
+        """Check whether log_parameters() output was logged with load balancing on."""
+        return (params is not None and len(params) > 2 + len(cls.FITTED_PARAMETERS)
+                and bool(params[-1]))
+    
+    @classmethod
+    def from_log_parameters(cls, params: Optional[list]) -> 'FSRS6Scheduler':
+        """Create a scheduler from log_parameters() output (None: the defaults)."""
+        if params is None:
+            return cls()
+        intensity, request_retention, *fitted = params
+        scheduler = cls(intensity, request_retention)
+        if len(fitted) > len(cls.FITTED_PARAMETERS):
+            scheduler.load_balance = bool(fitted.pop())
+        if fitted:
+            scheduler.apply_parameters(dict(zip(cls.FITTED_PARAMETERS, fitted)))
+        return scheduler
+    
     def calculate_interval(self, stability: float) -> int:
         """Calculate interval in days based on stability and retention."""
         if stability <= 0:
@@ -123,6 +221,40 @@ class FSRS6Scheduler:
         interval = stability * (math.log(self.request_retention) / math.log(0.9))
         return max(1, int(round(interval)))
     
+    @staticmethod
+    def fuzz_window(interval: int) -> tuple[int, int]:
+        """
+        Get the range of intervals the load balancer may choose for a target.
+        
+        Widths follow Anki's fuzz: one day, plus 15% of the part of the
+        interval between 2.5 and 7 days, 10% of the part between 7 and 20,
+        and 5% beyond that. Intervals under 3 days are never moved.
+        """
+        if interval < 3:
+            return interval, interval
+        delta = (1.0 + 0.15 * (min(interval, 7) - 2.5) + 0.1 * max(0, min(interval, 20) - 7)
+                 + 0.05 * max(0, interval - 20))
+        return max(2, int(round(interval - delta))), int(round(interval + delta))
+    
+    def balance_interval(self, interval: int, today: int,
+                         due_on: Callable[[int], int]) -> int:
+        """
+        Move an interval within its fuzz window to the least loaded due day.
+        
+        Cards learned together would otherwise all come due on the same day.
+        Ties go to the day nearest the target, then the earlier one.
+        
+        Args:
+            interval: Target interval from calculate_interval
+            today: Day ordinal of the review
+            due_on: Number of cards already due on a given day ordinal
+        """
+        low, high = self.fuzz_window(interval)
+        if low == high:
+            return interval
+        return min(range(low, high + 1),
+                   key=lambda days: (due_on(today + days), abs(days - interval), days))
+    
     def update_difficulty(self, current_difficulty: float, grade_again: bool) -> float:
         """
         Update difficulty based on grade.
@@ -168,17 +300,25 @@ class FSRS6Scheduler:
                 base_multiplier = self.stability_factor_good * (difficulty_factor / 10)
                 return current_stability * base_multiplier / self.stabilityGrowth
     
-    def schedule_card(self, card: Card, grade_again: bool) -> Card:
+    def schedule_card(self, card: Card, grade_again: bool,
+                      today: Optional[int] = None) -> Card:
         """
         Schedule a card based on binary grade.
         
         Args:
             card: The card to schedule
             grade_again: True if user graded "Again", False if "Good"
+            today: Day ordinal of the review (default: today)
         
         Returns:
             Updated card with new FSRS-6 metadata
         """
+        # Take the card's old values out of the deck statistics
+        indexed = self.due_index is not None and card in self.due_index
+        tracked = indexed and self.deck_stats is not None
+        if tracked:
+            self.deck_stats.remove(card)
+        
         # Update difficulty
         card.difficulty = self.update_difficulty(card.difficulty, grade_again)
         
@@ -191,7 +331,12 @@ class FSRS6Scheduler:
         )
         
         # Calculate new interval
+        if today is None:
+            today = today_ordinal()
         card.interval_days = self.calculate_interval(card.stability)
+        if self.load_balance and indexed:
+            card.interval_days = self.balance_interval(card.interval_days, today,
+                                                       self.due_index.count_on)
         
         # Update lapses
         if grade_again:
@@ -210,26 +355,233 @@ class FSRS6Scheduler:
             elif card.state == 3:
                 card.state = 2
         
-        # Update last seen
-        card.last_seen = datetime.now().strftime('%Y-%m-%d')
+        # Update last seen and precompute the next due day
+        card.last_seen = today
+        card.next_due_day = today + card.interval_days
+        card.dirty = True
+        self.revision += 1
+        
+        # Re-file the card in the due index
+        if self.due_index is not None:
+            self.due_index.update(card)
+        if tracked:
+            self.deck_stats.add(card)
         
         return card
     
-    def is_card_due(self, card: Card) -> bool:
-        """Check if a card is due for review."""
-        if card.state == 0:  # New cards are always due
-            return True
+    def schedule_batch(self, states, stabilities, difficulties, intervals,
+                       lapses, grades, last_seen=None, next_due=None,
+                       today: Optional[int] = None,
+                       due_counts: Optional[Counter] = None) -> int:
+        """
+        Schedule many cards in one pass over struct-of-arrays columns.
         
-        if not card.last_seen:
-            return True
+        Each column is a mutable sequence indexed by card position, e.g.
+        ``array('b')`` for states, ``array('d')`` for stability/difficulty and
+        ``array('l')`` for intervals/lapses. Columns are updated in place and
+        give exactly the same values as calling schedule_card on each card.
         
-        try:
-            last_seen_date = datetime.strptime(card.last_seen, '%Y-%m-%d')
-            next_review_date = last_seen_date + timedelta(days=card.interval_days)
-            return datetime.now() >= next_review_date
-        except (ValueError, TypeError):
-            return True
+        Args:
+            states: Card states (0-3)
+            stabilities: Stability values in days
+            difficulties: Difficulty values (1-10)
+            intervals: Interval column (overwritten)
+            lapses: Lapse counts
+            grades: Truthy for "Again", falsy for "Good"
+            last_seen: Optional column of last-seen day ordinals to stamp with today
+            next_due: Optional column of next-due day ordinals
+            today: Day ordinal of the review (default: today)
+            due_counts: Cards due on each day ordinal, for load_balance;
+                        updated as cards move (from their next_due day if
+                        that column is given)
+        
+        Returns:
+            Number of cards scheduled
+        """
+        n = len(grades)
+        columns = [states, stabilities, difficulties, intervals, lapses]
+        if last_seen is not None:
+            columns.append(last_seen)
+        if next_due is not None:
+            columns.append(next_due)
+        if any(len(column) != n for column in columns):
+            raise ValueError("All batch columns must have the same length as grades")
+        
+        # Hoist every per-card constant out of the loop. The expressions are
+        # kept identical to the scalar path so results match bit for bit.
+        again_step = self.difficulty_increase * self.diffAdjust
+        good_step = self.difficulty_decay * self.diffAdjust
+        interval_ratio = math.log(self.request_retention) / math.log(0.9)
+        initial_again = self.initial_stability_again
+        initial_good = self.initial_stability_good
+        factor_again = self.stability_factor_again
+        factor_good = self.stability_factor_good
+        growth = self.stabilityGrowth
+        if today is None:
+            today = today_ordinal()
+        balance = self.load_balance and due_counts is not None
+        
+        for i in range(n):
+            grade_again = grades[i]
+            state = states[i]
+            
+            difficulty = difficulties[i] + (again_step if grade_again else good_step)
+            difficulty = max(1.0, min(10.0, difficulty))
+            difficulties[i] = difficulty
+            
+            if state == 0:
+                stability = initial_again if grade_again else initial_good
+            elif grade_again:
+                stability = stabilities[i] * factor_again
+            else:
+                stability = stabilities[i] * (factor_good * ((11 - difficulty) / 10)) / growth
+            stabilities[i] = stability
+            
+            if stability <= 0:
+                interval = 1
+            else:
+                interval = max(1, int(round(stability * interval_ratio)))
+            if balance:
+                interval = self.balance_interval(interval, today, due_counts.__getitem__)
+                if next_due is not None:
+                    due_counts[next_due[i]] -= 1
+                due_counts[today + interval] += 1
+            intervals[i] = interval
+            
+            if grade_again:
+                lapses[i] += 1
+                states[i] = 1 if state == 0 else 3
+            else:
+                states[i] = 2
+            
+            if last_seen is not None:
+                last_seen[i] = today
+            if next_due is not None:
+                next_due[i] = today + interval
+        
+        return n
+    
+    def is_card_due(self, card: Card, today: Optional[int] = None) -> bool:
+        """
+        Check if a card is due for review.
+        
+        New and never-seen cards have next_due_day 0, so they are always due.
+        """
+        if today is None:
+            today = today_ordinal()
+        return card.next_due_day <= today
+    
+    def index_cards(self, cards: list[Card], stats: Optional[DeckStats] = None) -> DueIndex:
+        """
+        Build a due-date index and statistics over a deck and keep them current.
+        
+        Once indexed, get_due_cards and count_due_cards for this card list
+        only visit due cards instead of scanning the whole deck, and
+        deck_stats is updated in O(1) per scheduled card.
+        
+        Args:
+            cards: The deck's card list or CardStore
+            stats: Statistics already known for these cards (e.g. from the
+                   deck header); computed from the cards if omitted
+        """
+        self.due_index = DueIndex(cards)
+        self.deck_stats = stats if stats is not None else DeckStats.from_cards(cards)
+        self.revision += 1
+        return self.due_index
     
     def get_due_cards(self, cards: list[Card]) -> list[Card]:
         """Get all cards that are due for review."""
-        return [card for card in cards if self.is_card_due(card)]
+        if self.due_index is not None and self.due_index.covers(cards):
+            return self.due_index.due_cards()
+        today = today_ordinal()
+        return [card for card in cards if card.next_due_day <= today]
+    
+    def due_rows(self, cards: list[Card], today: Optional[int] = None) -> list[int]:
+        """Get the deck rows of all cards that are due for review, in deck order."""
+        if self.due_index is not None and self.due_index.covers(cards):
+            return self.due_index.due_rows(today)
+        if today is None:
+            today = today_ordinal()
+        return [row for row, card in enumerate(cards) if card.next_due_day <= today]
+    
+    def retrievability(self, card: Card, today: Optional[int] = None) -> float:
+        """
+        Estimate the probability of recalling a card today.
+        
+        R = 0.9^(t/S) for t days since the last review: stability is the
+        interval at which recall falls to 90%. New cards have R = 0.
+        """
+        if card.state == 0 or card.last_seen is None or card.stability <= 0:
+            return 0.0
+        if today is None:
+            today = today_ordinal()
+        if card.last_seen >= today:
+            return 1.0
+        return 0.9 ** ((today - card.last_seen) / card.stability)
+    
+    def practice_queue(self, cards: list[Card], limit: Optional[int] = None,
+                       ordering: str = 'retrievability', new_ratio: Optional[float] = None,
+                       today: Optional[int] = None) -> list[Card]:
+        """
+        Get the due cards for a practice session, most in need of review first.
+        
+        Args:
+            cards: The deck's card list or CardStore
+            limit: Most cards to return (None: every due card)
+            ordering: Name of a practice_queue.ORDERINGS entry
+            new_ratio: Share of the session reserved for new cards, or None
+            today: Day ordinal (default: today)
+        
+        Raises:
+            ValueError: If the ordering is unknown
+        """
+        if today is None:
+            today = today_ordinal()
+        rows = build_queue(cards, self.due_rows(cards, today), limit, ordering, new_ratio, today)
+        return [cards[row] for row in rows]
+    
+    def cached_analytics(self, cards: list[Card],
+                         today: Optional[int] = None) -> Optional[DeckAnalytics]:
+        """Get the deck analytics if they are still current for these cards and day."""
+        if today is None:
+            today = today_ordinal()
+        if self._analytics is None:
+            return None
+        cached_cards, revision, analytics = self._analytics
+        if cached_cards is cards and revision == self.revision and analytics.today == today:
+            return analytics
+        return None
+    
+    def analytics(self, cards: list[Card], today: Optional[int] = None) -> DeckAnalytics:
+        """
+        Get whole-deck memory analytics (see deck_analytics.analyze_deck).
+        
+        The result is cached until the next grade or day rollover.
+        """
+        if today is None:
+            today = today_ordinal()
+        analytics = self.cached_analytics(cards, today)
+        if analytics is None:
+            revision = self.revision
+            analytics = analyze_deck(cards, today)
+            self._analytics = (cards, revision, analytics)
+        return analytics
+    
+    def count_due_cards(self, cards: list[Card]) -> int:
+        """Count cards that are due for review."""
+        if self.due_index is not None and self.due_index.covers(cards):
+            return self.due_index.due_count()
+        today = today_ordinal()
+        return sum(1 for card in cards if card.next_due_day <= today)
+    
+    def forecast(self, cards: list[Card], days: int = 30,
+                 today: Optional[int] = None) -> list[int]:
+        """
+        Count cards falling due on each of the next days.
+        
+        Entry 0 is everything due by today (including overdue and new
+        cards); entry i counts cards due i days from today.
+        """
+        if self.due_index is not None and self.due_index.covers(cards):
+            return self.due_index.forecast(days, today)
+        return due_forecast(Counter(card.next_due_day for card in cards).items(), days, today)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Bulk grading: apply many graded reviews at once and save them in one commit.
+
+grade_many is the batch counterpart of FlashcardApp.handle_grade, for
+offline sync, imported paper-test results and scripted load tests. It runs
+in three steps, so that a failure at any point leaves both the deck in
+memory and the saved state as they were:
+
+    1. every grade is validated (known card, usable timestamp)
+    2. the grades are scheduled with FSRS6Scheduler.schedule_batch on copies
+       of the graded cards' columns, one batch per review day; a card graded
+       several times is scheduled once per round, in timestamp order
+    3. the reviews and the deck metadata, with the grades added to its
+       daily counts, are saved by one atomic append_reviews (a single
+       SQLite transaction or a single journal line), and only then written
+       back to the cards, the due index, the deck statistics and the
+       metadata in memory
+
+The app must not be running on the same deck while grading.py does.
+
+Usage:
+    python3 grading.py --user alice results.csv       # columns: front or id, grade[, timestamp]
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date
+from operator import itemgetter
+from typing import Iterable, Optional
+from fsrs import FSRS6Scheduler
+from models import Card, CardStore, DeckMetadata, make_card_id
+from persistence import PersistenceManager
+from replay import open_backend
+from sqlite_persistence import DEFAULT_DB_PATH, SqlitePersistenceManager
+from user_settings import UserSettings
+
+
+# Spellings of the two grades accepted in result files
+AGAIN_GRADES = ('again', '1', 'true', 'fail')
+GOOD_GRADES = ('good', '0', 'false', 'pass')
+
+
+class GradingError(ValueError):
+    """Raised when a batch of grades cannot be applied (nothing is changed)."""
+
+
+@dataclass
+class GradeReport:
+    """Outcome of one grade_many call."""
+    grades: int = 0
+    cards: int = 0  # Distinct cards graded
+    again: int = 0
+    batches: int = 0  # schedule_batch calls (review days x rounds)
+    seconds: float = 0.0
+    
+    @property
+    def grades_per_second(self) -> float:
+        return self.grades / self.seconds if self.seconds > 0 else 0.0
+
+
+def _row_lookup(cards) -> dict[int, int]:
+    """Map card IDs to deck rows."""
+    if isinstance(cards, CardStore):
+        return {card_id: row for row, card_id in enumerate(cards.ids)}
+    return {card.card_id: row for row, card in enumerate(cards)}
+
+
+# Typecodes of the working columns (as CardStore): state, stability,
+# difficulty, interval, lapses, last seen, next due
+_TYPECODES = ('b', 'd', 'd', 'i', 'i', 'i', 'i')
+
+
+def _gather(cards, rows: list[int]) -> list[array]:
+    """Copy the scheduling fields of some deck rows into columns."""
+    if isinstance(cards, CardStore):
+        # Also works on a MappedCardStore, whose columns are memoryviews
+        sources = (cards.states, cards.stabilities, cards.difficulties, cards.intervals,
+                   cards.lapses, cards.last_seen, cards.next_due)
+        return [array(code, [column[row] for row in rows])
+                for code, column in zip(_TYPECODES, sources)]
+    picked = [cards[row] for row in rows]
+    values = ([card.state for card in picked],
+              [card.stability for card in picked],
+              [card.difficulty for card in picked],
+              [card.interval_days for card in picked],
+              [card.lapses for card in picked],
+              [card.last_seen or CardStore.NO_DAY for card in picked],
+              [card.next_due_day for card in picked])
+    return [array(code, column) for code, column in zip(_TYPECODES, values)]
+
+
+def grade_many(persistence: PersistenceManager, scheduler: FSRS6Scheduler, cards,
+               user: str, deck_name: str, grades: Iterable[tuple],
+               deck_metadata: Optional[DeckMetadata] = None) -> GradeReport:
+    """
+    Apply many graded reviews and save them in one commit.
+    
+    Args:
+        persistence: Storage backend
+        scheduler: Scheduler (and due index/statistics, if indexed) to use
+        cards: The deck's card list or CardStore
+        user: Username
+        deck_name: Deck name
+        grades: (card_id, grade_again, timestamp) tuples; grade_again is
+                truthy for "Again", and a None timestamp means now
+        deck_metadata: Daily review counts to add the grades to; saved with
+                       the reviews
+    
+    Returns:
+        GradeReport with counts and timing
+    
+    Raises:
+        GradingError: If a card ID is unknown or a timestamp is unusable
+        OSError: If the commit fails
+    """
+    start = time.perf_counter()
+    report = GradeReport()
+    now = round(time.time(), 3)
+    
+    # 1. Validate, before anything is changed
+    rows_by_id = _row_lookup(cards)
+    entries = []
+    for card_id, grade_again, timestamp in grades:
+        row = rows_by_id.get(card_id)
+        if row is None:
+            raise GradingError(f"Unknown card ID {card_id}")
+        if timestamp is None:
+            timestamp = now
+        try:
+            day = date.fromtimestamp(timestamp).toordinal()
+        except (TypeError, ValueError, OverflowError, OSError) as e:
+            raise GradingError(f"Bad timestamp {timestamp!r} for card {card_id}: {e}") from e
+        entries.append((timestamp, row, bool(grade_again), day))
+    entries.sort(key=itemgetter(0))  # Stable: equal timestamps keep their order
+    report.grades = len(entries)
+    if not entries:
+        return report
+    
+    # 2. Schedule on copies, one batch per (round, day)
+    slot_of: dict[int, int] = {}  # Deck row -> position in the working columns
+    batches: dict[tuple, list[int]] = {}
+    graded = Counter()
+    for i, (_, row, _, day) in enumerate(entries):
+        slot_of.setdefault(row, len(slot_of))
+        batches.setdefault((graded[row], day), []).append(i)
+        graded[row] += 1
+    rows = list(slot_of)
+    columns = _gather(cards, rows)
+    
+    due_counts = None
+    if scheduler.load_balance and scheduler.due_index is not None \
+            and scheduler.due_index.covers(cards):
+        due_counts = scheduler.due_index.day_counts()
+    params = scheduler.log_parameters()
+    ids = cards.ids if isinstance(cards, CardStore) else None
+    records: list = [None] * len(entries)
+    for key in sorted(batches):
+        batch = batches[key]
+        slots = [slot_of[entries[i][1]] for i in batch]
+        picked = [array(column.typecode, [column[slot] for slot in slots])
+                  for column in columns]
+        batch_grades = [entries[i][2] for i in batch]
+        scheduler.schedule_batch(*picked[:5], batch_grades, last_seen=picked[5],
+                                 next_due=picked[6], today=key[1], due_counts=due_counts)
+        for column, values in zip(columns, picked):
+            for slot, value in zip(slots, values):
+                column[slot] = value
+        states, stabilities, difficulties, intervals, lapses, last_seen = picked[:6]
+        for j, i in enumerate(batch):
+            timestamp, row, grade_again, day = entries[i]
+            card_id = ids[row] if ids is not None else cards[row].card_id
+            records[i] = [card_id, timestamp, int(grade_again), stabilities[j], difficulties[j],
+                          intervals[j], lapses[j], states[j], last_seen[j], params]
+        report.batches += 1
+    
+    # 3. Commit (with the day counts), then update the deck in memory
+    updated = None
+    if deck_metadata is not None:
+        updated = deck_metadata.copy()
+        updated.graded_batches += 1
+        for day, count in Counter(entry[3] for entry in entries).items():
+            updated.daily_counts.increment(day, count)
+    persistence.append_reviews(user, deck_name, records, atomic=True, deck_metadata=updated)
+    
+    states, stabilities, difficulties, intervals, lapses, last_seen, next_due = columns
+    index = scheduler.due_index
+    stats = scheduler.deck_stats
+    for slot, row in enumerate(rows):
+        card = cards[row]
+        tracked = index is not None and card in index
+        if tracked and stats is not None:
+            stats.remove(card)
+        card.state = states[slot]
+        card.stability = stabilities[slot]
+        card.difficulty = difficulties[slot]
+        card.interval_days = intervals[slot]
+        card.lapses = lapses[slot]
+        card.last_seen = last_seen[slot]
+        card.next_due_day = next_due[slot]
+        card.dirty = False  # Journaled above
+        if tracked:
+            index.update(card)
+            if stats is not None:
+                stats.add(card)
+    scheduler.revision += 1
+    
+    if updated is not None:
+        deck_metadata.daily_counts = updated.daily_counts
+        deck_metadata.graded_batches = updated.graded_batches
+        deck_metadata.dirty = False
+    report.cards = len(rows)
+    report.again = sum(entry[2] for entry in entries)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def read_results(path: str) -> list[tuple]:
+    """
+    Read graded results from a CSV file as grade_many tuples.
+    
+    Cards are identified by an `id` column or by their `front`; `grade` is
+    again/good (or 1/0), and an optional `timestamp` holds Unix seconds.
+    
+    Raises:
+        GradingError: If a row cannot be read
+    """
+    results = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                card_id = int(row['id']) if row.get('id') else make_card_id(row['front'])
+                grade = row['grade'].strip().lower()
+                if grade not in AGAIN_GRADES + GOOD_GRADES:
+                    raise ValueError(f"unknown grade {row['grade']!r}")
+                timestamp = float(row['timestamp']) if row.get('timestamp') else None
+            except (KeyError, ValueError) as e:
+                raise GradingError(f"{path}:{line}: {e}") from e
+            results.append((card_id, grade in AGAIN_GRADES, timestamp))
+    return results
+
+
+def main():
+    """Apply a file of graded results to a user's deck."""
+    parser = argparse.ArgumentParser(description="Apply many graded reviews at once")
+    parser.add_argument('results', help="CSV of results (front or id, grade[, timestamp])")
+    parser.add_argument('--user', required=True, help="User whose deck is graded")
+    parser.add_argument('--data', default="data/users",
+                        help="JSON user data directory (default: data/users)")
+    parser.add_argument('--db', default=None,
+                        help=f"SQLite database (default: {DEFAULT_DB_PATH} if it exists)")
+    parser.add_argument('--csv', default="hiragana.csv", help="Deck CSV (default: hiragana.csv)")
+    parser.add_argument('--deck', default="hiragana", help="Deck name (default: hiragana)")
+    args = parser.parse_args()
+    
+    db_path = args.db
+    if db_path is None and os.path.exists(DEFAULT_DB_PATH):
+        db_path = DEFAULT_DB_PATH
+    persistence = open_backend(args.data, db_path)
+    try:
+        settings = UserSettings(args.user, base_dir=args.data)
+        scheduler = FSRS6Scheduler(settings.effective_intensity(), settings.request_retention)
+        scheduler.load_parameters(settings.params_file)
+        scheduler.load_balance = settings.load_balance
+        cards = persistence.load_card_store(args.csv, args.user, args.deck)
+        scheduler.index_cards(cards)
+        metadata = persistence.load_deck_metadata(args.user, args.deck)
+        report = grade_many(persistence, scheduler, cards, args.user, args.deck,
+                            read_results(args.results), metadata)
+    except GradingError as e:
+        print(f"Nothing was graded: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if isinstance(persistence, SqlitePersistenceManager):
+            persistence.close()
+    print(f"Graded {report.grades:,} reviews of {report.cards:,} cards "
+          f"({report.again:,} Again) in {report.seconds:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,8 @@ Tkinter GUI for the flashcard application.
 import tkinter as tk
 from tkinter import ttk, messagebox
 from typing import Optional, Callable
-from models import Card, DeckMetadata
+from models import Card, DeckMetadata, DeckStats, format_day
+from deck_analytics import DIFFICULTY_LABELS, STABILITY_LABELS, DeckAnalytics
 from datetime import datetime
 
 
@@ -71,7 +72,9 @@ class MainMenu:
                  on_stats: Callable[[], None],
                  deck_metadata: DeckMetadata,
                  total_cards: int,
-                 due_cards: int):
+                 due_cards: int,
+                 on_import: Optional[Callable[[], None]] = None,
+                 on_grade_results: Optional[Callable[[], None]] = None):
         self.root = root
         self.frame = ttk.Frame(root, padding="20")
         self.frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -106,11 +109,52 @@ class MainMenu:
         stats_btn = ttk.Button(btn_frame, text="View Stats", 
                               command=on_stats, width=20)
         stats_btn.grid(row=1, column=0, pady=10)
+        
+        if on_import:
+            import_btn = ttk.Button(btn_frame, text="Import Progress...",
+                                   command=on_import, width=20)
+            import_btn.grid(row=2, column=0, pady=10)
+        
+        if on_grade_results:
+            results_btn = ttk.Button(btn_frame, text="Import Results...",
+                                    command=on_grade_results, width=20)
+            results_btn.grid(row=3, column=0, pady=10)
     
     def destroy(self):
         self.frame.destroy()
 
 
+class ImportProgressDialog:
+    """Modal window showing the progress of a deck import."""
+    
+    def __init__(self, root: tk.Tk, filename: str):
+        self.window = tk.Toplevel(root)
+        self.window.title("Importing")
+        self.window.transient(root)
+        self.window.resizable(False, False)
+        # Closing is not allowed mid-import; the dialog closes itself
+        self.window.protocol("WM_DELETE_WINDOW", lambda: None)
+        
+        frame = ttk.Frame(self.window, padding="20")
+        frame.grid(row=0, column=0)
+        ttk.Label(frame, text=f"Importing {filename}",
+                 font=('Arial', 12)).grid(row=0, column=0, pady=5)
+        self.bar = ttk.Progressbar(frame, length=300, mode='determinate', maximum=100)
+        self.bar.grid(row=1, column=0, pady=5)
+        self.status = ttk.Label(frame, text="Starting...")
+        self.status.grid(row=2, column=0, pady=5)
+        self.window.grab_set()
+    
+    def update_progress(self, fraction: float, rows: int):
+        """Show how much of the file has been imported."""
+        self.bar['value'] = fraction * 100
+        self.status.config(text=f"{rows:,} rows imported")
+    
+    def destroy(self):
+        self.window.grab_release()
+        self.window.destroy()
+
+
 class PracticeView:
     """Flashcard practice view with binary grading."""
     
@@ -234,54 +278,71 @@ class PracticeView:
 class StatsView:
     """Statistics and insights view with FSRS-6 parameter display and manual intensity override."""
     
-    def __init__(self, root: tk.Tk, cards: list[Card], 
+    WHEEL_EVENTS = ('<MouseWheel>', '<Button-4>', '<Button-5>')
+    
+    def __init__(self, root: tk.Tk, deck_stats: DeckStats, 
                  deck_metadata: DeckMetadata, scheduler, settings, 
                  on_back: Callable[[], None],
-                 on_intensity_changed: Callable[[], None]):
+                 on_intensity_changed: Callable[[], None],
+                 on_project_load: Optional[Callable[[float], None]] = None,
+                 forecast: Optional[list[int]] = None,
+                 analytics: Optional[DeckAnalytics] = None):
         self.root = root
-        self.cards = cards
+        self.deck_stats = deck_stats
         self.deck_metadata = deck_metadata
         self.scheduler = scheduler
         self.settings = settings
         self.on_back = on_back
         self.on_intensity_changed = on_intensity_changed
+        self.on_project_load = on_project_load
+        self.forecast = forecast
+        self.analytics = analytics
         
-        self.frame = ttk.Frame(root, padding="20")
+        self.frame = ttk.Frame(root)
         self.frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.frame.columnconfigure(0, weight=1)
+        self.frame.rowconfigure(0, weight=1)
+        
+        # The sections form one column, taller than the window, that scrolls
+        # inside it
+        self.canvas = tk.Canvas(self.frame, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.body = ttk.Frame(self.canvas, padding="20")
+        self.canvas.create_window((0, 0), window=self.body, anchor=tk.NW)
+        self.body.bind('<Configure>', lambda e: self.canvas.configure(
+            scrollregion=self.canvas.bbox('all')))
+        # The view fills the window, so the wheel scrolls it wherever the pointer is;
+        # Windows and macOS send <MouseWheel>, X11 buttons 4 and 5
+        for sequence in self.WHEEL_EVENTS:
+            self.canvas.bind_all(sequence, self._on_wheel)
         
         # Title
-        title = ttk.Label(self.frame, text="Statistics & Insights", 
+        title = ttk.Label(self.body, text="Statistics & Insights", 
                          font=('Arial', 20, 'bold'))
-        title.grid(row=0, column=0, columnspan=2, pady=20)
+        title.grid(row=0, column=0, pady=20)
         
         # FSRS-6 Parameters section (new)
         self._create_fsrs_parameters_section()
         
-        # Calculate stats
-        total_cards = len(cards)
-        new_cards = sum(1 for c in cards if c.state == 0)
-        learning_cards = sum(1 for c in cards if c.state == 1)
-        review_cards = sum(1 for c in cards if c.state == 2)
-        relearning_cards = sum(1 for c in cards if c.state == 3)
-        
-        avg_difficulty = sum(c.difficulty for c in cards) / total_cards if total_cards > 0 else 0
-        avg_stability = sum(c.stability for c in cards if c.stability > 0) / max(1, sum(1 for c in cards if c.stability > 0))
-        total_lapses = sum(c.lapses for c in cards)
-        
         # Stats display
-        stats_frame = ttk.LabelFrame(self.frame, text="Deck Statistics", padding="15")
+        stats_frame = ttk.LabelFrame(self.body, text="Deck Statistics", padding="15")
         stats_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=10)
         
+        # Running totals, so this does not depend on the deck size
+        new_cards, learning_cards, review_cards, relearning_cards = deck_stats.state_counts
         stats = [
-            ("Total Cards:", total_cards),
+            ("Total Cards:", deck_stats.total_cards),
             ("New Cards:", new_cards),
             ("Learning:", learning_cards),
             ("Review:", review_cards),
             ("Relearning:", relearning_cards),
             ("", ""),  # Spacer
-            ("Average Difficulty:", f"{avg_difficulty:.1f} / 10"),
-            ("Average Stability:", f"{avg_stability:.1f} days"),
-            ("Total Lapses:", total_lapses),
+            ("Average Difficulty:", f"{deck_stats.average_difficulty:.1f} / 10"),
+            ("Average Stability:", f"{deck_stats.average_stability:.1f} days"),
+            ("Total Lapses:", deck_stats.total_lapses),
         ]
         
         for i, (label, value) in enumerate(stats):
@@ -292,7 +353,7 @@ class StatsView:
                     row=i, column=1, sticky=tk.E, padx=20, pady=3)
         
         # Daily stats
-        daily_frame = ttk.LabelFrame(self.frame, text="Daily Progress", padding="15")
+        daily_frame = ttk.LabelFrame(self.body, text="Daily Progress", padding="15")
         daily_frame.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=10)
         
         today_count = deck_metadata.get_today_count()
@@ -304,26 +365,45 @@ class StatsView:
                  font=('Arial', 11, 'bold')).grid(row=0, column=1, sticky=tk.E, padx=20, pady=3)
         
         # Recent activity
-        if deck_metadata.daily_counts:
-            recent_frame = ttk.LabelFrame(self.frame, text="Recent Activity", padding="15")
+        recent_days = deck_metadata.daily_counts.recent(7)
+        if any(count for _, count in recent_days):
+            recent_frame = ttk.LabelFrame(self.body, text="Recent Activity", padding="15")
             recent_frame.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=10)
             
-            # Sort dates and show last 7 days
-            sorted_dates = sorted(deck_metadata.daily_counts.items(), reverse=True)[:7]
-            for i, (date, count) in enumerate(sorted_dates):
-                ttk.Label(recent_frame, text=date, font=('Arial', 10)).grid(
+            # Show the last 7 days, newest first
+            for i, (day, count) in enumerate(recent_days):
+                ttk.Label(recent_frame, text=format_day(day), font=('Arial', 10)).grid(
                     row=i, column=0, sticky=tk.W, pady=2)
                 ttk.Label(recent_frame, text=f"{count} cards", 
                          font=('Arial', 10)).grid(row=i, column=1, sticky=tk.E, padx=20, pady=2)
         
-        # Back button
+        # Upcoming due load, below the statistics
+        if forecast:
+            self._create_forecast_section()
+        
+        # Retrievability and histograms; filled in by show_analytics if not cached
+        self.memory_frame = ttk.LabelFrame(self.body, text="Memory", padding="15")
+        self.memory_frame.grid(row=6, column=0, sticky=(tk.W, tk.E), pady=10)
+        if analytics is not None:
+            self.show_analytics(analytics)
+        else:
+            ttk.Label(self.memory_frame, text="Analyzing deck...", font=('Arial', 10),
+                      foreground='gray').grid(row=0, column=0, sticky=tk.W)
+        
+        # Back button, kept in view below the scrolling sections
         back_btn = ttk.Button(self.frame, text="Back to Menu", 
                              command=on_back, width=20)
-        back_btn.grid(row=5, column=0, pady=20)
+        back_btn.grid(row=1, column=0, columnspan=2, pady=10)
+    
+    def _on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, 'units')
+        elif event.num == 5 or event.delta < 0:
+            self.canvas.yview_scroll(1, 'units')
     
     def _create_fsrs_parameters_section(self):
         """Create FSRS-6 parameters display and manual intensity override controls."""
-        params_frame = ttk.LabelFrame(self.frame, text="FSRS-6 Learning Parameters", padding="15")
+        params_frame = ttk.LabelFrame(self.body, text="FSRS-6 Learning Parameters", padding="15")
         params_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=10)
         
         # Get current parameters
@@ -415,6 +495,95 @@ class StatsView:
                  text="Note: Higher intensity = more frequent reviews, faster learning",
                  font=('Arial', 9), foreground='gray').grid(
             row=row, column=0, columnspan=2, sticky=tk.W, pady=(0, 5))
+        
+        # Simulated workload for the intensity entered above (or the current one)
+        if self.on_project_load is not None:
+            row += 1
+            project_frame = ttk.Frame(params_frame)
+            project_frame.grid(row=row, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+            ttk.Label(project_frame, text="Projected Load:", font=('Arial', 10)).pack(
+                side=tk.LEFT, padx=(0, 5))
+            self.projection_var = tk.StringVar(value="-")
+            ttk.Label(project_frame, textvariable=self.projection_var,
+                      font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+            ttk.Button(project_frame, text="Project", command=self._project_load,
+                       width=10).pack(side=tk.LEFT, padx=5)
+    
+    def _create_forecast_section(self):
+        """Draw the reviews due on each upcoming day as a bar chart."""
+        forecast_frame = ttk.LabelFrame(self.body, text="Upcoming Reviews", padding="15")
+        forecast_frame.grid(row=5, column=0, sticky=(tk.W, tk.E), pady=10)
+        
+        width, height, margin = 360, 180, 24
+        canvas = tk.Canvas(forecast_frame, width=width, height=height, background='white',
+                           highlightthickness=0)
+        canvas.grid(row=0, column=0)
+        
+        peak = max(self.forecast) or 1
+        slot = (width - margin) / len(self.forecast)
+        bottom = height - margin
+        for day, count in enumerate(self.forecast):
+            left = margin + day * slot
+            top = bottom - (bottom - 10) * count / peak
+            # Today's bar includes the overdue and new cards
+            color = '#d9822b' if day == 0 else '#4a7ab5'
+            canvas.create_rectangle(left + 1, top, left + slot - 1, bottom, fill=color, width=0)
+        canvas.create_line(margin, bottom, width, bottom)
+        canvas.create_text(margin - 4, 10, text=str(max(self.forecast)), anchor=tk.E,
+                           font=('Arial', 8))
+        for day in range(0, len(self.forecast), 7):
+            label = "Today" if day == 0 else f"+{day}d"
+            canvas.create_text(margin + (day + 0.5) * slot, bottom + 4, text=label,
+                               anchor=tk.N, font=('Arial', 8))
+        
+        ttk.Label(forecast_frame,
+                  text=f"{sum(self.forecast[1:8])} due in the next 7 days, "
+                       f"{self.forecast[0]} due now",
+                  font=('Arial', 10)).grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+    
+    def show_analytics(self, analytics: DeckAnalytics):
+        """Display a DeckAnalytics result in the memory section."""
+        self.analytics = analytics
+        for child in self.memory_frame.winfo_children():
+            child.destroy()
+        
+        ttk.Label(self.memory_frame,
+                  text=f"Expected recall today: {analytics.expected_remembered:,.0f} of "
+                       f"{analytics.reviewed_cards:,} reviewed cards "
+                       f"({analytics.average_retrievability:.0%})",
+                  font=('Arial', 10, 'bold')).grid(row=0, column=0, sticky=tk.W, pady=(0, 5))
+        
+        recall_labels = [f"{i * 10}%" for i in range(len(analytics.retrievability_histogram))]
+        charts = [
+            ("Retrievability", analytics.retrievability_histogram, recall_labels),
+            ("Stability", analytics.stability_histogram, STABILITY_LABELS),
+            ("Difficulty", analytics.difficulty_histogram, DIFFICULTY_LABELS),
+        ]
+        for i, (title, counts, labels) in enumerate(charts, start=1):
+            ttk.Label(self.memory_frame, text=title, font=('Arial', 9)).grid(
+                row=2 * i - 1, column=0, sticky=tk.W)
+            self._draw_histogram(self.memory_frame, counts, labels).grid(
+                row=2 * i, column=0, sticky=tk.W, pady=(0, 5))
+    
+    @staticmethod
+    def _draw_histogram(parent, counts: list[int], labels, width: int = 360,
+                        height: int = 70) -> tk.Canvas:
+        """Draw a small labelled bar chart; one bar per bin, whatever the deck size."""
+        margin = 14
+        canvas = tk.Canvas(parent, width=width, height=height, background='white',
+                           highlightthickness=0)
+        peak = max(counts, default=0) or 1
+        slot = width / max(1, len(counts))
+        bottom = height - margin
+        for i, count in enumerate(counts):
+            left = i * slot
+            top = bottom - (bottom - 4) * count / peak
+            canvas.create_rectangle(left + 1, top, left + slot - 1, bottom, fill='#4a7ab5',
+                                    width=0)
+            canvas.create_text(left + slot / 2, bottom + 2, text=labels[i], anchor=tk.N,
+                               font=('Arial', 7))
+        canvas.create_line(0, bottom, width, bottom)
+        return canvas
     
     def _apply_manual_intensity(self):
         """Apply manual intensity override."""
@@ -454,6 +623,22 @@ class StatsView:
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number")
     
+    def _project_load(self):
+        """Ask for a workload projection at the entered (or current) intensity."""
+        try:
+            intensity = float(self.intensity_var.get().strip())
+        except ValueError:
+            intensity = self.scheduler.intensity
+        self.projection_var.set("Simulating...")
+        self.on_project_load(max(0.0, min(10.0, intensity)))
+    
+    def show_projection(self, report):
+        """Display a WorkloadReport from the workload simulator."""
+        text = f"~{report.mean_reviews:.0f} reviews/day ({report.mean_minutes:.0f} min)"
+        if report.backlog:
+            text += f", {report.backlog:.0f} left over"
+        self.projection_var.set(text)
+    
     def _clear_manual_intensity(self):
         """Clear manual intensity override."""
         response = messagebox.askyesno(
@@ -468,4 +653,6 @@ class StatsView:
             self.on_intensity_changed()
     
     def destroy(self):
+        for sequence in self.WHEEL_EVENTS:
+            self.canvas.unbind_all(sequence)
         self.frame.destroy()
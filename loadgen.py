@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Load generator for api_server.py.
+
+Each simulated user holds one keep-alive connection and practises as fast
+as the server answers: log in, fetch a card, then grade cards (Again with
+a fixed probability), each grade's reply bringing the next card, until it
+has made its grades or runs out of cards. The report gives grades per
+second and the latency of the grade requests.
+
+With --serve, a server is started in the same process on a temporary data
+directory and a synthetic deck, so nothing real is touched. Client and
+server then share one CPU core, so the figures are a lower bound for a
+server running on its own.
+
+Usage:
+    python3 loadgen.py --port 8765 --users 50 --grades 200
+    python3 loadgen.py --serve --users 50 --grades 200
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import urlencode
+from api_server import ApiServer, SchedulingService
+from persistence import PersistenceManager
+
+
+class ApiClient:
+    """Minimal HTTP/1.1 JSON client over one keep-alive connection."""
+    
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+    
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+    
+    async def request(self, method: str, path: str, payload: Optional[dict] = None) -> tuple:
+        """
+        Send a request and wait for its reply.
+        
+        Returns:
+            (status code, decoded JSON reply)
+        """
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+        if body:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        self.writer.write((head + "\r\n").encode('latin-1') + body)
+        
+        status_line, *lines = (await self.reader.readuntil(b'\r\n\r\n')).split(b'\r\n')
+        length = 0
+        for line in lines:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                length = int(value)
+        return int(status_line.split()[1]), json.loads(await self.reader.readexactly(length))
+    
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+@dataclass
+class LoadReport:
+    """Outcome of one load run."""
+    users: int = 0
+    grades: int = 0
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    latencies: list = field(default_factory=list, repr=False)  # Grade requests, seconds
+    
+    @property
+    def grades_per_second(self) -> float:
+        return self.grades / self.seconds if self.seconds > 0 else 0.0
+    
+    def latency_ms(self, percentile: float) -> float:
+        """Get a percentile (0-100) of the grade latencies in milliseconds."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))] * 1000
+
+
+async def run_load(host: str, port: int, users: list[str], grades_per_user: int,
+                   again_rate: float = 0.1, seed: int = 0) -> LoadReport:
+    """
+    Practise as several users at once against a running server.
+    
+    Args:
+        host: Server address
+        port: Server port
+        users: Usernames (created if needed)
+        grades_per_user: Most grades each user makes
+        again_rate: Probability of grading Again
+        seed: Random seed for the grades
+    """
+    report = LoadReport(users=len(users))
+    rng = random.Random(seed)
+    
+    async def practise(user: str):
+        client = ApiClient(host, port)
+        await client.connect()
+        try:
+            status, _ = await client.request('POST', '/login', {'user': user})
+            report.requests += 1
+            if status != 200:
+                report.errors += 1
+                return
+            status, reply = await client.request(
+                'GET', '/next?' + urlencode({'user': user, 'over_limit': 1}))
+            report.requests += 1
+            for _ in range(grades_per_user):
+                if status != 200:
+                    report.errors += 1
+                    return
+                card = reply['card']
+                if card is None:
+                    return
+                start = time.perf_counter()
+                # Each grade reply carries the next card
+                status, reply = await client.request('POST', '/grade', {
+                    'user': user, 'card_id': card['id'], 'again': rng.random() < again_rate,
+                    'next': True, 'over_limit': True})
+                report.latencies.append(time.perf_counter() - start)
+                report.requests += 1
+                if status == 200:
+                    report.grades += 1
+                    reply = reply['next']
+        finally:
+            await client.close()
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(practise(user) for user in users))
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def write_synthetic_deck(path: str, size: int):
+    """Write a deck CSV of new cards in the shared deck's format."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['front', 'back', 'state', 'lastSeen'])
+        for i in range(size):
+            writer.writerow([f"card{i}", f"back{i}", 0, ''])
+
+
+async def run_local_load(users: int, grades_per_user: int, deck_size: int,
+                         max_sessions: int = 256) -> LoadReport:
+    """Start a server on temporary data in this process and load it."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        write_synthetic_deck(csv_path, deck_size)
+        data_dir = os.path.join(tmpdir, "users")
+        service = SchedulingService(PersistenceManager(base_dir=data_dir), data_dir,
+                                    csv_path, "deck", max_sessions=max_sessions)
+        server = ApiServer(service)
+        port = await server.start("127.0.0.1", 0)
+        try:
+            return await run_load("127.0.0.1", port, [f"load{i}" for i in range(users)],
+                                  grades_per_user)
+        finally:
+            await server.close()
+
+
+def main():
+    """Load a scheduling server and report throughput."""
+    parser = argparse.ArgumentParser(description="Load generator for api_server.py")
+    parser.add_argument('--host', default="127.0.0.1", help="Server address (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Server port (default: 8765)")
+    parser.add_argument('--users', type=int, default=50,
+                        help="Concurrent simulated users (default: 50)")
+    parser.add_argument('--grades', type=int, default=200,
+                        help="Grades per user (default: 200)")
+    parser.add_argument('--prefix', default="load", help="Username prefix (default: load)")
+    parser.add_argument('--serve', action='store_true',
+                        help="Start a server in this process on temporary data")
+    parser.add_argument('--deck-size', type=int, default=1_000,
+                        help="Synthetic deck size with --serve (default: 1000)")
+    args = parser.parse_args()
+    
+    if args.serve:
+        report = asyncio.run(run_local_load(args.users, args.grades, args.deck_size))
+    else:
+        users = [f"{args.prefix}{i}" for i in range(args.users)]
+        try:
+            report = asyncio.run(run_load(args.host, args.port, users, args.grades))
+        except OSError as e:
+            print(f"Cannot reach {args.host}:{args.port}: {e}", file=sys.stderr)
+            return 1
+    print(f"{report.grades:,} grades by {report.users} users in {report.seconds:.2f}s: "
+          f"{report.grades_per_second:,.0f} grades/s, {report.requests:,} requests, "
+          f"{report.errors} errors")
+    print(f"Grade latency: p50 {report.latency_ms(50):.2f} ms, "
+          f"p99 {report.latency_ms(99):.2f} ms")
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
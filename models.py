@@ -1,9 +1,75 @@
 """
 Data models for flashcard application.
 """
+import hashlib
+import math
+import sys
+from array import array
+from collections import Counter
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Optional
+from datetime import date
+from typing import Iterable, Iterator, Optional, Union
+
+
+def parse_day(value: Union[int, str, None]) -> Optional[int]:
+    """
+    Convert a stored date to a day ordinal.
+    
+    Accepts day ordinals (current format), 'YYYY-MM-DD' strings (legacy
+    format) or None. Unparseable dates become None.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (ValueError, TypeError):
+        return None
+
+
+def format_day(day: Optional[int]) -> str:
+    """Convert a day ordinal to a 'YYYY-MM-DD' string ('' for None)."""
+    if day is None:
+        return ''
+    return date.fromordinal(day).isoformat()
+
+
+def today_ordinal() -> int:
+    """Get today's date as a day ordinal."""
+    return date.today().toordinal()
+
+
+def due_forecast(day_counts: Iterable[tuple[int, int]], days: int,
+                 today: Optional[int] = None) -> list[int]:
+    """
+    Turn (due day, card count) pairs into counts for each of the next days.
+    
+    Entry 0 is everything due by today (overdue and new cards included);
+    entry i counts the cards falling due i days from today. Cards due after
+    the window are left out.
+    """
+    if today is None:
+        today = today_ordinal()
+    counts = [0] * days
+    if days <= 0:
+        return counts
+    for day, count in day_counts:
+        offset = day - today
+        if offset < days:
+            counts[max(0, offset)] += count
+    return counts
+
+
+def make_card_id(front: str, occurrence: int = 0) -> int:
+    """
+    Get the stable ID of a card from its content.
+    
+    The ID is a 63-bit hash of the front and the number of earlier cards in
+    the deck with the same front, so it survives edits elsewhere in the deck,
+    keeps duplicate fronts apart and fits a signed 64-bit column.
+    """
+    key = front if occurrence == 0 else f"{front}\x00{occurrence}"
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') >> 1
 
 
 @dataclass
@@ -12,7 +78,7 @@ class Card:
     front: str
     back: str
     state: int = 0  # 0=new, 1=learning, 2=review, 3=relearning
-    last_seen: Optional[str] = None
+    last_seen: Optional[int] = None  # Day ordinal (date.toordinal())
     
     # FSRS-6 metadata
     stability: float = 0.0  # S in days
@@ -20,13 +86,39 @@ class Card:
     interval_days: int = 0
     lapses: int = 0
     
+    # Stable ID used by every persistence join (see make_card_id). Defaults
+    # to the ID of the first card with this front.
+    card_id: Optional[int] = None
+    
+    # Day ordinal on which the card is next due (0 = due now).
+    # Derived from state/last_seen/interval_days; kept current by the scheduler.
+    next_due_day: int = field(default=0, init=False, repr=False, compare=False)
+    
+    # True while the card has changes that are not persisted yet. New cards
+    # start dirty; cards loaded from storage start clean.
+    dirty: bool = field(default=True, init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Accept legacy 'YYYY-MM-DD' strings for last_seen
+        self.last_seen = parse_day(self.last_seen)
+        if self.card_id is None:
+            self.card_id = make_card_id(self.front)
+        self.refresh_due_day()
+    
+    def refresh_due_day(self):
+        """Recompute next_due_day after editing scheduling fields directly."""
+        if self.state == 0 or self.last_seen is None:
+            self.next_due_day = 0
+        else:
+            self.next_due_day = self.last_seen + self.interval_days
+    
     def to_csv_row(self) -> dict:
         """Convert card to CSV row format."""
         return {
             'front': self.front,
             'back': self.back,
             'state': str(self.state),
-            'lastSeen': self.last_seen or ''
+            'lastSeen': format_day(self.last_seen)
         }
     
     def to_metadata(self) -> dict:
@@ -42,12 +134,13 @@ class Card:
     
     @classmethod
     def from_csv_and_metadata(cls, csv_row: dict, metadata: dict = None):
-        """Create card from CSV row and optional metadata."""
+        """Create a clean (already persisted) card from CSV row and optional metadata."""
         card = cls(
             front=csv_row['front'],
             back=csv_row['back'],
             state=int(csv_row.get('state', 0)),
-            last_seen=csv_row.get('lastSeen') or None
+            last_seen=csv_row.get('lastSeen') or None,
+            card_id=csv_row.get('id')
         )
         
         if metadata:
@@ -57,44 +150,529 @@ class Card:
             card.lapses = metadata.get('lapses', 0)
             # Override state and last_seen from metadata if present
             card.state = metadata.get('state', card.state)
-            card.last_seen = metadata.get('last_seen', card.last_seen)
+            card.last_seen = parse_day(metadata.get('last_seen', card.last_seen))
+            card.refresh_due_day()
         
+        card.dirty = False
         return card
 
 
+class CardView:
+    """
+    Lightweight Card-compatible view of one row of a CardStore.
+    
+    Reads and writes go straight to the store's columns, so the scheduler
+    and GUI can use views wherever they accept a Card.
+    """
+    __slots__ = ('store', 'row')
+    
+    def __init__(self, store: 'CardStore', row: int):
+        self.store = store
+        self.row = row
+    
+    @property
+    def card_id(self) -> int:
+        return self.store.ids[self.row]
+    
+    @property
+    def front(self) -> str:
+        return self.store.fronts[self.row]
+    
+    @property
+    def back(self) -> str:
+        return self.store.backs[self.row]
+    
+    @property
+    def state(self) -> int:
+        return self.store.states[self.row]
+    
+    @state.setter
+    def state(self, value: int):
+        self.store.states[self.row] = value
+    
+    @property
+    def last_seen(self) -> Optional[int]:
+        return self.store.last_seen[self.row] or None
+    
+    @last_seen.setter
+    def last_seen(self, value: Optional[int]):
+        self.store.last_seen[self.row] = value or CardStore.NO_DAY
+    
+    @property
+    def stability(self) -> float:
+        return self.store.stabilities[self.row]
+    
+    @stability.setter
+    def stability(self, value: float):
+        self.store.stabilities[self.row] = value
+    
+    @property
+    def difficulty(self) -> float:
+        return self.store.difficulties[self.row]
+    
+    @difficulty.setter
+    def difficulty(self, value: float):
+        self.store.difficulties[self.row] = value
+    
+    @property
+    def interval_days(self) -> int:
+        return self.store.intervals[self.row]
+    
+    @interval_days.setter
+    def interval_days(self, value: int):
+        self.store.intervals[self.row] = value
+    
+    @property
+    def lapses(self) -> int:
+        return self.store.lapses[self.row]
+    
+    @lapses.setter
+    def lapses(self, value: int):
+        self.store.lapses[self.row] = value
+    
+    @property
+    def next_due_day(self) -> int:
+        return self.store.next_due[self.row]
+    
+    @next_due_day.setter
+    def next_due_day(self, value: int):
+        self.store.next_due[self.row] = value
+    
+    @property
+    def dirty(self) -> bool:
+        return self.row in self.store.dirty_rows
+    
+    @dirty.setter
+    def dirty(self, value: bool):
+        if value:
+            self.store.dirty_rows.add(self.row)
+        else:
+            self.store.dirty_rows.discard(self.row)
+    
+    # Serialization and due-day logic are shared with Card
+    refresh_due_day = Card.refresh_due_day
+    to_csv_row = Card.to_csv_row
+    to_metadata = Card.to_metadata
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CardView):
+            return NotImplemented
+        return self.store is other.store and self.row == other.row
+    
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.row))
+    
+    def __repr__(self) -> str:
+        return f"CardView(row={self.row}, front={self.front!r}, state={self.state})"
+
+
+class CardStore:
+    """
+    Column-oriented card storage for very large decks.
+    
+    Fronts and backs are interned, so identical strings are shared between
+    every user's store on the same host. Numeric FSRS-6 fields live in typed
+    array columns (a few bytes each) instead of per-card objects. Indexing
+    returns CardView objects that behave like Card.
+    """
+    
+    # last_seen column value for "never seen" (ordinals start at 1)
+    NO_DAY = 0
+    
+    def __init__(self, cards: Iterable[Card] = ()):
+        self.ids = array('q')
+        self.fronts: list[str] = []
+        self.backs: list[str] = []
+        self.states = array('b')
+        self.stabilities = array('d')
+        self.difficulties = array('d')
+        self.intervals = array('i')
+        self.lapses = array('i')
+        self.last_seen = array('i')
+        self.next_due = array('i')
+        self.dirty_rows: set[int] = set()
+        self.extend(cards)
+    
+    def append(self, card: Card):
+        """Copy a card into the store."""
+        self.ids.append(card.card_id)
+        self.fronts.append(sys.intern(card.front))
+        self.backs.append(sys.intern(card.back))
+        self.states.append(card.state)
+        self.stabilities.append(card.stability)
+        self.difficulties.append(card.difficulty)
+        self.intervals.append(card.interval_days)
+        self.lapses.append(card.lapses)
+        self.last_seen.append(card.last_seen or self.NO_DAY)
+        self.next_due.append(card.next_due_day)
+        if card.dirty:
+            self.dirty_rows.add(len(self.fronts) - 1)
+    
+    def extend(self, cards: Iterable[Card]):
+        """Copy several cards into the store."""
+        for card in cards:
+            self.append(card)
+    
+    def __len__(self) -> int:
+        return len(self.fronts)
+    
+    def __getitem__(self, row: int) -> CardView:
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("card row out of range")
+        return CardView(self, row)
+    
+    def __iter__(self) -> Iterator[CardView]:
+        for row in range(len(self)):
+            yield CardView(self, row)
+    
+    def card(self, row: int) -> Card:
+        """Materialize a standalone Card copy of one row."""
+        view = self[row]
+        card = Card(front=view.front, back=view.back, state=view.state,
+                    last_seen=view.last_seen, stability=view.stability,
+                    difficulty=view.difficulty, interval_days=view.interval_days,
+                    lapses=view.lapses, card_id=view.card_id)
+        card.dirty = view.dirty
+        return card
+    
+    def to_cards(self) -> list[Card]:
+        """Materialize the whole store as a list of Card objects."""
+        return [self.card(row) for row in range(len(self))]
+
+
+@dataclass
+class ReviewEvent:
+    """One graded review from a deck's review log."""
+    card_id: int
+    timestamp: float
+    day: int  # Day ordinal the review was scheduled on
+    grade_again: bool
+    # Scheduler parameters in force (FSRS6Scheduler.log_parameters); None if not logged
+    params: Optional[tuple] = None
+
+
+@dataclass
+class DeckStats:
+    """
+    Running totals behind the stats screen.
+    
+    The scheduler keeps these current in O(1) per review (remove the card's
+    old values, add its new ones), so showing statistics never scans the
+    deck. from_cards recomputes everything from scratch, e.g. to verify the
+    running totals.
+    """
+    total_cards: int = 0
+    state_counts: list = field(default_factory=lambda: [0, 0, 0, 0])  # By state 0-3
+    difficulty_sum: float = 0.0
+    stability_sum: float = 0.0  # Over cards with stability > 0
+    stable_cards: int = 0
+    total_lapses: int = 0
+    
+    @classmethod
+    def from_cards(cls, cards: Iterable[Card]) -> 'DeckStats':
+        """Compute the statistics of a card list or CardStore from scratch."""
+        if isinstance(cards, CardStore):
+            # Column scans; no per-card views
+            states, difficulties = cards.states, cards.difficulties
+            stabilities, lapses = cards.stabilities, cards.lapses
+        else:
+            rows = [(card.state, card.difficulty, card.stability, card.lapses) for card in cards]
+            states, difficulties, stabilities, lapses = zip(*rows) if rows else ((),) * 4
+        counts = Counter(states)
+        positive = [stability for stability in stabilities if stability > 0]
+        return cls(
+            total_cards=len(states),
+            state_counts=[counts[state] for state in range(4)],
+            difficulty_sum=math.fsum(difficulties),
+            stability_sum=math.fsum(positive),
+            stable_cards=len(positive),
+            total_lapses=sum(lapses)
+        )
+    
+    def add(self, card: Card):
+        """Count a card (or a card's new values after scheduling)."""
+        self._apply(card, 1)
+    
+    def remove(self, card: Card):
+        """Uncount a card (or a card's old values before scheduling)."""
+        self._apply(card, -1)
+    
+    def _apply(self, card: Card, sign: int):
+        self.total_cards += sign
+        self.state_counts[card.state] += sign
+        self.difficulty_sum += sign * card.difficulty
+        if card.stability > 0:
+            self.stability_sum += sign * card.stability
+            self.stable_cards += sign
+        self.total_lapses += sign * card.lapses
+    
+    @property
+    def average_difficulty(self) -> float:
+        return self.difficulty_sum / self.total_cards if self.total_cards > 0 else 0.0
+    
+    @property
+    def average_stability(self) -> float:
+        return self.stability_sum / max(1, self.stable_cards)
+    
+    def to_dict(self) -> dict:
+        """Convert to dictionary for persistence."""
+        return {
+            'total_cards': self.total_cards,
+            'state_counts': list(self.state_counts),
+            'difficulty_sum': self.difficulty_sum,
+            'stability_sum': self.stability_sum,
+            'stable_cards': self.stable_cards,
+            'total_lapses': self.total_lapses
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Create from dictionary."""
+        return cls(
+            total_cards=data['total_cards'],
+            state_counts=list(data['state_counts']),
+            difficulty_sum=data['difficulty_sum'],
+            stability_sum=data['stability_sum'],
+            stable_cards=data['stable_cards'],
+            total_lapses=data['total_lapses']
+        )
+
+
+@dataclass
+class DeckHeader:
+    """
+    Small summary of a user's deck, read at login instead of the whole deck.
+    
+    Holds what the main menu and stats screen need: the card count, how
+    many cards fall due on each day and the deck statistics. source
+    fingerprints the saved data it summarizes, so a stale header can be
+    detected and ignored.
+    """
+    total_cards: int = 0
+    due_days: dict = field(default_factory=dict)  # next-due day ordinal -> card count
+    source: tuple = ()
+    stats: DeckStats = field(default_factory=DeckStats)
+    
+    @classmethod
+    def from_cards(cls, cards: Iterable[Card], source: tuple = ()) -> 'DeckHeader':
+        """Summarize a card list or CardStore."""
+        if isinstance(cards, CardStore):
+            days = cards.next_due
+        else:
+            days = (card.next_due_day for card in cards)
+        return cls(total_cards=len(cards), due_days=dict(Counter(days)), source=tuple(source),
+                   stats=DeckStats.from_cards(cards))
+    
+    def due_count(self, today: Optional[int] = None) -> int:
+        """Count cards due on the given day (default: today)."""
+        if today is None:
+            today = today_ordinal()
+        return sum(count for day, count in self.due_days.items() if day <= today)
+    
+    def forecast(self, days: int, today: Optional[int] = None) -> list[int]:
+        """Count cards falling due on each of the next days (see due_forecast)."""
+        return due_forecast(self.due_days.items(), days, today)
+    
+    def to_dict(self) -> dict:
+        """Convert to dictionary for persistence."""
+        return {
+            'total_cards': self.total_cards,
+            'due_days': {str(day): count for day, count in self.due_days.items()},
+            'source': list(self.source),
+            'stats': self.stats.to_dict()
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Create from dictionary."""
+        return cls(
+            total_cards=data['total_cards'],
+            due_days={int(day): count for day, count in data['due_days'].items()},
+            source=tuple(data['source']),
+            stats=DeckStats.from_dict(data['stats'])
+        )
+
+
+class DailyCounts:
+    """
+    Bounded record of how many cards were reviewed per day.
+    
+    The last RECENT_DAYS days live in a ring buffer indexed by day ordinal,
+    so the current day's count is read and incremented in O(1). As days
+    leave the ring their counts are folded into weekly totals (kept for
+    RECENT_WEEKS weeks) and monthly totals (kept indefinitely, one entry per
+    month), so storage no longer grows with every day of use.
+    """
+    RECENT_DAYS = 90
+    RECENT_WEEKS = 104
+    
+    def __init__(self):
+        self._days = array('i', bytes(4 * self.RECENT_DAYS))
+        self._latest = 0  # Newest day ordinal in the ring (0 = empty)
+        # Days that have left the ring: Monday ordinal -> count, 'YYYY-MM' -> count
+        self.weekly: dict[int, int] = {}
+        self.monthly: dict[str, int] = {}
+    
+    def _in_ring(self, day: int) -> bool:
+        return self._latest - self.RECENT_DAYS < day <= self._latest
+    
+    def _advance(self, day: int):
+        """Move the ring forward to end at day, folding out evicted days."""
+        if self._latest == 0:
+            self._latest = day
+            return
+        first_kept = day - self.RECENT_DAYS + 1
+        evict_from = max(self._latest - self.RECENT_DAYS + 1, 0)
+        for old in range(evict_from, min(first_kept, self._latest + 1)):
+            slot = old % self.RECENT_DAYS
+            if self._days[slot]:
+                self._fold(old, self._days[slot])
+                self._days[slot] = 0
+        self._latest = day
+        cutoff = day - 7 * self.RECENT_WEEKS
+        for monday in [monday for monday in self.weekly if monday <= cutoff]:
+            del self.weekly[monday]
+    
+    def _fold(self, day: int, count: int):
+        """Add a count for a day outside the ring to the aggregates."""
+        when = date.fromordinal(day)
+        monday = day - when.weekday()
+        if monday > self._latest - 7 * self.RECENT_WEEKS:
+            self.weekly[monday] = self.weekly.get(monday, 0) + count
+        month = when.strftime('%Y-%m')
+        self.monthly[month] = self.monthly.get(month, 0) + count
+    
+    def increment(self, day: int, count: int = 1):
+        """Add reviews to a day (a day ordinal). O(1) within the same day."""
+        if day > self._latest:
+            self._advance(day)
+        if self._in_ring(day):
+            self._days[day % self.RECENT_DAYS] += count
+        else:
+            self._fold(day, count)
+    
+    def get(self, day: int) -> int:
+        """Get the count for a day within the last RECENT_DAYS days (else 0). O(1)."""
+        return self._days[day % self.RECENT_DAYS] if self._in_ring(day) else 0
+    
+    def recent(self, days: int = 7, today: Optional[int] = None) -> list[tuple[int, int]]:
+        """Get (day ordinal, count) for the last days days, newest first. O(days)."""
+        if today is None:
+            today = today_ordinal()
+        days = min(days, self.RECENT_DAYS)
+        return [(day, self.get(day)) for day in range(today, today - days, -1)]
+    
+    def total(self) -> int:
+        """Get the number of reviews ever recorded."""
+        return sum(self._days) + sum(self.monthly.values())
+    
+    def __bool__(self) -> bool:
+        return self._latest != 0
+    
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, DailyCounts):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+    
+    def copy(self) -> 'DailyCounts':
+        """Create an independent copy."""
+        counts = DailyCounts()
+        counts._days = array('i', self._days)
+        counts._latest = self._latest
+        counts.weekly = dict(self.weekly)
+        counts.monthly = dict(self.monthly)
+        return counts
+    
+    def to_dict(self) -> dict:
+        """Convert to dictionary for persistence."""
+        recent = {}
+        if self._latest:
+            for day in range(self._latest - self.RECENT_DAYS + 1, self._latest + 1):
+                if day > 0 and self.get(day):
+                    recent[format_day(day)] = self.get(day)
+        return {
+            'latest': format_day(self._latest) if self._latest else None,
+            'recent': recent,
+            'weekly': {format_day(monday): count for monday, count in sorted(self.weekly.items())},
+            'monthly': dict(sorted(self.monthly.items()))
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DailyCounts':
+        """
+        Create from a dictionary.
+        
+        Also accepts the old unbounded {'YYYY-MM-DD': count} layout, whose
+        older days are folded into weekly and monthly totals.
+        """
+        counts = cls()
+        if 'recent' not in data:
+            for day, count in sorted((parse_day(key), count) for key, count in data.items()):
+                if day is not None:
+                    counts.increment(day, count)
+            return counts
+        
+        if data.get('latest'):
+            counts._advance(parse_day(data['latest']))
+        for key, count in data['recent'].items():
+            counts.increment(parse_day(key), count)
+        counts.weekly = {parse_day(key): count for key, count in data['weekly'].items()}
+        counts.monthly = dict(data['monthly'])
+        return counts
+
+
 @dataclass
 class DeckMetadata:
     """Global metadata for a deck."""
     max_per_day: int = 20
-    daily_counts: dict = field(default_factory=dict)  # date -> count
+    daily_counts: DailyCounts = field(default_factory=DailyCounts)
     allow_over_limit_today: bool = False
+    # Batches saved by grading.grade_many; orders this copy against the one
+    # a JSON journal line carries (see PersistenceManager.load_deck_metadata)
+    graded_batches: int = 0
+    
+    # True while there are changes that are not persisted yet
+    dirty: bool = field(default=False, repr=False, compare=False)
     
     def to_dict(self) -> dict:
         """Convert to dictionary for persistence."""
         return {
             'max_per_day': self.max_per_day,
-            'daily_counts': self.daily_counts,
-            'allow_over_limit_today': self.allow_over_limit_today
+            'daily_counts': self.daily_counts.to_dict(),
+            'allow_over_limit_today': self.allow_over_limit_today,
+            'graded_batches': self.graded_batches
         }
     
+    def copy(self) -> 'DeckMetadata':
+        """Create an independent copy (e.g. to hand to a background writer)."""
+        return DeckMetadata(
+            max_per_day=self.max_per_day,
+            daily_counts=self.daily_counts.copy(),
+            allow_over_limit_today=self.allow_over_limit_today,
+            graded_batches=self.graded_batches,
+            dirty=self.dirty
+        )
+    
     @classmethod
     def from_dict(cls, data: dict):
         """Create from dictionary."""
         return cls(
             max_per_day=data.get('max_per_day', 20),
-            daily_counts=data.get('daily_counts', {}),
-            allow_over_limit_today=data.get('allow_over_limit_today', False)
+            daily_counts=DailyCounts.from_dict(data.get('daily_counts', {})),
+            allow_over_limit_today=data.get('allow_over_limit_today', False),
+            graded_batches=data.get('graded_batches', 0)
         )
     
     def get_today_count(self) -> int:
         """Get count of cards reviewed today."""
-        today = datetime.now().strftime('%Y-%m-%d')
-        return self.daily_counts.get(today, 0)
+        return self.daily_counts.get(today_ordinal())
     
     def increment_today_count(self):
         """Increment today's review count."""
-        today = datetime.now().strftime('%Y-%m-%d')
-        self.daily_counts[today] = self.daily_counts.get(today, 0) + 1
+        self.daily_counts.increment(today_ordinal())
+        self.dirty = True
     
     def can_review_more(self) -> bool:
         """Check if more cards can be reviewed today."""
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+Per-user fitting of the FSRS-6 scheduler constants to review history.
+
+The scheduler predicts that a card with stability S is still recalled t
+days after its last review with probability R = 0.9^(t/S). For each user
+this module finds the constants (FSRS6Scheduler.FITTED_PARAMETERS) that
+minimize the log-loss of that prediction against the actual Again/Good
+outcomes in the review log.
+
+Under the scheduler's update rules, log S before a review is linear in the
+logs of the four stability constants, with coefficients that depend only on
+the card's earlier grades (which initial stability applied, how many Again
+and Good reviews followed) plus a difficulty term. Samples with the same
+grade counts share the constants' part of log S, so the recalled samples
+(whose loss is linear in 1/S) reduce to one sum per distinct grade-count
+row, and the loss, exact gradient and Hessian cost one pass over the
+forgotten samples. The stability constants are solved for with Newton's
+method. The two difficulty constants change the difficulty term, so they
+are tuned by a short coordinate search around the Newton fit.
+
+Users are independent and are fitted in parallel by a process pool. The
+result is written to each user's fsrs_params.json, which the app applies
+with FSRS6Scheduler.load_parameters.
+
+Usage:
+    python3 optimizer.py                  # fit every user
+    python3 optimizer.py --user alice --dry-run
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from operator import mul
+from typing import Iterable, Optional
+from durable import atomic_write_bytes
+from fsrs import FSRS6Scheduler
+from models import ReviewEvent
+from persistence import PersistenceManager
+from process_pool import map_in_workers
+from replay import open_backend
+from sqlite_persistence import DEFAULT_DB_PATH, SqlitePersistenceManager
+from user_settings import UserSettings
+
+
+LN_09 = math.log(0.9)
+
+# Reviews needed (after each card's first) before a user is fitted
+MIN_REVIEWS = 100
+
+# Pull of the defaults on the log-constants; matters only for short histories
+RIDGE = 2.0
+
+# Newton stopping rules: largest step in log-parameter space (0.01% change),
+# or total log-loss improvement too small to matter
+NEWTON_TOLERANCE = 1e-4
+LOSS_TOLERANCE = 1e-3
+MAX_NEWTON_STEPS = 25
+
+# Newton steps per difficulty trial; only the winner is refitted to convergence
+TRIAL_NEWTON_STEPS = 3
+
+# Multiplicative steps tried on each difficulty constant, coarse to fine
+DIFFICULTY_STEPS = (2.0, 1.41)
+
+# Version of fsrs_params.json
+PARAMS_FORMAT = 1
+
+
+class _Samples:
+    """Training samples of one outcome (recalled or forgotten) as columns."""
+    
+    def __init__(self):
+        self.elapsed = array('d')    # Days since the previous review
+        self.rows = array('i')       # Sample's feature row (see ReviewHistory.features)
+        self.card_rows = array('i')  # Sample's card, to rebuild the difficulty term
+        self.positions = array('i')  # Sample's review number within its card
+    
+    def __len__(self) -> int:
+        return len(self.elapsed)
+
+
+@dataclass
+class ReviewHistory:
+    """A user's review log arranged for fitting."""
+    grades: list = field(default_factory=list)  # Per card: list of grade_again flags
+    # Distinct feature vectors: (first review Again, first review Good, Again
+    # reviews since, Good reviews since); log S is their dot product with the
+    # log-constants plus the difficulty term
+    features: list = field(default_factory=list)
+    columns: dict = field(default_factory=dict)  # Feature columns and products, by name
+    recalled: _Samples = field(default_factory=_Samples)
+    forgotten: _Samples = field(default_factory=_Samples)
+    
+    @property
+    def samples(self) -> int:
+        return len(self.recalled) + len(self.forgotten)
+    
+    @classmethod
+    def from_events(cls, events: Iterable[ReviewEvent]) -> 'ReviewHistory':
+        """
+        Build training samples from a review log (oldest first).
+        
+        Every review after a card's first is a sample: whether it was
+        recalled after the days elapsed since the previous review. Same-day
+        repeats carry no forgetting information and are skipped as samples
+        (they still update the card's state).
+        """
+        by_card: dict[int, tuple[list, list]] = {}
+        for event in events:
+            days, grades = by_card.setdefault(event.card_id, ([], []))
+            days.append(event.day)
+            grades.append(event.grade_again)
+        
+        history = cls()
+        rows: dict[tuple, int] = {}
+        for card_row, (days, grades) in enumerate(by_card.values()):
+            history.grades.append(grades)
+            first_again = 1.0 if grades[0] else 0.0
+            agains = goods = 0
+            for position in range(1, len(grades)):
+                elapsed = days[position] - days[position - 1]
+                if elapsed > 0:
+                    vector = (first_again, 1.0 - first_again, float(agains), float(goods))
+                    samples = history.forgotten if grades[position] else history.recalled
+                    samples.elapsed.append(elapsed)
+                    samples.rows.append(rows.setdefault(vector, len(rows)))
+                    samples.card_rows.append(card_row)
+                    samples.positions.append(position)
+                if grades[position]:
+                    agains += 1
+                else:
+                    goods += 1
+        history.features = list(rows)
+        columns = [array('d', column) for column in zip(*rows)] or [array('d')] * 4
+        first, rest, agains, goods = columns
+        history.columns = {
+            'first': first, 'rest': rest, 'agains': agains, 'goods': goods,
+            'fa': array('d', map(mul, first, agains)), 'fg': array('d', map(mul, first, goods)),
+            'aa': array('d', map(mul, agains, agains)), 'ag': array('d', map(mul, agains, goods)),
+            'gg': array('d', map(mul, goods, goods)),
+        }
+        return history
+    
+    def difficulty_terms(self, increase_step: float, decay_step: float) -> dict:
+        """
+        Get each sample's difficulty term: the sum of log((11 - D) / 10) over
+        the card's Good reviews before the sample, after its first review
+        (no longer accumulated once below -50).
+        
+        Returns:
+            Terms for the recalled and the forgotten samples
+        """
+        # Running term before each review, per card
+        before: list[list] = []
+        log = math.log
+        for grades in self.grades:
+            terms = [0.0]
+            difficulty = 5.0
+            total = 0.0
+            for grade_again in grades:
+                if grade_again:
+                    difficulty = min(10.0, difficulty + increase_step)
+                else:
+                    difficulty = max(1.0, difficulty + decay_step)
+                    if len(terms) > 1 and total > -50.0:
+                        total += log((11 - difficulty) / 10)
+                terms.append(total)
+            before.append(terms)
+        return {
+            outcome: array('d', [before[row][position] for row, position in
+                                 zip(samples.card_rows, samples.positions)])
+            for outcome, samples in (('recalled', self.recalled), ('forgotten', self.forgotten))
+        }
+
+
+class _Terms:
+    """A history's difficulty terms for one choice of the difficulty constants."""
+    
+    def __init__(self, history: ReviewHistory, increase_step: float, decay_step: float):
+        self.values = history.difficulty_terms(increase_step, decay_step)
+        # Elapsed days over the difficulty part of S, so u = ln(0.9) * scaled / e^(theta.x)
+        self.scaled = {
+            outcome: array('d', map(lambda t, c: t * math.exp(-c), samples.elapsed,
+                                    self.values[outcome]))
+            for outcome, samples in (('recalled', history.recalled),
+                                     ('forgotten', history.forgotten))
+        }
+        # Recalled samples enter the loss linearly, so each feature row needs only a sum
+        self.recalled_sums = [0.0] * len(history.features)
+        for row, s in zip(history.recalled.rows, self.scaled['recalled']):
+            self.recalled_sums[row] += s
+
+
+def _row_scales(history: ReviewHistory, theta: list) -> list:
+    """ln(0.9) / e^(theta.x) for each feature row (the exponent limited to +-50)."""
+    again0, good0, again_factor, good_factor = theta
+    columns = history.columns
+    exp = math.exp
+    return [LN_09 * exp(-z if -50.0 < z < 50.0 else -50.0 if z > 0 else 50.0)
+            for z in [again0 * f + good0 * r + again_factor * a + good_factor * g
+                      for f, r, a, g in zip(columns['first'], columns['rest'],
+                                            columns['agains'], columns['goods'])]]
+
+
+def _penalty(theta: list, prior: list) -> float:
+    return 0.5 * RIDGE * sum((value - center) ** 2 for value, center in zip(theta, prior))
+
+
+def log_loss(history: ReviewHistory, terms: _Terms, theta: list, prior: list) -> float:
+    """Total log-loss (plus the ridge penalty) of the predictions."""
+    scales = _row_scales(history, theta)
+    # Recalled: -ln(R) = -u
+    loss = -sum(map(mul, scales, terms.recalled_sums))
+    # Forgotten: -ln(1 - R)
+    expm1 = math.expm1
+    try:
+        loss -= sum(map(math.log, [-expm1(scales[row] * s) for row, s in
+                                   zip(history.forgotten.rows, terms.scaled['forgotten'])]))
+    except ValueError:
+        return math.inf  # Constants so extreme that a prediction is exactly 1
+    return loss + _penalty(theta, prior)
+
+
+def _moments(history: ReviewHistory, first: list, second: list) -> tuple:
+    """
+    Chain per-feature-row derivatives of the loss with respect to log S
+    (first and second) through the features to theta.
+    """
+    columns = history.columns
+    dot = lambda weights, name: sum(map(mul, weights, columns[name]))
+    gradient = [dot(first, 'first'), dot(first, 'rest'), dot(first, 'agains'),
+                dot(first, 'goods')]
+    f, r, a, g = (dot(second, 'first'), dot(second, 'rest'), dot(second, 'agains'),
+                  dot(second, 'goods'))
+    fa, fg, ag = dot(second, 'fa'), dot(second, 'fg'), dot(second, 'ag')
+    hessian = [
+        [f, 0.0, fa, fg],
+        [0.0, r, a - fa, g - fg],
+        [fa, a - fa, dot(second, 'aa'), ag],
+        [fg, g - fg, ag, dot(second, 'gg')],
+    ]
+    return gradient, hessian
+
+
+def _newton_terms(history: ReviewHistory, terms: _Terms, theta: list) -> tuple:
+    """Gradient and Hessian of the log-loss with respect to theta."""
+    scales = _row_scales(history, theta)
+    # Recalled: loss -u, so d/dz = u and d2/dz2 = -u
+    first = list(map(mul, scales, terms.recalled_sums))
+    second = [-u for u in first]
+    
+    # Forgotten: loss -ln(1 - e^u)
+    exp, expm1 = math.exp, math.expm1
+    for row, s in zip(history.forgotten.rows, terms.scaled['forgotten']):
+        u = scales[row] * s
+        retained = exp(u)
+        lost = -expm1(u)
+        first[row] -= u * retained / lost
+        second[row] += retained * u * (u + lost) / (lost * lost)
+    return _moments(history, first, second)
+
+
+def _solve(matrix: list, vector: list) -> list:
+    """Solve a small dense linear system by Gaussian elimination with pivoting."""
+    n = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(col + 1, n):
+            factor = rows[r][col] / rows[col][col]
+            for c in range(col, n + 1):
+                rows[r][c] -= factor * rows[col][c]
+    solution = [0.0] * n
+    for r in reversed(range(n)):
+        solution[r] = (rows[r][n] - sum(rows[r][c] * solution[c]
+                                        for c in range(r + 1, n))) / rows[r][r]
+    return solution
+
+
+def _shift_terms(history: ReviewHistory, old: _Terms, new: _Terms, theta: list) -> list:
+    """
+    Starting point for a fit with new difficulty terms: theta moved so that
+    log S stays as close as possible (least squares) to its old values.
+    """
+    change = [0.0] * len(history.features)
+    counts = [0.0] * len(history.features)
+    for outcome, samples in (('recalled', history.recalled), ('forgotten', history.forgotten)):
+        for row, before, after in zip(samples.rows, old.values[outcome], new.values[outcome]):
+            change[row] += before - after
+            counts[row] += 1
+    gradient, hessian = _moments(history, change, counts)
+    for i in range(4):
+        hessian[i][i] += 1e-9  # Features absent from the history stay put
+    return [value + delta for value, delta in zip(theta, _solve(hessian, gradient))]
+
+
+def _fit_stability(history: ReviewHistory, terms: _Terms, theta: list, prior: list,
+                   max_steps: int = MAX_NEWTON_STEPS) -> tuple[list, float]:
+    """Newton's method (with step halving) on the log stability constants."""
+    loss = log_loss(history, terms, theta, prior)
+    for _ in range(max_steps):
+        gradient, hessian = _newton_terms(history, terms, theta)
+        for i in range(4):
+            gradient[i] += RIDGE * (theta[i] - prior[i])
+            hessian[i][i] += RIDGE
+        step = _solve(hessian, [-value for value in gradient])
+        if max(abs(delta) for delta in step) < NEWTON_TOLERANCE:
+            break
+        scale = 1.0
+        while True:
+            candidate = [value + scale * delta for value, delta in zip(theta, step)]
+            candidate_loss = log_loss(history, terms, candidate, prior)
+            if candidate_loss <= loss or scale < 1e-4:
+                break
+            scale /= 2
+        if candidate_loss > loss:
+            break
+        theta, loss, improvement = candidate, candidate_loss, loss - candidate_loss
+        if improvement < LOSS_TOLERANCE:
+            break
+    return theta, loss
+
+
+@dataclass
+class FitResult:
+    """Outcome of fitting one user."""
+    user: str
+    reviews: int = 0  # Training samples used
+    parameters: Optional[dict] = None  # None if the history was too short
+    log_loss: float = 0.0  # Mean per review, fitted
+    baseline_log_loss: float = 0.0  # Mean per review, current constants
+    seconds: float = 0.0
+
+
+def fit_parameters(history: ReviewHistory, scheduler: Optional[FSRS6Scheduler] = None,
+                   user: str = '') -> FitResult:
+    """
+    Fit the scheduler constants to a review history.
+    
+    Args:
+        history: Training data (see ReviewHistory.from_events)
+        scheduler: Scheduler whose intensity (and current constants, the
+                   starting point) the fit is for; default FSRS6Scheduler()
+        user: Name recorded on the result
+    """
+    start = time.perf_counter()
+    scheduler = scheduler or FSRS6Scheduler()
+    result = FitResult(user, reviews=history.samples)
+    if history.samples < MIN_REVIEWS:
+        result.seconds = time.perf_counter() - start
+        return result
+    
+    growth, adjust = scheduler.stabilityGrowth, scheduler.diffAdjust
+    prior = [math.log(scheduler.initial_stability_again),
+             math.log(scheduler.initial_stability_good),
+             math.log(scheduler.stability_factor_again),
+             math.log(scheduler.stability_factor_good / growth)]
+    increase, decay = scheduler.difficulty_increase, scheduler.difficulty_decay
+    
+    terms = _Terms(history, increase * adjust, decay * adjust)
+    result.baseline_log_loss = log_loss(history, terms, prior, prior) / history.samples
+    theta, loss = _fit_stability(history, terms, prior, prior)
+    
+    # Coordinate search on the difficulty constants; each trial gets a few
+    # Newton steps from the current fit, enough to rank it
+    for factor in DIFFICULTY_STEPS:
+        for index in (0, 1):
+            for candidate in (factor, 1 / factor):
+                trial = [increase, decay]
+                trial[index] *= candidate
+                trial_terms = _Terms(history, trial[0] * adjust, trial[1] * adjust)
+                shifted = _shift_terms(history, terms, trial_terms, theta)
+                trial_theta, trial_loss = _fit_stability(history, trial_terms, shifted, prior,
+                                                         TRIAL_NEWTON_STEPS)
+                if trial_loss < loss:
+                    (increase, decay), theta, loss = trial, trial_theta, trial_loss
+                    terms = trial_terms
+                    break
+    theta, loss = _fit_stability(history, terms, theta, prior)
+    
+    result.parameters = {
+        'initial_stability_again': math.exp(theta[0]),
+        'initial_stability_good': math.exp(theta[1]),
+        'stability_factor_again': math.exp(theta[2]),
+        'stability_factor_good': math.exp(theta[3]) * growth,
+        'difficulty_decay': decay,
+        'difficulty_increase': increase,
+    }
+    result.log_loss = (loss - _penalty(theta, prior)) / history.samples
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def save_parameters(path, result: FitResult):
+    """Write a fit in the format FSRS6Scheduler.load_parameters reads."""
+    data = {
+        'format': PARAMS_FORMAT,
+        'parameters': result.parameters,
+        'reviews': result.reviews,
+        'log_loss': result.log_loss,
+        'baseline_log_loss': result.baseline_log_loss,
+        'fitted_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    atomic_write_bytes(path, json.dumps(data, indent=2).encode('utf-8'))
+
+
+def fit_user(persistence: PersistenceManager, user: str, deck_name: str,
+             save: bool = True) -> FitResult:
+    """Fit one user from their review log and (optionally) save the parameters."""
+    settings = UserSettings(user, base_dir=str(persistence.base_dir))
+    scheduler = FSRS6Scheduler(settings.effective_intensity(), settings.request_retention)
+    history = ReviewHistory.from_events(persistence.iter_review_events(user, deck_name))
+    result = fit_parameters(history, scheduler, user)
+    if save and result.parameters is not None:
+        save_parameters(settings.params_file, result)
+    return result
+
+
+def fit_users(users: list[str], deck_name: str, base_dir: str, db_path: Optional[str] = None,
+              save: bool = True, processes: Optional[int] = None) -> list[FitResult]:
+    """
+    Fit many users across a process pool.
+    
+    Args:
+        users: Users to fit
+        deck_name: Deck whose review log is used
+        base_dir: JSON user data directory (parameter files are written here)
+        db_path: SQLite database to read reviews from instead of the JSON files
+        save: Write each user's fsrs_params.json
+        processes: Worker processes (default: one per CPU; 1 runs in-process)
+    
+    Returns:
+        One result per user, in the order given
+    """
+    # Each worker process opens the backend once
+    return map_in_workers(partial(fit_user, deck_name=deck_name, save=save), users,
+                          open_backend, (base_dir, db_path), processes)
+
+
+def main():
+    """Fit scheduler constants for users from their review logs."""
+    parser = argparse.ArgumentParser(description="Fit FSRS-6 constants to review history")
+    parser.add_argument('--data', default="data/users",
+                        help="JSON user data directory (default: data/users)")
+    parser.add_argument('--db', default=None,
+                        help=f"SQLite database (default: {DEFAULT_DB_PATH} if it exists)")
+    parser.add_argument('--deck', default="hiragana", help="Deck name (default: hiragana)")
+    parser.add_argument('--user', action='append', dest='users', metavar='USER',
+                        help="User to fit (repeatable; default: every user)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Report the fits without writing parameter files")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Worker processes (default: one per CPU)")
+    args = parser.parse_args()
+    
+    db_path = args.db
+    if db_path is None and os.path.exists(DEFAULT_DB_PATH):
+        db_path = DEFAULT_DB_PATH
+    users = args.users
+    if users is None:
+        persistence = open_backend(args.data, db_path)
+        users = persistence.list_users()
+        if isinstance(persistence, SqlitePersistenceManager):
+            persistence.close()
+    
+    for result in fit_users(users, args.deck, args.data, db_path, not args.dry_run,
+                            args.processes):
+        if result.parameters is None:
+            print(f"{result.user}: {result.reviews} reviews, too few to fit "
+                  f"(need {MIN_REVIEWS})")
+            continue
+        values = ", ".join(f"{name}={value:.3f}" for name, value in result.parameters.items())
+        print(f"{result.user}: {result.reviews} reviews, log-loss "
+              f"{result.baseline_log_loss:.4f} -> {result.log_loss:.4f} "
+              f"({result.seconds:.2f}s)\n  {values}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,18 +2,211 @@
 Persistence layer for saving/loading deck and card data.
 """
 import csv
+import itertools
 import json
 import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
-from models import Card, DeckMetadata
+from typing import Iterator, Optional
+from deck_snapshot import MappedCardStore, encode_snapshot, read_source
+from durable import DurabilityPolicy, WriteGroup, atomic_write_bytes, sync_paths
+from models import Card, CardStore, DeckHeader, DeckMetadata, ReviewEvent, make_card_id
+
+
+# Positional fields of one review journal record (one JSON array per line).
+# grade_again is null for records written by a save rather than a review.
+# params (the scheduler's log_parameters) is only present on graded records
+# written since reviews became replayable. Journals written before card IDs
+# existed hold the front in place of card_id.
+JOURNAL_FIELDS = ('card_id', 'timestamp', 'grade_again', 'stability', 'difficulty',
+                  'interval_days', 'lapses', 'state', 'last_seen', 'params')
+
+# Journal lines parsed per json.loads call
+JOURNAL_BATCH_LINES = 4096
+
+
+def read_journal_records(f) -> Iterator[list]:
+    """
+    Stream the records of an open journal file.
+    
+    Lines are parsed a batch at a time as one JSON array, which is several
+    times faster than one json.loads per line. A batch holding a torn line
+    (from a crash mid-append) falls back to line by line, skipping it.
+    A line holding a list of records (an atomic append) yields each one,
+    as does one holding them with the deck metadata.
+    """
+    while True:
+        lines = list(itertools.islice(f, JOURNAL_BATCH_LINES))
+        if not lines:
+            return
+        try:
+            records = json.loads('[' + ','.join(lines) + ']')
+        except json.JSONDecodeError:
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        for record in records:
+            if isinstance(record, dict):
+                yield from record['reviews']
+            elif record and isinstance(record[0], list):
+                yield from record
+            else:
+                yield record
+
+
+def read_journal_deck_metadata(journal: Path) -> Optional[dict]:
+    """Get the deck metadata saved by a journal's last graded batch, if any."""
+    latest = None
+    try:
+        with open(journal, 'rb') as f:
+            for line in f:
+                # Only batches saved with their deck metadata are objects
+                if line.startswith(b'{'):
+                    try:
+                        latest = json.loads(line)['deck_metadata']
+                    except ValueError:
+                        continue  # Torn by a crash: the batch is lost as a whole
+    except FileNotFoundError:
+        return None
+    return latest
+
+
+def review_event(record: list) -> Optional[ReviewEvent]:
+    """Convert a journal record to a ReviewEvent, or None if it has no grade."""
+    grade_again = record[2]
+    if grade_again is None:
+        return None
+    card_id = record[0]
+    if isinstance(card_id, str):
+        card_id = make_card_id(card_id)  # Front-keyed legacy record
+    params = record[9] if len(record) > 9 else None
+    # Positional: noticeably faster than keywords over a whole review log
+    return ReviewEvent(card_id, record[1], record[8], bool(grade_again),
+                       tuple(params) if params is not None else None)
+
+
+# Version of cards_metadata.json. Version 1 files were a bare dict keyed by
+# card front; version 2 wraps a dict keyed by card ID.
+METADATA_FORMAT = 2
+
+
+def read_metadata_file(path: Path) -> dict:
+    """Read a cards_metadata.json file into a dict keyed by card ID."""
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data.get('format'), int):
+        return {int(card_id): values for card_id, values in data['cards'].items()}
+    # Front-keyed file from before card IDs (duplicate fronts shared one entry)
+    return {make_card_id(front): values for front, values in data.items()}
+
+
+def encode_metadata(metadata: dict) -> bytes:
+    """Serialize ID-keyed card metadata in the current file format."""
+    data = {
+        'format': METADATA_FORMAT,
+        'cards': {str(card_id): values for card_id, values in metadata.items()}
+    }
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+@dataclass
+class SaveStats:
+    """Counters for what persistence writes cost."""
+    writes: int = 0
+    records: int = 0
+    bytes: int = 0
+    
+    def add(self, other: 'SaveStats'):
+        """Accumulate another set of counters into this one."""
+        self.writes += other.writes
+        self.records += other.records
+        self.bytes += other.bytes
+
+
+class DeckContentCache:
+    """
+    Parse-once cache of shared deck CSV files.
+    
+    Deck content (front, back and default state) is read-only and shared by
+    every user, so each file is parsed once per process and reused until its
+    modification time or size changes.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple] = {}
+        self.parse_count = 0
+    
+    def rows(self, csv_path: str) -> list[dict]:
+        """Get the parsed rows of a deck CSV. Callers must not modify them."""
+        path = os.path.abspath(csv_path)
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+        
+        rows = []
+        occurrences: dict[str, int] = {}
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                front = row['front'] = sys.intern(row['front'])
+                row['back'] = sys.intern(row['back'])
+                # IDs are assigned here, once per parse, and reused by every load
+                occurrence = occurrences.get(front, 0)
+                occurrences[front] = occurrence + 1
+                row['id'] = make_card_id(front, occurrence)
+                rows.append(row)
+        with self._lock:
+            self._entries[path] = (key, rows)
+            self.parse_count += 1
+        return rows
+    
+    def clear(self):
+        """Drop all cached decks."""
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every PersistenceManager in the process
+deck_content_cache = DeckContentCache()
 
 
 class PersistenceManager:
     """Manages persistence of card and deck metadata."""
     
-    def __init__(self, base_dir: str = "data/users"):
+    # Card metadata is stored as a snapshot plus an append-only review journal.
+    # Once the journal grows past this size it is folded into the snapshot.
+    COMPACT_THRESHOLD_BYTES = 256 * 1024
+    
+    def __init__(self, base_dir: str = "data/users",
+                 compact_threshold_bytes: int = COMPACT_THRESHOLD_BYTES,
+                 durability: Optional[DurabilityPolicy] = None):
         self.base_dir = Path(base_dir)
+        self.compact_threshold_bytes = compact_threshold_bytes
+        self.durability = durability or DurabilityPolicy()
+        self._journal_lock = threading.Lock()
+        self._compactions: dict[Path, threading.Thread] = {}
+        
+        # Write group of the logical save in progress on each thread, and
+        # files written by groups that skipped their fsync
+        self._groups = threading.local()
+        self._unsynced: set[Path] = set()
+        self._unsynced_lock = threading.Lock()
+        
+        # What the most recent write cost, and running totals
+        self.last_save = SaveStats()
+        self.save_totals = SaveStats()
     
     def get_user_deck_dir(self, user: str, deck_name: str) -> Path:
         """Get the directory for a user's deck data."""
@@ -25,43 +218,342 @@ class PersistenceManager:
         deck_dir.mkdir(parents=True, exist_ok=True)
         return deck_dir
     
-    def save_card_metadata(self, user: str, deck_name: str, cards: list[Card]):
-        """Save card metadata to JSON file."""
+    @contextmanager
+    def write_group(self) -> Iterator[WriteGroup]:
+        """
+        Group the writes of one logical save so they share one sync barrier.
+        
+        Nested calls on the same thread join the outermost group. Whether the
+        group is fsynced is decided by the durability policy.
+        """
+        group = getattr(self._groups, 'current', None)
+        if group is not None:
+            yield group
+            return
+        
+        group = WriteGroup(sync=self.durability.next_save_syncs())
+        self._groups.current = group
+        try:
+            with group:
+                yield group
+        finally:
+            self._groups.current = None
+        
+        with self._unsynced_lock:
+            if group.sync:
+                # This barrier also covers earlier unsynced writes
+                pending, self._unsynced = self._unsynced - group.paths, set()
+            else:
+                self._unsynced |= group.paths
+                pending = set()
+        if pending:
+            sync_paths(pending)
+    
+    def sync(self):
+        """Force every write made so far to disk (e.g. at session end)."""
+        with self._unsynced_lock:
+            pending, self._unsynced = self._unsynced, set()
+        sync_paths(pending)
+    
+    def _record_save(self, records: int, nbytes: int) -> SaveStats:
+        """Update the save counters after a write."""
+        stats = SaveStats(writes=1, records=records, bytes=nbytes)
+        self.last_save = stats
+        self.save_totals.add(stats)
+        return stats
+    
+    def save_card_metadata(self, user: str, deck_name: str, cards: list[Card],
+                           full: bool = False) -> SaveStats:
+        """
+        Save card metadata, writing only cards marked dirty.
+        
+        Dirty cards are appended to the review journal as delta records. A
+        full snapshot is written when requested or when none exists yet.
+        
+        Returns:
+            Counters for the records and bytes written
+        """
+        deck_dir = self.ensure_user_deck_dir(user, deck_name)
+        if full or not (deck_dir / "cards_metadata.json").exists():
+            return self._write_snapshot(user, deck_name, cards)
+        
+        if isinstance(cards, CardStore):
+            dirty = [cards[row] for row in sorted(cards.dirty_rows)]
+        else:
+            dirty = [card for card in cards if card.dirty]
+        if not dirty:
+            return self._record_save(0, 0)
+        stats = self.append_reviews(
+            user, deck_name, [self.review_record(card, None) for card in dirty])
+        for card in dirty:
+            card.dirty = False
+        self.maybe_compact(user, deck_name)
+        return stats
+    
+    def _write_snapshot(self, user: str, deck_name: str, cards: list[Card]) -> SaveStats:
+        """Write a full metadata snapshot and archive the journal it supersedes."""
         deck_dir = self.ensure_user_deck_dir(user, deck_name)
         metadata_file = deck_dir / "cards_metadata.json"
         
-        # Build metadata dict keyed by front side of card
-        metadata = {}
-        for card in cards:
-            metadata[card.front] = card.to_metadata()
+        metadata = {card.card_id: card.to_metadata() for card in cards}
+        data = encode_metadata(metadata)
         
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        self.wait_for_compaction(user, deck_name)
+        with self._journal_lock:
+            # Always synced: the journal it replaces is deleted next
+            with WriteGroup(sync=True) as group:
+                group.write(metadata_file, data)
+            # The snapshot now covers every journaled review
+            for journal in (deck_dir / "reviews.journal.compacting", deck_dir / "reviews.journal"):
+                self._archive_journal(journal)
+        for card in cards:
+            card.dirty = False
+        return self._record_save(len(metadata), len(data))
     
     def load_card_metadata(self, user: str, deck_name: str) -> dict:
-        """Load card metadata from JSON file."""
+        """
+        Load card metadata keyed by card ID.
+        
+        Reads the JSON snapshot and replays the review journal over it.
+        Front-keyed files from older versions are converted on the fly and
+        rewritten in the new format by the next snapshot or compaction.
+        """
         deck_dir = self.get_user_deck_dir(user, deck_name)
-        metadata_file = deck_dir / "cards_metadata.json"
+        metadata = read_metadata_file(deck_dir / "cards_metadata.json")
         
-        if not metadata_file.exists():
-            return {}
+        # An interrupted compaction leaves its rotated journal behind
+        for journal in (deck_dir / "reviews.journal.compacting", deck_dir / "reviews.journal"):
+            self._replay_journal(journal, metadata)
+        return metadata
+    
+    @staticmethod
+    def review_record(card: Card, grade_again: Optional[bool],
+                      timestamp: Optional[float] = None,
+                      params: Optional[list] = None) -> list:
+        """
+        Build a journal record (see JOURNAL_FIELDS) for a card's current state.
         
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        Pass the scheduler's log_parameters() with graded reviews so they can
+        be replayed (see replay.py).
+        """
+        if timestamp is None:
+            timestamp = round(time.time(), 3)
+        grade = None if grade_again is None else int(grade_again)
+        record = [card.card_id, timestamp, grade, card.stability, card.difficulty,
+                  card.interval_days, card.lapses, card.state, card.last_seen]
+        if params is not None:
+            record.append(list(params))
+        return record
+    
+    def append_review(self, user: str, deck_name: str, card: Card, grade_again: bool,
+                      timestamp: Optional[float] = None, params: Optional[list] = None):
+        """
+        Append one graded review to the deck's journal.
+        
+        Writes a single compact line holding the card's resulting state, so
+        the cost of a grade does not depend on deck size.
+        """
+        self.append_reviews(
+            user, deck_name, [self.review_record(card, grade_again, timestamp, params)])
+        card.dirty = False
+    
+    def append_reviews(self, user: str, deck_name: str, records: list[list],
+                       atomic: bool = False,
+                       deck_metadata: Optional[DeckMetadata] = None) -> SaveStats:
+        """
+        Append several journal records with a single write.
+        
+        With atomic, the records share one journal line: a crash mid-append
+        tears that line, and readers then skip all of the records rather
+        than keeping the ones written before the crash. Deck metadata given
+        with an atomic append is saved in the same line; load_deck_metadata
+        prefers it to deck_metadata.json until that file has caught up.
+        """
+        deck_dir = self.ensure_user_deck_dir(user, deck_name)
+        if deck_metadata is not None:
+            line = {'reviews': records, 'deck_metadata': deck_metadata.to_dict()}
+            data = (json.dumps(line, ensure_ascii=False, separators=(',', ':'))
+                    + '\n').encode('utf-8')
+        elif atomic:
+            data = (json.dumps(records, ensure_ascii=False, separators=(',', ':'))
+                    + '\n').encode('utf-8')
+        else:
+            data = ''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+                           for record in records).encode('utf-8')
+        
+        with self.write_group() as group, self._journal_lock:
+            group.append(deck_dir / "reviews.journal", data)
+        if deck_metadata is not None:
+            deck_metadata.dirty = False
+        return self._record_save(len(records), len(data))
+    
+    def _replay_journal(self, journal: Path, metadata: dict):
+        """Apply journal records to a metadata dict in order."""
+        if not journal.exists():
+            return
+        # Only each card's last record matters
+        latest = {}
+        with open(journal, 'r', encoding='utf-8') as f:
+            for values in read_journal_records(f):
+                card_id = values[0]
+                if isinstance(card_id, str):
+                    card_id = make_card_id(card_id)  # Front-keyed legacy record
+                latest[card_id] = values
+        state_fields = JOURNAL_FIELDS[3:9]
+        for card_id, values in latest.items():
+            metadata[card_id] = dict(zip(state_fields, values[3:9]))
+    
+    def _archive_journal(self, journal: Path):
+        """
+        Move a journal's graded reviews into the deck's review history.
+        
+        Call with the journal lock held once the journal's state is saved
+        elsewhere; the journal is deleted afterwards. Segments are named
+        after the journal's modification time, so repeating an interrupted
+        archive rewrites the same segment instead of duplicating reviews.
+        Deck metadata saved in the journal but not yet in deck_metadata.json
+        is written there first.
+        """
+        if not journal.exists():
+            return
+        journaled = read_journal_deck_metadata(journal)
+        if journaled is not None:
+            metadata_file = journal.parent / "deck_metadata.json"
+            saved = self._read_deck_metadata(metadata_file)
+            if journaled['graded_batches'] > saved.graded_batches:
+                with WriteGroup(sync=True) as group:
+                    group.write(metadata_file, json.dumps(journaled, indent=2).encode('utf-8'))
+        graded = []
+        with open(journal, 'r', encoding='utf-8') as f:
+            for record in read_journal_records(f):
+                if len(record) > 2 and record[2] is not None:
+                    graded.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        if graded:
+            history_dir = journal.parent / "history"
+            history_dir.mkdir(exist_ok=True)
+            # The rotated journal is always older than the live one
+            rank = 0 if journal.suffix == '.compacting' else 1
+            segment = history_dir / f"reviews-{journal.stat().st_mtime_ns:020d}-{rank}.journal"
+            with WriteGroup(sync=True) as group:
+                group.write(segment, ('\n'.join(graded) + '\n').encode('utf-8'))
+        journal.unlink()
+    
+    def iter_review_events(self, user: str, deck_name: str) -> Iterator[ReviewEvent]:
+        """
+        Stream a deck's graded reviews, oldest first.
+        
+        Reads the archived review history and then the journal. All files
+        are opened up front, so a compaction running meanwhile neither hides
+        nor repeats reviews.
+        """
+        deck_dir = self.get_user_deck_dir(user, deck_name)
+        files = []
+        with self._journal_lock:
+            paths = sorted((deck_dir / "history").glob("reviews-*.journal"))
+            for path in paths + [deck_dir / "reviews.journal.compacting",
+                                 deck_dir / "reviews.journal"]:
+                try:
+                    files.append(open(path, 'r', encoding='utf-8'))
+                except FileNotFoundError:
+                    continue
+        try:
+            for f in files:
+                for record in read_journal_records(f):
+                    event = review_event(record)
+                    if event is not None:
+                        yield event
+        finally:
+            for f in files:
+                f.close()
+    
+    def journal_size(self, user: str, deck_name: str) -> int:
+        """Get the size in bytes of the deck's review journal."""
+        journal = self.get_user_deck_dir(user, deck_name) / "reviews.journal"
+        return journal.stat().st_size if journal.exists() else 0
+    
+    def maybe_compact(self, user: str, deck_name: str) -> bool:
+        """
+        Start a background compaction if the journal is past the threshold.
+        
+        Returns:
+            True if a compaction was started
+        """
+        if self.journal_size(user, deck_name) < self.compact_threshold_bytes:
+            return False
+        deck_dir = self.get_user_deck_dir(user, deck_name)
+        running = self._compactions.get(deck_dir)
+        if running is not None and running.is_alive():
+            return False
+        
+        thread = threading.Thread(target=self.compact, args=(user, deck_name),
+                                  name=f"compact-{user}-{deck_name}")
+        self._compactions[deck_dir] = thread
+        thread.start()
+        return True
+    
+    def compact(self, user: str, deck_name: str):
+        """
+        Fold the review journal into the metadata snapshot.
+        
+        The journal is rotated under the lock so new reviews can keep being
+        appended while the snapshot is rebuilt. Its graded reviews are then
+        archived to the review history.
+        """
+        deck_dir = self.get_user_deck_dir(user, deck_name)
+        journal = deck_dir / "reviews.journal"
+        rotated = deck_dir / "reviews.journal.compacting"
+        with self._journal_lock:
+            if journal.exists() and not rotated.exists():
+                os.replace(journal, rotated)
+        if not rotated.exists():
+            return
+        
+        metadata_file = deck_dir / "cards_metadata.json"
+        metadata = read_metadata_file(metadata_file)
+        self._replay_journal(rotated, metadata)
+        
+        data = encode_metadata(metadata)
+        with self._journal_lock:
+            with WriteGroup(sync=True) as group:
+                group.write(metadata_file, data)
+            self._archive_journal(rotated)
     
-    def save_deck_metadata(self, user: str, deck_name: str, deck_metadata: DeckMetadata):
+    def wait_for_compaction(self, user: str, deck_name: str):
+        """Block until any running background compaction of the deck finishes."""
+        thread = self._compactions.get(self.get_user_deck_dir(user, deck_name))
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+    
+    def save_deck_metadata(self, user: str, deck_name: str,
+                           deck_metadata: DeckMetadata) -> SaveStats:
         """Save deck metadata to JSON file."""
         deck_dir = self.ensure_user_deck_dir(user, deck_name)
         metadata_file = deck_dir / "deck_metadata.json"
         
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(deck_metadata.to_dict(), f, indent=2)
+        data = json.dumps(deck_metadata.to_dict(), indent=2).encode('utf-8')
+        with self.write_group() as group:
+            group.write(metadata_file, data)
+        deck_metadata.dirty = False
+        return self._record_save(1, len(data))
     
     def load_deck_metadata(self, user: str, deck_name: str) -> DeckMetadata:
-        """Load deck metadata from JSON file."""
-        deck_dir = self.get_user_deck_dir(user, deck_name)
-        metadata_file = deck_dir / "deck_metadata.json"
+        """
+        Load deck metadata from JSON file.
         
+        A batch of grades saves the deck metadata in its journal line too
+        (see append_reviews). If that copy counts more graded batches, the
+        file was not rewritten after the batch, so the copy is used.
+        """
+        deck_dir = self.get_user_deck_dir(user, deck_name)
+        deck_metadata = self._read_deck_metadata(deck_dir / "deck_metadata.json")
+        for journal in (deck_dir / "reviews.journal.compacting", deck_dir / "reviews.journal"):
+            journaled = read_journal_deck_metadata(journal)
+            if journaled is not None and journaled['graded_batches'] > deck_metadata.graded_batches:
+                deck_metadata = DeckMetadata.from_dict(journaled)
+        return deck_metadata
+    
+    @staticmethod
+    def _read_deck_metadata(metadata_file: Path) -> DeckMetadata:
         if not metadata_file.exists():
             return DeckMetadata()
         
@@ -70,23 +562,129 @@ class PersistenceManager:
             return DeckMetadata.from_dict(data)
     
     def load_deck_from_csv(self, csv_path: str, user: str, deck_name: str) -> list[Card]:
-        """Load cards from CSV file and merge with saved metadata."""
+        """Load cards from the shared deck CSV and overlay the user's saved metadata."""
         cards = []
         
         # Load card metadata
         card_metadata = self.load_card_metadata(user, deck_name)
         
-        # Read CSV
-        with open(csv_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Get metadata for this card if it exists
-                metadata = card_metadata.get(row['front'])
-                card = Card.from_csv_and_metadata(row, metadata)
-                cards.append(card)
+        # Deck content is parsed once and shared between users
+        for row in deck_content_cache.rows(csv_path):
+            # Get metadata for this card if it exists
+            metadata = card_metadata.get(row['id'])
+            card = Card.from_csv_and_metadata(row, metadata)
+            cards.append(card)
         
         return cards
     
+    def load_card_store(self, csv_path: str, user: str, deck_name: str) -> CardStore:
+        """Load a deck into a compact column store instead of a Card list."""
+        store = CardStore()
+        card_metadata = self.load_card_metadata(user, deck_name)
+        
+        for row in deck_content_cache.rows(csv_path):
+            metadata = card_metadata.get(row['id'])
+            store.append(Card.from_csv_and_metadata(row, metadata))
+        
+        return store
+    
+    def _deck_source(self, csv_path: str, user: str, deck_name: str) -> tuple:
+        """Fingerprint the data a deck snapshot or header is built from."""
+        deck_dir = self.get_user_deck_dir(user, deck_name)
+        csv_stat = os.stat(csv_path)
+        try:
+            metadata_stat = (deck_dir / "cards_metadata.json").stat()
+            metadata = (metadata_stat.st_mtime_ns, metadata_stat.st_size)
+        except FileNotFoundError:
+            metadata = (0, 0)
+        journal = sum(path.stat().st_size for path in (
+            deck_dir / "reviews.journal", deck_dir / "reviews.journal.compacting")
+            if path.exists())
+        return (csv_stat.st_mtime_ns, csv_stat.st_size) + metadata + (journal,)
+    
+    def save_deck_snapshot(self, csv_path: str, user: str, deck_name: str,
+                           cards: list[Card]) -> SaveStats:
+        """
+        Write a binary snapshot of a user's merged deck for fast loading.
+        
+        Call once pending reviews are saved (e.g. at session end) so the
+        snapshot matches the saved metadata and the next open can map it.
+        """
+        deck_dir = self.ensure_user_deck_dir(user, deck_name)
+        snapshot_file = deck_dir / "deck.snapshot"
+        data = encode_snapshot(cards, self._deck_source(csv_path, user, deck_name))
+        if isinstance(cards, MappedCardStore) and Path(cards.path) == snapshot_file:
+            # Windows cannot replace a mapped file, so unmap it for the
+            # replace (the rows are already encoded) and map the new file
+            cards.close()
+            try:
+                atomic_write_bytes(snapshot_file, data)
+            finally:
+                cards.reopen()
+        else:
+            with self.write_group() as group:
+                group.write(snapshot_file, data)
+        return self._record_save(len(cards), len(data))
+    
+    def open_deck_snapshot(self, csv_path: str, user: str, deck_name: str) -> CardStore:
+        """
+        Open a user's deck as a memory-mapped CardStore.
+        
+        Rows are decoded lazily from the mapped file, so opening costs about
+        the same for any deck size. A missing, stale or unreadable snapshot
+        is rebuilt from the CSV and saved metadata first.
+        """
+        snapshot_file = self.get_user_deck_dir(user, deck_name) / "deck.snapshot"
+        if read_source(snapshot_file) == self._deck_source(csv_path, user, deck_name):
+            try:
+                return MappedCardStore(snapshot_file)
+            except (OSError, ValueError):
+                pass  # Fresh header over a damaged body: treat it as stale
+        store = self.load_card_store(csv_path, user, deck_name)
+        self.save_deck_snapshot(csv_path, user, deck_name, store)
+        return MappedCardStore(snapshot_file)
+    
+    def save_deck_header(self, csv_path: str, user: str, deck_name: str,
+                         cards: list[Card]) -> SaveStats:
+        """
+        Write the small summary (card count, due-day histogram) read at login.
+        
+        Like save_deck_snapshot, call once pending reviews are saved.
+        """
+        deck_dir = self.ensure_user_deck_dir(user, deck_name)
+        header = DeckHeader.from_cards(cards, self._deck_source(csv_path, user, deck_name))
+        data = json.dumps(header.to_dict()).encode('utf-8')
+        with self.write_group() as group:
+            group.write(deck_dir / "deck_header.json", data)
+        return self._record_save(1, len(data))
+    
+    def load_deck_header(self, csv_path: str, user: str, deck_name: str) -> Optional[DeckHeader]:
+        """Load the deck header, or None if it is missing or out of date."""
+        header_file = self.get_user_deck_dir(user, deck_name) / "deck_header.json"
+        try:
+            with open(header_file, 'r', encoding='utf-8') as f:
+                header = DeckHeader.from_dict(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+        if header.source != self._deck_source(csv_path, user, deck_name):
+            return None
+        return header
+    
+    def export_deck_csv(self, csv_path: str, user: str, deck_name: str, output_path: str) -> int:
+        """
+        Write a user's merged view of a deck (content plus progress) to a new CSV.
+        
+        The shared source CSV is never modified.
+        
+        Returns:
+            Number of cards exported
+        """
+        if os.path.abspath(output_path) == os.path.abspath(csv_path):
+            raise ValueError("Refusing to overwrite the shared deck CSV; choose another path")
+        cards = self.load_deck_from_csv(csv_path, user, deck_name)
+        self.save_deck_to_csv(output_path, cards)
+        return len(cards)
+    
     def save_deck_to_csv(self, csv_path: str, cards: list[Card]):
         """Save cards to CSV file (only front, back, state, lastSeen)."""
         with open(csv_path, 'w', encoding='utf-8', newline='') as f:
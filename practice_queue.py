@@ -0,0 +1,141 @@
+"""
+Practice queue selection: which due cards a session shows, and in what order.
+
+When more cards are due than the daily limit allows, the queue takes the
+ones the chosen ordering ranks first. heapq.nsmallest keeps only the best
+`limit` candidates, so building a queue from n due cards is O(n log k)
+rather than a full sort. Orderings rank by a key computed from each card's
+schedule (lower = shown sooner) and are registered in ORDERINGS, so new ones
+can be plugged in by name.
+
+New cards have nothing to forget yet: the at-risk orderings rank them after
+every review card. A new_ratio instead reserves that share of the queue for
+new cards (taken in deck order) and spreads them evenly among the reviews.
+"""
+import heapq
+import math
+from typing import Callable, Iterable, Optional
+from models import Card, CardStore, today_ordinal
+
+
+class _Field:
+    """Row-indexed access to one attribute of a card list, like a CardStore column."""
+    
+    def __init__(self, cards: list[Card], name: str):
+        self.cards = cards
+        self.name = name
+    
+    def __getitem__(self, row: int):
+        return getattr(self.cards[row], self.name)
+
+
+def _fields(cards) -> tuple:
+    """Get the state, stability, last-seen and next-due columns of a deck."""
+    if isinstance(cards, CardStore) or hasattr(cards, 'next_due'):
+        # A CardStore, or other columns under its names (e.g. a workload trial's)
+        return cards.states, cards.stabilities, cards.last_seen, cards.next_due
+    return (_Field(cards, 'state'), _Field(cards, 'stability'), _Field(cards, 'last_seen'),
+            _Field(cards, 'next_due_day'))
+
+
+def deck_order(cards, rows: list[int], today: int) -> list:
+    """Rank cards by their position in the deck."""
+    return rows
+
+
+def most_overdue(cards, rows: list[int], today: int) -> list:
+    """Rank review cards by how many days ago they fell due; new cards last."""
+    states, _, _, next_due = _fields(cards)
+    return [next_due[row] if states[row] else math.inf for row in rows]
+
+
+def lowest_retrievability(cards, rows: list[int], today: int) -> list:
+    """
+    Rank review cards by current retrievability, least likely to be recalled
+    first; new cards last.
+    
+    Retrievability is 0.9^(t/S) (see FSRS6Scheduler.retrievability), which
+    falls as t/S grows, so -t/S ranks identically without the power.
+    """
+    states, stabilities, last_seen, _ = _fields(cards)
+    keys = []
+    for row in rows:
+        if not states[row]:
+            keys.append(math.inf)
+            continue
+        seen = last_seen[row]
+        stability = stabilities[row]
+        keys.append((seen - today) / stability if seen and stability > 0 else -math.inf)
+    return keys
+
+
+# Name -> function(cards, rows, today) returning one sort key per row
+ORDERINGS: dict[str, Callable[..., list]] = {
+    'deck': deck_order,
+    'overdue': most_overdue,
+    'retrievability': lowest_retrievability,
+}
+
+
+def _interleave(reviews: list, new: list) -> list:
+    """Spread the new cards evenly through the reviews."""
+    total = len(reviews) + len(new)
+    queue = []
+    next_review = next_new = 0
+    for position in range(1, total + 1):
+        # Place a new card whenever their share so far falls behind
+        if next_new < len(new) and (next_review >= len(reviews)
+                                    or (next_new + 1) * total <= position * len(new)):
+            queue.append(new[next_new])
+            next_new += 1
+        else:
+            queue.append(reviews[next_review])
+            next_review += 1
+    return queue
+
+
+def build_queue(cards, rows: Iterable[int], limit: Optional[int] = None,
+                ordering: str = 'retrievability', new_ratio: Optional[float] = None,
+                today: Optional[int] = None) -> list[int]:
+    """
+    Choose and order the cards for a practice session.
+    
+    Args:
+        cards: The deck (card list, CardStore, or an object with a CardStore's
+               states, stabilities, last_seen and next_due columns)
+        rows: Rows of the due cards
+        limit: Most cards to return (None: all of them)
+        ordering: Name of an ORDERINGS entry
+        new_ratio: Share of the queue reserved for new cards (0-1), or None
+                   to rank new cards with the rest under the ordering
+        today: Day ordinal to measure elapsed time from (default: today)
+    
+    Returns:
+        Rows in the order to show them
+    
+    Raises:
+        ValueError: If the ordering is unknown
+    """
+    rank = ORDERINGS.get(ordering)
+    if rank is None:
+        raise ValueError(f"Unknown practice ordering '{ordering}'")
+    if today is None:
+        today = today_ordinal()
+    rows = list(rows)
+    if limit is None:
+        limit = len(rows)
+    
+    if new_ratio is None:
+        keys = rank(cards, rows, today)
+        return [row for _, row in heapq.nsmallest(limit, zip(keys, rows))]
+    
+    states = _fields(cards)[0]
+    new_rows = [row for row in rows if not states[row]]
+    review_rows = [row for row in rows if states[row]]
+    # Reserve the new cards' share; either kind fills what the other leaves
+    new_count = min(len(new_rows), round(limit * max(0.0, min(1.0, new_ratio))))
+    review_count = min(len(review_rows), limit - new_count)
+    new_count = min(len(new_rows), limit - review_count)
+    keys = rank(cards, review_rows, today)
+    reviews = [row for _, row in heapq.nsmallest(review_count, zip(keys, review_rows))]
+    return _interleave(reviews, heapq.nsmallest(new_count, new_rows))
@@ -0,0 +1,56 @@
+"""
+Process-pool fan-out shared by the batch tools (optimizer, replay, workload).
+
+Each worker process builds a context once, e.g. opens the storage backend
+or receives the deck, and then runs many tasks against it. With a single
+process or a single task everything runs in the calling process instead.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, Optional
+
+
+# Built once per worker process by its initializer
+_worker_context: Any = None
+
+
+def _init_worker(setup: Callable, setup_args: tuple):
+    global _worker_context
+    _worker_context = setup(*setup_args)
+
+
+def _run_task(task: Callable, item):
+    return task(_worker_context, item)
+
+
+def shared(value):
+    """Setup that gives every worker the same value (pickled once per worker)."""
+    return value
+
+
+def map_in_workers(task: Callable, items: Iterable, setup: Callable, setup_args: tuple = (),
+                   processes: Optional[int] = None) -> list:
+    """
+    Run task(context, item) for every item across a process pool.
+    
+    Args:
+        task: Picklable function of a worker's context and one item
+        items: Task inputs
+        setup: Picklable function building a worker's context from setup_args
+        setup_args: Arguments of setup
+        processes: Worker processes (default: one per CPU; 1 runs in-process)
+    
+    Returns:
+        One result per item, in order
+    """
+    items = list(items)
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(items) <= 1:
+        context = setup(*setup_args)
+        return [task(context, item) for item in items]
+    # Several items per task keeps inter-process overhead small
+    chunksize = max(1, len(items) // (processes * 4))
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(setup, setup_args)) as pool:
+        return list(pool.map(partial(_run_task, task), items, chunksize=chunksize))
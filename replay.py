@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Replay of the review log to rebuild or audit card state.
+
+Every graded review is logged with its day, grade and the scheduler
+parameters in force (see PersistenceManager.iter_review_events). Replaying
+a deck starts each reviewed card from new and schedules its reviews again
+in order, each day's reviews together through FSRS6Scheduler.schedule_batch
+(which gives exactly the state schedule_card would):
+
+    - with the logged parameters, the result must match the saved state
+      (an audit); cards whose progress was imported rather than reviewed
+      show up as mismatches
+    - with new parameters, the result is what the history would have
+      produced under them, and can be written back (a rebuild)
+
+Users are independent, so they are replayed in parallel by a process pool
+and each deck's log is streamed rather than loaded whole.
+
+Usage:
+    python3 replay.py                             # audit every user
+    python3 replay.py --intensity 7 --rebuild     # re-apply history with new parameters
+"""
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import repeat
+from typing import Iterable, Optional
+from fsrs import FSRS6Scheduler
+from models import Card, ReviewEvent, parse_day
+from persistence import PersistenceManager
+from process_pool import map_in_workers
+from sqlite_persistence import DEFAULT_DB_PATH, SqlitePersistenceManager
+
+
+# Cap on individually reported mismatched card IDs (the count is always exact)
+MAX_REPORTED = 100
+
+# Replay state of a card not reviewed yet, in schedule_batch's column order:
+# state, stability, difficulty, interval, lapses, last seen
+_NEW_CARD = (0, 0.0, 5.0, 0, 0, None)
+
+
+@dataclass
+class ReplayReport:
+    """Outcome of replaying one user's deck."""
+    user: str
+    deck_name: str
+    events: int = 0
+    cards: int = 0  # Cards with at least one review
+    mismatch_count: int = 0
+    mismatched: list = field(default_factory=list)  # Card IDs, first MAX_REPORTED only
+    rebuilt: int = 0
+    seconds: float = 0.0
+
+
+def replay_events(events: Iterable[ReviewEvent],
+                  scheduler: Optional[FSRS6Scheduler] = None) -> dict[int, Card]:
+    """
+    Recompute card state by scheduling every review again, in log order.
+    
+    Args:
+        events: Graded reviews, oldest first
+        scheduler: Scheduler for every review; by default each review uses
+                   the parameters logged with it
+    
+    Returns:
+        Replayed cards (content-less) keyed by card ID
+    """
+    states, _ = _replay(events, scheduler)
+    return {card_id: _card(card_id, state) for card_id, state in states.items()}
+
+
+def _replay(events: Iterable[ReviewEvent], scheduler: Optional[FSRS6Scheduler] = None,
+            balanced: Optional[set[int]] = None) -> tuple[dict[int, tuple], int]:
+    """
+    Replay events in batches of one day and one set of logged parameters.
+    
+    Args:
+        events: Graded reviews, oldest first
+        scheduler: Scheduler for every review (default: the logged parameters)
+        balanced: If given, receives the cards whose last review was logged
+                  with load balancing
+    
+    Returns:
+        (replayed state keyed by card ID, in _NEW_CARD's order; number of events)
+    """
+    states: dict[int, tuple] = {}
+    schedulers: dict[Optional[tuple], FSRS6Scheduler] = {}
+    count = 0
+    day = params = None
+    card_ids: list[int] = []
+    grades: list[bool] = []
+    for event in events:
+        count += 1
+        if event.day != day or event.params != params:
+            if card_ids:
+                _schedule_day(states, schedulers, scheduler, day, params, card_ids, grades,
+                              balanced)
+                card_ids, grades = [], []
+            day, params = event.day, event.params
+        card_ids.append(event.card_id)
+        grades.append(event.grade_again)
+    if card_ids:
+        _schedule_day(states, schedulers, scheduler, day, params, card_ids, grades, balanced)
+    return states, count
+
+
+def _card(card_id: int, replayed: tuple) -> Card:
+    """Build a content-less card from its replayed state."""
+    state, stability, difficulty, interval, lapses, last_seen = replayed
+    return Card(front='', back='', state=state, last_seen=last_seen, stability=stability,
+                difficulty=difficulty, interval_days=interval, lapses=lapses, card_id=card_id)
+
+
+def _saved_state(values: dict) -> tuple:
+    """Put saved card metadata in _NEW_CARD's order, with Card's defaults."""
+    return (values.get('state', 0), values.get('stability', 0.0),
+            values.get('difficulty', 5.0), values.get('interval_days', 0),
+            values.get('lapses', 0), parse_day(values.get('last_seen')))
+
+
+def _schedule_day(states: dict[int, tuple], schedulers: dict, scheduler: Optional[FSRS6Scheduler],
+                  day: int, params: Optional[tuple], card_ids: list[int], grades: list[bool],
+                  balanced: Optional[set[int]]):
+    """Schedule one day's reviews logged with the same parameters."""
+    active = scheduler
+    if active is None:
+        active = schedulers.get(params)
+        if active is None:
+            active = schedulers[params] = FSRS6Scheduler.from_log_parameters(params)
+    if balanced is not None:
+        if FSRS6Scheduler.logged_load_balance(params):
+            balanced.update(card_ids)
+        else:
+            balanced.difference_update(card_ids)
+    
+    for ids, round_grades in _rounds(card_ids, grades):
+        # Gather the cards' columns, schedule them, and scatter them back
+        columns = list(map(list, zip(*map(states.get, ids, repeat(_NEW_CARD)))))
+        # No due counts: intervals logged with load balancing are not
+        # rebalanced, just as schedule_card does for cards outside a due index
+        active.schedule_batch(*columns[:5], round_grades, last_seen=columns[5], today=day)
+        states.update(zip(ids, zip(*columns)))
+
+
+def _rounds(card_ids: list[int], grades: list[bool]) -> Iterable[tuple[list, list]]:
+    """
+    Split a day's reviews into batches of distinct cards.
+    
+    A card reviewed several times that day is in one round per review, in
+    log order, like grading.grade_many.
+    """
+    if len(set(card_ids)) == len(card_ids):
+        yield card_ids, grades
+        return
+    rounds: list[tuple[list, list]] = []
+    seen: dict[int, int] = {}
+    for card_id, grade_again in zip(card_ids, grades):
+        n = seen.get(card_id, 0)
+        seen[card_id] = n + 1
+        if n == len(rounds):
+            rounds.append(([], []))
+        rounds[n][0].append(card_id)
+        rounds[n][1].append(grade_again)
+    yield from rounds
+
+
+def replay_deck(persistence: PersistenceManager, user: str, deck_name: str,
+                params: Optional[list] = None, rebuild: bool = False) -> ReplayReport:
+    """
+    Replay one user's review log and compare it with the saved card state.
+    
+    Args:
+        persistence: Storage backend
+        user: Username
+        deck_name: Deck to replay
+        params: log_parameters()-style parameters to replay every review
+                with (default: the logged ones)
+        rebuild: Save the replayed state of every mismatched card
+    """
+    start = time.perf_counter()
+    report = ReplayReport(user, deck_name)
+    scheduler = FSRS6Scheduler.from_log_parameters(params) if params is not None else None
+    balanced: set[int] = set()
+    states, report.events = _replay(persistence.iter_review_events(user, deck_name),
+                                    scheduler, balanced)
+    report.cards = len(states)
+    
+    stored = persistence.load_card_metadata(user, deck_name)
+    changed = []
+    for card_id, replayed in states.items():
+        values = stored.get(card_id)
+        if values is not None:
+            saved = _saved_state(values)
+            # The load balancer only moves an interval within its fuzz window,
+            # and nothing else depends on it, so such a shift is not a mismatch
+            # when the saved interval came from a balanced review
+            interval = replayed[3]
+            if card_id in balanced and saved[3] != interval:
+                low, high = FSRS6Scheduler.fuzz_window(interval)
+                if low <= saved[3] <= high:
+                    saved = saved[:3] + (interval,) + saved[4:]
+            if saved == replayed:
+                continue
+        report.mismatch_count += 1
+        if len(report.mismatched) < MAX_REPORTED:
+            report.mismatched.append(card_id)
+        changed.append(_card(card_id, replayed))
+    
+    if rebuild and changed:
+        persistence.append_reviews(
+            user, deck_name, [persistence.review_record(card, None) for card in changed])
+        persistence.maybe_compact(user, deck_name)
+        persistence.wait_for_compaction(user, deck_name)
+        report.rebuilt = len(changed)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def open_backend(base_dir: str, db_path: Optional[str] = None) -> PersistenceManager:
+    """Open the SQLite database if given, else the JSON files under base_dir."""
+    if db_path is not None:
+        return SqlitePersistenceManager(db_path, base_dir=base_dir)
+    return PersistenceManager(base_dir)
+
+
+def replay_users(users: list[str], deck_name: str, base_dir: str,
+                 db_path: Optional[str] = None, params: Optional[list] = None,
+                 rebuild: bool = False, processes: Optional[int] = None) -> list[ReplayReport]:
+    """
+    Replay many users' decks across a process pool.
+    
+    Args:
+        users: Users to replay
+        deck_name: Deck to replay for each user
+        base_dir: JSON user data directory
+        db_path: SQLite database to use instead of the JSON files
+        params: Parameters to replay with (default: the logged ones)
+        rebuild: Save replayed state that differs from the saved state
+        processes: Worker processes (default: one per CPU; 1 runs in-process)
+    
+    Returns:
+        One report per user, in the order given
+    """
+    # Each worker process opens the backend once
+    job = partial(replay_deck, deck_name=deck_name, params=params, rebuild=rebuild)
+    return map_in_workers(job, users, open_backend, (base_dir, db_path), processes)
+
+
+def main():
+    """Audit or rebuild card state from the review log."""
+    parser = argparse.ArgumentParser(description="Replay review logs through FSRS-6")
+    parser.add_argument('--data', default="data/users",
+                        help="JSON user data directory (default: data/users)")
+    parser.add_argument('--db', default=None,
+                        help=f"SQLite database (default: {DEFAULT_DB_PATH} if it exists)")
+    parser.add_argument('--deck', default="hiragana", help="Deck name (default: hiragana)")
+    parser.add_argument('--user', action='append', dest='users', metavar='USER',
+                        help="User to replay (repeatable; default: every user)")
+    parser.add_argument('--intensity', type=float,
+                        help="Replay with this intensity instead of the logged parameters")
+    parser.add_argument('--retention', type=float, default=0.9,
+                        help="Request retention used with --intensity (default: 0.9)")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Save the replayed state of cards that differ")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Worker processes (default: one per CPU)")
+    args = parser.parse_args()
+    
+    db_path = args.db
+    if db_path is None and os.path.exists(DEFAULT_DB_PATH):
+        db_path = DEFAULT_DB_PATH
+    users = args.users
+    if users is None:
+        persistence = open_backend(args.data, db_path)
+        users = persistence.list_users()
+        if isinstance(persistence, SqlitePersistenceManager):
+            persistence.close()
+    params = [args.intensity, args.retention] if args.intensity is not None else None
+    
+    start = time.perf_counter()
+    reports = replay_users(users, args.deck, args.data, db_path, params, args.rebuild,
+                           args.processes)
+    elapsed = time.perf_counter() - start
+    for report in reports:
+        if report.mismatch_count:
+            action = "rebuilt" if report.rebuilt else "differ"
+            print(f"{report.user}: {report.mismatch_count} of {report.cards} reviewed cards "
+                  f"{action}")
+    events = sum(report.events for report in reports)
+    mismatches = sum(report.mismatch_count for report in reports)
+    print(f"Replayed {events:,} reviews for {len(reports)} users in {elapsed:.2f}s; "
+          f"{mismatches:,} cards differ from the saved state")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+SQLite storage backend for deck and card data.
+
+Drop-in replacement for PersistenceManager for large decks: card metadata
+lives in one indexed table, saves only upsert the rows that changed, and
+reviews are appended as single-row transactions.
+
+Migrate existing JSON data with:
+    python3 sqlite_persistence.py data/users data/flashcards.db
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from datetime import date
+from typing import Iterable, Iterator, Optional
+from durable import DurabilityPolicy, WriteGroup
+from models import Card, CardStore, DeckMetadata, ReviewEvent, make_card_id
+from persistence import PersistenceManager, SaveStats
+
+
+# Default database location used by the application once data is migrated
+DEFAULT_DB_PATH = "data/flashcards.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS cards (
+    user TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    card_id INTEGER NOT NULL,
+    stability REAL NOT NULL,
+    difficulty REAL NOT NULL,
+    interval_days INTEGER NOT NULL,
+    lapses INTEGER NOT NULL,
+    state INTEGER NOT NULL,
+    last_seen INTEGER,
+    next_due INTEGER NOT NULL,
+    PRIMARY KEY (user, deck, card_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cards_next_due ON cards (user, deck, next_due);
+CREATE TABLE IF NOT EXISTS decks (
+    user TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    PRIMARY KEY (user, deck)
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    user TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    card_id INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    grade_again INTEGER NOT NULL,
+    day INTEGER,
+    params TEXT
+);
+CREATE INDEX IF NOT EXISTS reviews_user_deck ON reviews (user, deck, timestamp);
+CREATE TABLE IF NOT EXISTS deck_revisions (
+    user TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    PRIMARY KEY (user, deck)
+);
+"""
+
+UPSERT_CARD = """
+INSERT INTO cards (user, deck, card_id, stability, difficulty, interval_days,
+                   lapses, state, last_seen, next_due)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user, deck, card_id) DO UPDATE SET
+    stability = excluded.stability,
+    difficulty = excluded.difficulty,
+    interval_days = excluded.interval_days,
+    lapses = excluded.lapses,
+    state = excluded.state,
+    last_seen = excluded.last_seen,
+    next_due = excluded.next_due
+"""
+
+
+# Copies front-keyed tables from databases created before card IDs
+MIGRATE_FRONT_KEYS = """
+INSERT OR REPLACE INTO cards
+SELECT user, deck, make_card_id(front), stability, difficulty, interval_days,
+       lapses, state, last_seen, next_due
+FROM cards_by_front;
+INSERT INTO reviews (user, deck, card_id, timestamp, grade_again)
+SELECT user, deck, make_card_id(front), timestamp, grade_again FROM reviews_by_front;
+DROP TABLE cards_by_front;
+DROP TABLE reviews_by_front
+"""
+
+UPSERT_DECK = """
+INSERT INTO decks (user, deck, metadata) VALUES (?, ?, ?)
+ON CONFLICT (user, deck) DO UPDATE SET metadata = excluded.metadata
+"""
+
+# Bumped in every transaction that changes a deck's cards
+BUMP_REVISION = """
+INSERT INTO deck_revisions (user, deck, revision) VALUES (?, ?, 1)
+ON CONFLICT (user, deck) DO UPDATE SET revision = revision + 1
+"""
+
+
+class SqlitePersistenceManager(PersistenceManager):
+    """Manages persistence of card and deck metadata in a SQLite database."""
+    
+    # Reviews read per query when streaming the review log
+    REVIEW_PAGE_ROWS = 5000
+    
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, base_dir: str = "data/users",
+                 durability: Optional[DurabilityPolicy] = None):
+        super().__init__(base_dir, durability=durability)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL commits are atomic either way; FULL also syncs every commit.
+        # Otherwise commits reach the disk at checkpoints (see write_group).
+        if self.durability.level == DurabilityPolicy.EVERY_GRADE:
+            self._conn.execute("PRAGMA synchronous=FULL")
+        else:
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.create_function("make_card_id", 1, make_card_id, deterministic=True)
+        self._migrate_front_keys()
+        self._conn.executescript(SCHEMA)
+        self._add_review_log_columns()
+    
+    def _migrate_front_keys(self):
+        """Re-key a database created before card IDs, in one transaction."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cards)")}
+        if 'front' not in columns:
+            return
+        statements = [
+            "ALTER TABLE cards RENAME TO cards_by_front",
+            "ALTER TABLE reviews RENAME TO reviews_by_front",
+            "DROP INDEX IF EXISTS cards_next_due",
+            "DROP INDEX IF EXISTS reviews_user_deck",
+        ] + SCHEMA.split(';') + MIGRATE_FRONT_KEYS.split(';')
+        self._conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                if statement.strip():
+                    self._conn.execute(statement)
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+    
+    def _add_review_log_columns(self):
+        """Add the replay columns to a reviews table created before they existed."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(reviews)")}
+        with self._conn:
+            for name, kind in (('day', 'INTEGER'), ('params', 'TEXT')):
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE reviews ADD COLUMN {name} {kind}")
+    
+    @contextmanager
+    def write_group(self) -> Iterator[WriteGroup]:
+        """
+        Group one logical save, as PersistenceManager.write_group.
+        
+        Under every_n durability, every Nth logical save checkpoints the
+        WAL, which syncs it and every earlier commit. every_grade commits
+        are already synced, and session_end waits for sync().
+        """
+        outermost = getattr(self._groups, 'current', None) is None
+        with super().write_group() as group:
+            yield group
+        if outermost and group.sync and self.durability.level == DurabilityPolicy.EVERY_N:
+            self.sync()
+    
+    def sync(self):
+        """Checkpoint the WAL so every committed save is on disk."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(FULL)")
+    
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+    
+    @staticmethod
+    def _card_row(card: Card) -> tuple:
+        return (card.stability, card.difficulty, card.interval_days, card.lapses,
+                card.state, card.last_seen, card.next_due_day)
+    
+    @staticmethod
+    def _payload_bytes(rows: list[tuple]) -> int:
+        """Approximate bytes of row data written (text fields + 8 per number)."""
+        return sum(len(value.encode('utf-8')) if isinstance(value, str) else 8
+                   for row in rows for value in row)
+    
+    def save_card_metadata(self, user: str, deck_name: str, cards: list[Card],
+                           full: bool = False) -> SaveStats:
+        """
+        Save card metadata, upserting only cards marked dirty (or all if full).
+        
+        Returns:
+            Counters for the rows and approximate payload bytes written
+        """
+        if full:
+            changed = list(cards)
+        elif isinstance(cards, CardStore):
+            changed = [cards[row] for row in sorted(cards.dirty_rows)]
+        else:
+            changed = [card for card in cards if card.dirty]
+        rows = [(user, deck_name, card.card_id) + self._card_row(card) for card in changed]
+        with self.write_group(), self._lock:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO users (name) VALUES (?)", (user,))
+                self._conn.executemany(UPSERT_CARD, rows)
+                if rows:
+                    self._conn.execute(BUMP_REVISION, (user, deck_name))
+        for card in changed:
+            card.dirty = False
+        return self._record_save(len(rows), self._payload_bytes(rows))
+    
+    def load_card_metadata(self, user: str, deck_name: str) -> dict:
+        """Load card metadata keyed by card ID."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT card_id, stability, difficulty, interval_days, lapses, state, last_seen "
+                "FROM cards WHERE user = ? AND deck = ?", (user, deck_name)).fetchall()
+        return {
+            card_id: {
+                'stability': stability,
+                'difficulty': difficulty,
+                'interval_days': interval_days,
+                'lapses': lapses,
+                'state': state,
+                'last_seen': last_seen,
+            }
+            for card_id, stability, difficulty, interval_days, lapses, state, last_seen in rows
+        }
+    
+    def append_reviews(self, user: str, deck_name: str, records: list[list],
+                       atomic: bool = False,
+                       deck_metadata: Optional[DeckMetadata] = None) -> SaveStats:
+        """
+        Record graded reviews and the cards' resulting state in one transaction.
+        
+        Always all or nothing, so atomic is accepted only for compatibility
+        with PersistenceManager.append_reviews. Deck metadata, if given, is
+        saved in the same transaction.
+        """
+        card_rows = {}
+        review_rows = []
+        for record in records:
+            (card_id, timestamp, grade_again, stability, difficulty, interval_days,
+             lapses, state, last_seen) = record[:9]
+            next_due = 0 if state == 0 or last_seen is None else last_seen + interval_days
+            # Later records for the same card supersede earlier ones
+            card_rows[card_id] = (user, deck_name, card_id, stability, difficulty, interval_days,
+                                lapses, state, last_seen, next_due)
+            if grade_again is not None:
+                params = json.dumps(record[9]) if len(record) > 9 else None
+                review_rows.append((user, deck_name, card_id, timestamp, grade_again,
+                                    last_seen, params))
+        
+        with self.write_group(), self._lock:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO users (name) VALUES (?)", (user,))
+                self._conn.executemany(UPSERT_CARD, list(card_rows.values()))
+                self._conn.executemany(
+                    "INSERT INTO reviews (user, deck, card_id, timestamp, grade_again, day, params) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", review_rows)
+                if deck_metadata is not None:
+                    self._conn.execute(UPSERT_DECK, (user, deck_name,
+                                                     json.dumps(deck_metadata.to_dict())))
+                self._conn.execute(BUMP_REVISION, (user, deck_name))
+        if deck_metadata is not None:
+            deck_metadata.dirty = False
+        written = list(card_rows.values()) + review_rows
+        return self._record_save(len(written), self._payload_bytes(written))
+    
+    def iter_review_events(self, user: str, deck_name: str) -> Iterator[ReviewEvent]:
+        """Stream a deck's graded reviews, oldest first, a page at a time."""
+        position = (float('-inf'), 0)
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT timestamp, rowid, card_id, grade_again, day, params FROM reviews "
+                    "WHERE user = ? AND deck = ? AND (timestamp, rowid) > (?, ?) "
+                    "ORDER BY timestamp, rowid LIMIT ?",
+                    (user, deck_name, *position, self.REVIEW_PAGE_ROWS)).fetchall()
+            if not rows:
+                return
+            for timestamp, _, card_id, grade_again, day, params in rows:
+                if day is None:
+                    # Logged before review days were stored
+                    day = date.fromtimestamp(timestamp).toordinal()
+                yield ReviewEvent(card_id, timestamp, day, bool(grade_again),
+                                  tuple(json.loads(params)) if params else None)
+            position = rows[-1][:2]
+    
+    def journal_size(self, user: str, deck_name: str) -> int:
+        """Reviews are applied in place, so there is never a pending journal."""
+        return 0
+    
+    def maybe_compact(self, user: str, deck_name: str) -> bool:
+        """SQLite needs no journal compaction."""
+        return False
+    
+    def compact(self, user: str, deck_name: str):
+        """SQLite needs no journal compaction."""
+    
+    def wait_for_compaction(self, user: str, deck_name: str):
+        """SQLite needs no journal compaction."""
+    
+    def _deck_source(self, csv_path: str, user: str, deck_name: str) -> tuple:
+        """Fingerprint the deck CSV and the deck's revision in the database."""
+        csv_stat = os.stat(csv_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT revision FROM deck_revisions WHERE user = ? AND deck = ?",
+                (user, deck_name)).fetchone()
+        return (csv_stat.st_mtime_ns, csv_stat.st_size, 0, 0, row[0] if row else 0)
+    
+    def save_deck_metadata(self, user: str, deck_name: str,
+                           deck_metadata: DeckMetadata) -> SaveStats:
+        """Save deck metadata."""
+        data = json.dumps(deck_metadata.to_dict())
+        with self.write_group(), self._lock, self._conn:
+            self._conn.execute(UPSERT_DECK, (user, deck_name, data))
+        deck_metadata.dirty = False
+        return self._record_save(1, len(data.encode('utf-8')))
+    
+    def load_deck_metadata(self, user: str, deck_name: str) -> DeckMetadata:
+        """Load deck metadata."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT metadata FROM decks WHERE user = ? AND deck = ?",
+                (user, deck_name)).fetchone()
+        if row is None:
+            return DeckMetadata()
+        return DeckMetadata.from_dict(json.loads(row[0]))
+    
+    def list_users(self) -> list[str]:
+        """List all users."""
+        with self._lock:
+            return [name for (name,) in self._conn.execute("SELECT name FROM users ORDER BY name")]
+    
+    def user_exists(self, user: str) -> bool:
+        """Check if a user exists."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM users WHERE name = ?", (user,)).fetchone() is not None
+    
+    def create_user(self, user: str):
+        """Create a new user."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO users (name) VALUES (?)", (user,))
+    
+    def import_card_metadata(self, user: str, deck_name: str, metadata: dict) -> int:
+        """
+        Bulk-insert ID-keyed card metadata (as loaded by the JSON backend).
+        
+        Returns:
+            Number of cards imported
+        """
+        rows = []
+        for card_id, values in metadata.items():
+            card = Card.from_csv_and_metadata({'front': '', 'back': '', 'id': card_id}, values)
+            rows.append((user, deck_name, card_id) + self._card_row(card))
+        with self._lock:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO users (name) VALUES (?)", (user,))
+                self._conn.executemany(UPSERT_CARD, rows)
+                self._conn.execute(BUMP_REVISION, (user, deck_name))
+        return len(rows)
+    
+    def has_reviews(self, user: str, deck_name: str) -> bool:
+        """Check whether any review of a deck has been logged."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM reviews WHERE user = ? AND deck = ? LIMIT 1",
+                (user, deck_name)).fetchone() is not None
+    
+    def import_review_events(self, user: str, deck_name: str,
+                             events: Iterable[ReviewEvent]) -> int:
+        """
+        Bulk-load review log events (e.g. a JSON deck's history) in one transaction.
+        
+        Returns:
+            Number of reviews imported
+        """
+        rows = [(user, deck_name, event.card_id, event.timestamp, int(event.grade_again),
+                 event.day, json.dumps(list(event.params)) if event.params is not None else None)
+                for event in events]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO reviews (user, deck, card_id, timestamp, grade_again, day, params) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+
+def migrate_from_json(source: PersistenceManager, target: SqlitePersistenceManager) -> dict:
+    """
+    Copy every user's deck data from the JSON layout into SQLite.
+    
+    Reads data/users/<user>/<deck>/*.json (replaying any review journal) and
+    writes each deck in a single transaction, then copies its review
+    history. Settings files stay where they are.
+    
+    Safe to run again: card and deck metadata are overwritten, and a deck
+    whose reviews are already in the database (each deck's are copied in
+    one transaction) keeps them instead of getting duplicates.
+    
+    Returns:
+        Dictionary with counts of migrated users, decks, cards and reviews
+    """
+    counts = {'users': 0, 'decks': 0, 'cards': 0, 'reviews': 0}
+    for user in source.list_users():
+        target.create_user(user)
+        counts['users'] += 1
+        for deck_dir in sorted((source.base_dir / user).iterdir()):
+            if not deck_dir.is_dir():
+                continue
+            deck_name = deck_dir.name
+            metadata = source.load_card_metadata(user, deck_name)
+            counts['cards'] += target.import_card_metadata(user, deck_name, metadata)
+            target.save_deck_metadata(user, deck_name, source.load_deck_metadata(user, deck_name))
+            if not target.has_reviews(user, deck_name):
+                counts['reviews'] += target.import_review_events(
+                    user, deck_name, source.iter_review_events(user, deck_name))
+            counts['decks'] += 1
+    return counts
+
+
+def main():
+    """Migrate a JSON data directory into a SQLite database."""
+    parser = argparse.ArgumentParser(description="Migrate JSON user data to SQLite")
+    parser.add_argument('source', nargs='?', default="data/users",
+                        help="JSON user data directory (default: data/users)")
+    parser.add_argument('target', nargs='?', default=DEFAULT_DB_PATH,
+                        help=f"SQLite database path (default: {DEFAULT_DB_PATH})")
+    args = parser.parse_args()
+    
+    source = PersistenceManager(args.source)
+    target = SqlitePersistenceManager(args.target, base_dir=args.source)
+    counts = migrate_from_json(source, target)
+    target.close()
+    print(f"Migrated {counts['users']} users, {counts['decks']} decks, "
+          f"{counts['cards']} cards, {counts['reviews']} reviews into {args.target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,14 +4,37 @@ Test script to verify FSRS-6 implementation and persistence.
 """
 import sys
 import os
-from datetime import datetime, timedelta
+import asyncio
+import json
+import random
+import sqlite3
+import tempfile
+from array import array
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http import HTTPStatus
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from models import Card, DeckMetadata
+from models import (Card, CardStore, CardView, DailyCounts, DeckHeader, DeckMetadata, DeckStats,
+                    format_day, make_card_id)
 from fsrs import FSRS6Scheduler
-from persistence import PersistenceManager
+from api_server import ApiError, ApiServer, SchedulingService
+from loadgen import ApiClient, run_load, write_synthetic_deck
+from grading import GradingError, grade_many
+from deck_import import DeckImportError, import_deck_csv
+from deck_snapshot import MappedCardStore, encode_snapshot
+from durable import DurabilityPolicy, WriteGroup, atomic_write_bytes
+from optimizer import ReviewHistory, fit_parameters, fit_users, save_parameters
+from persistence import PersistenceManager, deck_content_cache
+from practice_queue import build_queue
+from replay import replay_deck, replay_events, replay_users
+from sqlite_persistence import SqlitePersistenceManager, migrate_from_json
+from user_settings import UserSettings
+from workload import (FIRST_AGAIN_RATE, SECONDS_PER_REVIEW, calibrate_intensity, deck_columns,
+                      simulate_trial, simulate_workload)
+from write_behind import WriteBehindSaver
 
 
 def test_card_model():
@@ -57,6 +80,55 @@ def test_deck_metadata():
     print("✓ DeckMetadata tests passed")
 
 
+def test_daily_counts():
+    """Test the bounded daily review counts and their migration."""
+    print("Testing daily counts...")
+    start = date(2024, 1, 1).toordinal()
+    counts = DailyCounts()
+    for offset in range(400):
+        counts.increment(start + offset, offset % 5 + 1)
+    latest = start + 399
+    expected_total = sum(offset % 5 + 1 for offset in range(400))
+    
+    # Only the last RECENT_DAYS days are kept per day; the rest is aggregated
+    assert counts.get(latest) == 399 % 5 + 1
+    assert counts.get(latest - DailyCounts.RECENT_DAYS) == 0
+    assert counts.total() == expected_total
+    assert sum(counts.monthly.values()) == expected_total - sum(
+        offset % 5 + 1 for offset in range(400 - DailyCounts.RECENT_DAYS, 400))
+    assert all(monday > latest - 7 * DailyCounts.RECENT_WEEKS for monday in counts.weekly)
+    assert all(date.fromordinal(monday).weekday() == 0 for monday in counts.weekly)
+    recent = counts.recent(3, today=latest + 1)
+    assert recent == [(latest + 1, 0), (latest, 5), (latest - 1, 4)]
+    
+    # Serialization is bounded and round-trips
+    data = counts.to_dict()
+    assert len(data['recent']) <= DailyCounts.RECENT_DAYS
+    restored = DailyCounts.from_dict(json.loads(json.dumps(data)))
+    assert restored == counts
+    assert restored.total() == expected_total
+    
+    # Late increments for days that already left the ring go to the aggregates
+    restored.increment(start, 10)
+    assert restored.total() == expected_total + 10
+    assert restored.monthly['2024-01'] == counts.monthly['2024-01'] + 10
+    
+    # Copies are independent
+    copy = counts.copy()
+    copy.increment(latest)
+    assert copy.get(latest) == counts.get(latest) + 1
+    
+    # Old flat {date: count} files are migrated
+    legacy = {format_day(start + offset): offset % 5 + 1 for offset in range(400)}
+    assert DailyCounts.from_dict(legacy) == counts
+    metadata = DeckMetadata.from_dict({'max_per_day': 5, 'daily_counts': legacy})
+    assert metadata.daily_counts.total() == expected_total
+    assert DeckMetadata.from_dict(metadata.to_dict()).daily_counts == counts
+    assert not DeckMetadata.from_dict({}).daily_counts
+    
+    print("✓ Daily counts tests passed")
+
+
 def test_fsrs_scheduler():
     """Test FSRS-6 scheduler."""
     print("Testing FSRS-6 scheduler...")
@@ -101,6 +173,399 @@ def test_fsrs_scheduler():
     print("✓ FSRS-6 scheduler tests passed")
 
 
+def test_batch_scheduling_parity():
+    """Test that schedule_batch matches schedule_card exactly."""
+    print("Testing batch scheduling parity...")
+    rng = random.Random(42)
+    
+    for intensity in (0.0, 5.0, 10.0):
+        scheduler = FSRS6Scheduler(intensity=intensity, request_retention=0.85)
+        cards = [
+            Card(front=str(i), back=str(i), state=rng.randint(0, 3),
+                 stability=rng.uniform(0.0, 200.0), difficulty=rng.uniform(1.0, 10.0),
+                 interval_days=rng.randint(0, 100), lapses=rng.randint(0, 5))
+            for i in range(500)
+        ]
+        grades = array('b', (rng.random() < 0.3 for _ in cards))
+        
+        states = array('b', (c.state for c in cards))
+        stabilities = array('d', (c.stability for c in cards))
+        difficulties = array('d', (c.difficulty for c in cards))
+        intervals = array('l', (c.interval_days for c in cards))
+        lapses = array('l', (c.lapses for c in cards))
+        last_seen = array('l', bytes(8 * len(cards)))
+        next_due = array('l', bytes(8 * len(cards)))
+        
+        count = scheduler.schedule_batch(states, stabilities, difficulties,
+                                         intervals, lapses, grades, last_seen, next_due)
+        assert count == len(cards)
+        
+        for i, card in enumerate(cards):
+            scheduler.schedule_card(card, bool(grades[i]))
+            assert states[i] == card.state
+            assert stabilities[i] == card.stability
+            assert difficulties[i] == card.difficulty
+            assert intervals[i] == card.interval_days
+            assert lapses[i] == card.lapses
+            assert last_seen[i] == card.last_seen
+            assert next_due[i] == card.next_due_day
+    
+    # Mismatched column lengths are rejected
+    try:
+        scheduler.schedule_batch(array('b', [0]), array('d'), array('d'),
+                                 array('l'), array('l'), array('b', [1]))
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+    
+    print("✓ Batch scheduling parity tests passed")
+
+
+def test_due_index():
+    """Test that the due index agrees with a linear due scan."""
+    print("Testing due index...")
+    rng = random.Random(7)
+    today = datetime.now()
+    
+    cards = []
+    for i in range(300):
+        state = rng.randint(0, 3)
+        last_seen = (today - timedelta(days=rng.randint(0, 30))).strftime('%Y-%m-%d')
+        cards.append(Card(front=str(i), back=str(i), state=state,
+                          last_seen=rng.choice([last_seen, last_seen, None, "bad-date"]),
+                          interval_days=rng.randint(1, 30), stability=1.0))
+    expected = [c for c in cards if FSRS6Scheduler().is_card_due(c)]
+    
+    scheduler = FSRS6Scheduler()
+    index = scheduler.index_cards(cards)
+    assert len(index) == len(cards)
+    assert scheduler.get_due_cards(cards) == expected
+    assert scheduler.count_due_cards(cards) == len(expected)
+    
+    # Grading keeps the index current
+    for card in expected[:50]:
+        scheduler.schedule_card(card, grade_again=rng.random() < 0.5)
+    expected = [c for c in cards if scheduler.is_card_due(c)]
+    due = scheduler.get_due_cards(cards)
+    assert [id(c) for c in due] == [id(c) for c in expected]
+    assert scheduler.count_due_cards(cards) == len(expected)
+    
+    # Other card lists fall back to a scan
+    other = [Card(front="x", back="x")]
+    assert scheduler.count_due_cards(other) == 1
+    
+    # So does the indexed list once cards are appended to it
+    cards.append(Card(front="new", back="new"))
+    assert not index.covers(cards)
+    assert scheduler.count_due_cards(cards) == len(expected) + 1
+    
+    print("✓ Due index tests passed")
+
+
+def test_due_forecast():
+    """Test the per-day forecast of upcoming due cards."""
+    print("Testing due forecast...")
+    rng = random.Random(9)
+    today = date(2025, 3, 1).toordinal()
+    cards = []
+    for i in range(400):
+        card = Card(front=str(i), back=str(i), state=rng.randint(0, 3),
+                    last_seen=today - rng.randint(0, 40), interval_days=rng.randint(1, 60))
+        cards.append(card)
+    
+    def brute_force(days):
+        # What a faked clock and is_card_due would give, one day at a time
+        scheduler = FSRS6Scheduler()
+        due_by = [sum(scheduler.is_card_due(card, today + day) for card in cards)
+                  for day in range(days)]
+        return [due_by[0]] + [due_by[day] - due_by[day - 1] for day in range(1, days)]
+    
+    scheduler = FSRS6Scheduler()
+    assert scheduler.forecast(cards, 30, today) == brute_force(30)  # Scan fallback
+    scheduler.index_cards(cards)
+    assert scheduler.forecast(cards, 30, today) == brute_force(30)
+    assert scheduler.forecast(cards, 1, today) == [scheduler.due_index.due_count(today)]
+    assert scheduler.forecast(cards, 0, today) == []
+    
+    # Grading moves cards out of today's count into later days
+    for card in scheduler.due_index.due_cards(today)[:25]:
+        scheduler.schedule_card(card, grade_again=rng.random() < 0.3, today=today)
+    forecast = scheduler.forecast(cards, 90, today)
+    assert forecast == brute_force(90)
+    assert sum(forecast) == sum(1 for card in cards if card.next_due_day < today + 90)
+    
+    # The deck header answers the same query without the cards
+    header = DeckHeader.from_cards(cards)
+    assert header.forecast(90, today) == forecast
+    assert DeckHeader.from_dict(header.to_dict()).forecast(90, today) == forecast
+    assert header.forecast(10, today + 5) == scheduler.forecast(cards, 10, today + 5)
+    
+    print("✓ Due forecast tests passed")
+
+
+def test_practice_queue():
+    """Test that capped practice sessions keep the most at-risk due cards."""
+    print("Testing practice queue...")
+    rng = random.Random(21)
+    today = date(2025, 3, 1).toordinal()
+    cards = []
+    for i in range(500):
+        state = rng.choice([0, 1, 2, 2, 3])
+        cards.append(Card(front=str(i), back=str(i), state=state,
+                          last_seen=today - rng.randint(1, 60) if state else None,
+                          interval_days=rng.randint(1, 40), stability=rng.uniform(0.5, 30.0)))
+    scheduler = FSRS6Scheduler()
+    due = [row for row, card in enumerate(cards) if scheduler.is_card_due(card, today)]
+    new = [row for row in due if cards[row].state == 0]
+    reviews = [row for row in due if cards[row].state != 0]
+    assert scheduler.due_rows(cards, today) == due
+    
+    def by_recall(rows):
+        return sorted(rows, key=lambda row: (scheduler.retrievability(cards[row], today), row))
+    
+    # Lowest retrievability first, new cards after every review card
+    queue = scheduler.practice_queue(cards, 20, today=today)
+    assert [id(c) for c in queue] == [id(cards[row]) for row in by_recall(reviews)[:20]]
+    everything = scheduler.practice_queue(cards, today=today)
+    assert [id(c) for c in everything] == [id(cards[row]) for row in by_recall(reviews) + new]
+    retrievability = [scheduler.retrievability(card, today) for card in queue]
+    assert retrievability == sorted(retrievability)
+    assert scheduler.retrievability(cards[new[0]], today) == 0.0
+    
+    # Most overdue first; deck order keeps the old first-rows behaviour
+    overdue = scheduler.practice_queue(cards, 30, ordering='overdue', today=today)
+    expected = sorted(reviews, key=lambda row: (cards[row].next_due_day, row))[:30]
+    assert [id(c) for c in overdue] == [id(cards[row]) for row in expected]
+    deck = scheduler.practice_queue(cards, 30, ordering='deck', today=today)
+    assert [id(c) for c in deck] == [id(cards[row]) for row in due[:30]]
+    
+    # A new-card ratio reserves that share and spreads it through the session
+    mixed = scheduler.practice_queue(cards, 20, new_ratio=0.25, today=today)
+    rows = [cards.index(card) for card in mixed]
+    assert [row for row in rows if row in new] == new[:5]
+    assert [row for row in rows if row not in new] == by_recall(reviews)[:15]
+    assert all(rows[i] in new for i in (3, 7, 11, 15, 19))
+    # Either kind fills what the other cannot
+    only_new = scheduler.practice_queue(cards, 20, new_ratio=1.0, today=today)
+    assert len(only_new) == 20 and all(card.state == 0 for card in only_new[:len(new)])
+    assert len(scheduler.practice_queue(cards, len(due) + 10, new_ratio=0.9, today=today)) == len(due)
+    
+    # Indexed columns pick the same cards as the card-list scan
+    store = CardStore(cards)
+    scheduler.index_cards(store)
+    assert scheduler.due_rows(store, today) == due
+    for ordering in ('retrievability', 'overdue', 'deck'):
+        for ratio in (None, 0.3):
+            expected = scheduler.practice_queue(cards, 25, ordering, ratio, today)
+            queue = scheduler.practice_queue(store, 25, ordering, ratio, today)
+            assert [card.front for card in queue] == [card.front for card in expected]
+    try:
+        scheduler.practice_queue(cards, 5, ordering='random', today=today)
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+    
+    # The ordering is a persisted user setting
+    with tempfile.TemporaryDirectory() as tmpdir:
+        settings = UserSettings("u", base_dir=tmpdir)
+        assert settings.practice_order == 'retrievability' and settings.new_card_ratio is None
+        settings.set_practice_order('overdue', 0.2)
+        reloaded = UserSettings("u", base_dir=tmpdir)
+        assert (reloaded.practice_order, reloaded.new_card_ratio) == ('overdue', 0.2)
+        try:
+            settings.set_practice_order('random')
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+    
+    print("✓ Practice queue tests passed")
+
+
+def test_deck_analytics():
+    """Test whole-deck retrievability analytics against per-card computation."""
+    print("Testing deck analytics...")
+    rng = random.Random(22)
+    today = date(2025, 3, 1).toordinal()
+    cards = []
+    for i in range(600):
+        state = rng.choice([0, 1, 2, 2, 3])
+        cards.append(Card(front=str(i), back=str(i), state=state,
+                          last_seen=today - rng.randint(0, 90) if state else None,
+                          interval_days=rng.randint(1, 60),
+                          stability=rng.choice([0.2, rng.uniform(0.5, 500.0)]) if state else 0.0,
+                          difficulty=rng.uniform(1.0, 10.0)))
+    cards[1].state, cards[1].last_seen, cards[1].stability = 2, today + 3, 5.0  # Clock skew
+    scheduler = FSRS6Scheduler()
+    analytics = scheduler.analytics(cards, today)
+    
+    expected = [scheduler.retrievability(card, today) for card in cards]
+    assert list(analytics.retrievability) == expected
+    assert max(expected) <= 1.0
+    reviewed = [card for card in cards if card.state != 0]
+    assert analytics.total_cards == len(cards)
+    assert analytics.reviewed_cards == len(reviewed)
+    assert abs(analytics.expected_remembered - sum(expected)) < 1e-9
+    assert abs(analytics.average_retrievability - sum(expected) / len(reviewed)) < 1e-12
+    
+    # Histograms over reviewed cards, by brute force
+    recall = [0] * 10
+    stability = [0] * 11
+    difficulty = [0] * 9
+    stability_edges = (1, 2, 4, 7, 14, 30, 60, 120, 240, 365)
+    for card in reviewed:
+        recall[min(9, int(scheduler.retrievability(card, today) * 10))] += 1
+        stability[sum(card.stability >= edge for edge in stability_edges)] += 1
+        difficulty[min(8, int(card.difficulty) - 1)] += 1
+    assert analytics.retrievability_histogram == recall
+    assert analytics.stability_histogram == stability
+    assert analytics.difficulty_histogram == difficulty
+    
+    # Column store gives the same result
+    store = CardStore(cards)
+    from_store = FSRS6Scheduler().analytics(store, today)
+    assert list(from_store.retrievability) == expected
+    assert from_store.stability_histogram == stability
+    assert from_store.difficulty_histogram == difficulty
+    
+    # Cached until the next grade or day rollover
+    assert scheduler.analytics(cards, today) is analytics
+    assert scheduler.cached_analytics(cards, today + 1) is None
+    assert scheduler.cached_analytics(list(cards), today) is None
+    scheduler.schedule_card(cards[0], grade_again=False, today=today)
+    assert scheduler.cached_analytics(cards, today) is None
+    regraded = scheduler.analytics(cards, today)
+    assert regraded is not analytics and regraded.retrievability[0] == 1.0
+    assert FSRS6Scheduler().analytics([], today).reviewed_cards == 0
+    
+    print("✓ Deck analytics tests passed")
+
+
+def test_deck_stats():
+    """Test running deck statistics against a recount from scratch."""
+    print("Testing deck statistics...")
+    rng = random.Random(16)
+    today = date(2025, 3, 1).toordinal()
+    
+    def assert_matches(stats, cards):
+        expected = DeckStats.from_cards(cards)
+        assert stats.total_cards == expected.total_cards
+        assert stats.state_counts == expected.state_counts
+        assert stats.stable_cards == expected.stable_cards
+        assert stats.total_lapses == expected.total_lapses
+        assert abs(stats.difficulty_sum - expected.difficulty_sum) < 1e-6
+        assert abs(stats.stability_sum - expected.stability_sum) < 1e-6 * max(1.0, expected.stability_sum)
+    
+    for cards in ([Card(front=f"c{i}", back="b") for i in range(200)],
+                  CardStore(Card(front=f"c{i}", back="b") for i in range(200))):
+        scheduler = FSRS6Scheduler()
+        scheduler.index_cards(cards)
+        assert scheduler.deck_stats.state_counts == [200, 0, 0, 0]
+        assert scheduler.deck_stats.average_stability == 0.0
+        for step in range(2000):
+            card = cards[rng.randrange(len(cards))]
+            scheduler.schedule_card(card, grade_again=rng.random() < 0.3, today=today + step // 100)
+        assert_matches(scheduler.deck_stats, cards)
+        assert sum(scheduler.deck_stats.state_counts) == 200
+        
+        # Cards outside the indexed deck do not touch its statistics
+        before = scheduler.deck_stats.to_dict()
+        scheduler.schedule_card(Card(front="stray", back="b"), grade_again=False, today=today)
+        assert scheduler.deck_stats.to_dict() == before
+        
+        # Statistics handed in (e.g. from a header) are kept current
+        stats = DeckStats.from_dict(json.loads(json.dumps(scheduler.deck_stats.to_dict())))
+        scheduler.index_cards(cards, stats)
+        scheduler.schedule_card(cards[0], grade_again=True, today=today + 30)
+        assert scheduler.deck_stats is stats
+        assert_matches(stats, cards)
+    
+    # List and column recounts agree exactly, and the header carries them
+    store = CardStore(cards.to_cards())
+    assert DeckStats.from_cards(store) == DeckStats.from_cards(cards.to_cards())
+    header = DeckHeader.from_dict(DeckHeader.from_cards(store).to_dict())
+    assert header.stats == DeckStats.from_cards(store)
+    assert DeckStats.from_cards([]) == DeckStats()
+    
+    print("✓ Deck statistics tests passed")
+
+
+def test_day_ordinals():
+    """Test day-ordinal last_seen handling and legacy string migration."""
+    print("Testing day ordinals...")
+    today = datetime.now().date()
+    
+    # Legacy string dates are converted on construction
+    card = Card(front="か", back="ka", state=2, last_seen=today.isoformat(), interval_days=3)
+    assert card.last_seen == today.toordinal()
+    assert card.next_due_day == today.toordinal() + 3
+    assert card.to_csv_row()['lastSeen'] == today.isoformat()
+    assert card.to_metadata()['last_seen'] == today.toordinal()
+    
+    # Old (string) and new (ordinal) metadata both load
+    row = {'front': 'か', 'back': 'ka', 'state': '0', 'lastSeen': ''}
+    legacy = Card.from_csv_and_metadata(row, {'state': 2, 'interval_days': 1,
+                                              'last_seen': '2020-01-01'})
+    current = Card.from_csv_and_metadata(row, legacy.to_metadata())
+    assert legacy.last_seen == current.last_seen == datetime(2020, 1, 1).toordinal()
+    assert legacy.next_due_day == current.next_due_day == legacy.last_seen + 1
+    
+    # Unparseable dates count as never seen, which is always due
+    broken = Card(front="き", back="ki", state=2, last_seen="not-a-date", interval_days=5)
+    assert broken.last_seen is None
+    
+    scheduler = FSRS6Scheduler()
+    assert scheduler.is_card_due(broken)
+    assert not scheduler.is_card_due(card)
+    assert scheduler.is_card_due(card, today=card.next_due_day)
+    
+    # Scheduling with an explicit day stamps that day
+    scheduler.schedule_card(card, grade_again=False, today=1000)
+    assert card.last_seen == 1000
+    assert card.next_due_day == 1000 + card.interval_days
+    
+    print("✓ Day ordinal tests passed")
+
+
+def test_card_store():
+    """Test the column-oriented CardStore and its views."""
+    print("Testing CardStore...")
+    cards = [
+        Card(front="あ", back="a"),
+        Card(front="い", back="i", state=2, last_seen=738000, stability=4.0,
+             difficulty=3.5, interval_days=4, lapses=1),
+    ]
+    store = CardStore(cards)
+    assert len(store) == 2
+    assert store.to_cards() == cards
+    
+    view = store[1]
+    assert isinstance(view, CardView)
+    assert view.front == "い" and view.back == "i"
+    assert view.last_seen == 738000
+    assert view.next_due_day == 738004
+    assert store[0].last_seen is None
+    assert view.to_metadata() == cards[1].to_metadata()
+    assert view.to_csv_row() == cards[1].to_csv_row()
+    assert store[1] == view and store[0] != view
+    
+    # Scheduling a view writes through to the columns
+    scheduler = FSRS6Scheduler()
+    for card, view in zip(cards, store):
+        scheduler.schedule_card(card, grade_again=False, today=740000)
+        scheduler.schedule_card(view, grade_again=False, today=740000)
+    assert store.to_cards() == cards
+    assert list(store.next_due) == [c.next_due_day for c in cards]
+    
+    # The due index works over a store too
+    store.extend([Card(front="う", back="u")])
+    scheduler.index_cards(store)
+    assert [v.front for v in scheduler.get_due_cards(store)] == ["う"]
+    scheduler.schedule_card(store[2], grade_again=True)
+    assert scheduler.count_due_cards(store) == 0
+    
+    print("✓ CardStore tests passed")
+
+
 def test_persistence():
     """Test persistence layer."""
     print("Testing persistence layer...")
@@ -122,9 +587,9 @@ def test_persistence():
     
     # Load card metadata
     loaded_metadata = pm.load_card_metadata(test_user, test_deck)
-    assert "あ" in loaded_metadata
-    assert loaded_metadata["あ"]["stability"] == 3.0
-    assert loaded_metadata["い"]["difficulty"] == 6.0
+    assert cards[0].card_id in loaded_metadata
+    assert loaded_metadata[cards[0].card_id]["stability"] == 3.0
+    assert loaded_metadata[cards[1].card_id]["difficulty"] == 6.0
     
     # Test deck metadata
     deck_meta = DeckMetadata(max_per_day=25)
@@ -138,6 +603,1163 @@ def test_persistence():
     print("✓ Persistence tests passed")
 
 
+def test_review_journal():
+    """Test journaled reviews, replay on load and compaction."""
+    print("Testing review journal...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pm = PersistenceManager(base_dir=tmpdir, compact_threshold_bytes=1)
+        user, deck = "journal_user", "deck"
+        cards = [Card(front="あ", back="a"), Card(front="い", back="i")]
+        pm.save_card_metadata(user, deck, cards)
+        
+        scheduler = FSRS6Scheduler()
+        scheduler.schedule_card(cards[0], grade_again=False)
+        pm.append_review(user, deck, cards[0], grade_again=False)
+        scheduler.schedule_card(cards[0], grade_again=True)
+        pm.append_review(user, deck, cards[0], grade_again=True)
+        assert pm.journal_size(user, deck) > 0
+        
+        # Latest journal record wins over the snapshot
+        loaded = pm.load_card_metadata(user, deck)
+        assert loaded[cards[0].card_id] == cards[0].to_metadata()
+        assert loaded[cards[1].card_id] == cards[1].to_metadata()
+        
+        # A torn trailing line is ignored
+        journal = pm.get_user_deck_dir(user, deck) / "reviews.journal"
+        with open(journal, 'a', encoding='utf-8') as f:
+            f.write('["い",17')
+        assert pm.load_card_metadata(user, deck) == loaded
+        
+        # Compaction folds the journal into the snapshot
+        assert pm.maybe_compact(user, deck)
+        pm.wait_for_compaction(user, deck)
+        assert pm.journal_size(user, deck) == 0
+        assert pm.load_card_metadata(user, deck) == loaded
+    
+    print("✓ Review journal tests passed")
+
+
+def test_review_replay():
+    """Test the review history and replaying it to audit and rebuild card state."""
+    print("Testing review replay...")
+    start = date(2025, 1, 1).toordinal()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for pm in (PersistenceManager(base_dir=os.path.join(tmpdir, "json"),
+                                      compact_threshold_bytes=1 << 30),
+                   SqlitePersistenceManager(os.path.join(tmpdir, "test.db"),
+                                            base_dir=os.path.join(tmpdir, "sqlite"))):
+            user, deck = "replay_user", "deck"
+            cards = [Card(front=f"c{i}", back="b") for i in range(20)]
+            pm.save_card_metadata(user, deck, cards)
+            scheduler = FSRS6Scheduler()
+            rng = random.Random(17)
+            graded = 0
+            for day in range(60):
+                if day == 30:
+                    scheduler.set_intensity(8.0, 0.85)  # Parameters change mid-history
+                for card in rng.sample(cards, 5):
+                    grade_again = rng.random() < 0.25
+                    scheduler.schedule_card(card, grade_again, today=start + day)
+                    pm.append_review(user, deck, card, grade_again,
+                                     timestamp=1.7e9 + graded, params=scheduler.log_parameters())
+                    graded += 1
+                if day % 20 == 19 and not isinstance(pm, SqlitePersistenceManager):
+                    pm.compact(user, deck)  # Archives graded reviews to the history
+            
+            events = list(pm.iter_review_events(user, deck))
+            assert len(events) == graded
+            assert [event.timestamp for event in events] == [1.7e9 + i for i in range(graded)]
+            assert {event.params for event in events} == {(5.0, 0.9), (8.0, 0.85)}
+            if not isinstance(pm, SqlitePersistenceManager):
+                deck_dir = pm.get_user_deck_dir(user, deck)
+                assert len(list((deck_dir / "history").iterdir())) == 3
+                assert not (deck_dir / "reviews.journal").exists()
+            
+            # With the logged parameters, replay reproduces the saved state exactly
+            replayed = replay_events(events)
+            assert {card.card_id: card.to_metadata() for card in cards
+                    if card.last_seen} == {card_id: card.to_metadata()
+                                           for card_id, card in replayed.items()}
+            assert replay_deck(pm, user, deck).mismatch_count == 0
+            
+            # Progress set outside the scheduler (an import) shows up in the audit
+            imported = cards[0]
+            imported.state, imported.stability = 2, 99.0
+            pm.append_reviews(user, deck, [pm.review_record(imported, None)])
+            report = replay_deck(pm, user, deck)
+            assert report.events == graded
+            assert report.mismatched == [imported.card_id]
+            
+            # Rebuilding with new parameters saves the re-scheduled state
+            report = replay_deck(pm, user, deck, params=[2.0, 0.95], rebuild=True)
+            assert report.rebuilt == report.mismatch_count == len(replayed)
+            rebuilt = replay_events(pm.iter_review_events(user, deck), FSRS6Scheduler(2.0, 0.95))
+            stored = pm.load_card_metadata(user, deck)
+            assert all(stored[card_id] == card.to_metadata() for card_id, card in rebuilt.items())
+            assert replay_deck(pm, user, deck, params=[2.0, 0.95]).mismatch_count == 0
+            # Rebuilt state is not a review, so the history is unchanged
+            assert len(list(pm.iter_review_events(user, deck))) == graded
+            if isinstance(pm, SqlitePersistenceManager):
+                pm.close()
+        
+        # Users replay in parallel worker processes with the same results
+        base_dir = os.path.join(tmpdir, "json")
+        PersistenceManager(base_dir=base_dir).create_user("empty_user")
+        reports = replay_users(["replay_user", "empty_user"], "deck", base_dir,
+                               params=[2.0, 0.95], processes=2)
+        assert [report.user for report in reports] == ["replay_user", "empty_user"]
+        assert reports[0].events == graded and reports[1].events == 0
+        assert reports[0].mismatch_count == 0
+    
+    print("✓ Review replay tests passed")
+
+
+def test_parameter_optimizer():
+    """Test fitting scheduler constants to a user's review history."""
+    print("Testing parameter optimizer...")
+    true_params = {'initial_stability_again': 0.8, 'initial_stability_good': 5.0,
+                   'stability_factor_again': 0.6, 'stability_factor_good': 3.5,
+                   'difficulty_decay': -0.3, 'difficulty_increase': 0.6}
+    truth = FSRS6Scheduler()
+    truth.apply_parameters(true_params)
+    assert truth.parameters_fitted and truth.fitted_parameters() == true_params
+    for bad in ({'difficulty_decay': 0.2}, {'stability_factor_good': 0.0}, {'decay': -1.0}):
+        try:
+            FSRS6Scheduler().apply_parameters(bad)
+            assert False, f"{bad} should be rejected"
+        except ValueError:
+            pass
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pm = PersistenceManager(base_dir=tmpdir)
+        user, deck = "fit_user", "deck"
+        cards = [Card(front=f"c{i}", back="b") for i in range(150)]
+        due = {card.card_id: 0 for card in cards}
+        rng = random.Random(23)
+        start = date(2025, 1, 1).toordinal()
+        for day in range(120):
+            for card in cards:
+                if due[card.card_id] > day:
+                    continue
+                if card.last_seen is None:
+                    grade_again = rng.random() < 0.3
+                else:
+                    recall = 0.9 ** ((start + day - card.last_seen) / card.stability)
+                    grade_again = rng.random() > recall
+                truth.schedule_card(card, grade_again, today=start + day)
+                pm.append_review(user, deck, card, grade_again, params=truth.log_parameters())
+                due[card.card_id] = day + max(1, round(card.interval_days * rng.uniform(0.7, 1.5)))
+        
+        # The fit predicts the history better than the default constants
+        history = ReviewHistory.from_events(pm.iter_review_events(user, deck))
+        assert history.samples > 1000
+        result = fit_parameters(history, user=user)
+        assert result.log_loss < result.baseline_log_loss
+        assert set(result.parameters) == set(FSRS6Scheduler.FITTED_PARAMETERS)
+        for name in ('stability_factor_again', 'stability_factor_good'):
+            assert abs(result.parameters[name] / true_params[name] - 1) < 0.3, name
+        
+        # Saved parameters are applied at login and logged with each review
+        settings = UserSettings(user, base_dir=tmpdir)
+        assert not FSRS6Scheduler().load_parameters(settings.params_file)
+        save_parameters(settings.params_file, result)
+        scheduler = FSRS6Scheduler()
+        assert scheduler.load_parameters(settings.params_file)
+        assert scheduler.fitted_parameters() == result.parameters
+        params = scheduler.log_parameters()
+        assert len(params) == 2 + len(FSRS6Scheduler.FITTED_PARAMETERS)
+        replayed = FSRS6Scheduler.from_log_parameters(params)
+        assert replayed.log_parameters() == params
+        assert FSRS6Scheduler().log_parameters() == [5.0, 0.9]
+        
+        # A short history is left alone; users are fitted in worker processes
+        pm.create_user("new_user")
+        results = fit_users([user, "new_user"], deck, tmpdir, save=False, processes=2)
+        assert [r.user for r in results] == [user, "new_user"]
+        assert results[0].parameters == result.parameters
+        assert results[1].parameters is None and results[1].reviews == 0
+        assert not UserSettings("new_user", base_dir=tmpdir).params_file.exists()
+    
+    print("✓ Parameter optimizer tests passed")
+
+
+def test_workload_simulator():
+    """Test the Monte Carlo workload projection."""
+    print("Testing workload simulator...")
+    start = date(2025, 1, 1).toordinal()
+    cards = [Card(front=f"c{i}", back="b") for i in range(60)]
+    scheduler = FSRS6Scheduler()
+    for card in cards[:40]:
+        scheduler.schedule_card(card, card.front.endswith("3"), today=start - 5)
+    columns = deck_columns(cards)
+    assert columns == deck_columns(CardStore(cards))
+    assert list(columns['next_due']) == [card.next_due_day for card in cards]
+    
+    # A trial matches reviewing the same cards one at a time with schedule_card,
+    # in the practice screen's order
+    for ordering, new_ratio in (('retrievability', None), ('overdue', 0.5), ('deck', None)):
+        counts, seen, recalled, backlog = simulate_trial(
+            columns, [6.0, 0.85], 40, start, max_per_day=15, seed=4, ordering=ordering,
+            new_ratio=new_ratio)
+        assert list(columns['next_due']) == [card.next_due_day for card in cards]  # Not modified
+        reference = FSRS6Scheduler(6.0, 0.85)
+        copies = [Card.from_csv_and_metadata({'front': c.front, 'back': c.back}, c.to_metadata())
+                  for c in cards]
+        rng = random.Random(4)
+        expected_counts, expected_seen, expected_recalled = [], 0, 0
+        for today in range(start, start + 40):
+            due_rows = [row for row, card in enumerate(copies) if card.next_due_day <= today]
+            due = [copies[row] for row in build_queue(copies, due_rows, 15, ordering, new_ratio,
+                                                      today)]
+            expected_counts.append(len(due))
+            for card in due:
+                if card.state == 0:
+                    grade_again = rng.random() < FIRST_AGAIN_RATE
+                else:
+                    recall = 0.9 ** ((today - card.last_seen) / card.stability)
+                    grade_again = rng.random() >= recall
+                    expected_seen += 1
+                    expected_recalled += not grade_again
+                reference.schedule_card(card, grade_again, today=today)
+        assert counts == expected_counts
+        assert (seen, recalled) == (expected_seen, expected_recalled)
+        assert backlog == sum(1 for card in copies if card.next_due_day <= start + 39) > 0
+        assert max(counts) == 15 and counts[0] == 15
+    
+    # Trials average the same way in worker processes; intensity raises the load
+    options = dict(days=60, trials=6, start_day=start, seed=1)
+    light = simulate_workload(cards, FSRS6Scheduler(1.0), processes=1, **options)
+    assert len(light.daily_reviews) == 60 and light.trials == 6
+    assert light.daily_reviews[0] == 60  # Everything is due on the first day
+    assert simulate_workload(cards, FSRS6Scheduler(1.0), processes=2,
+                             **options).daily_reviews == light.daily_reviews
+    heavy = simulate_workload(cards, FSRS6Scheduler(9.0), processes=1, **options)
+    assert heavy.mean_reviews > light.mean_reviews
+    assert heavy.mean_minutes == heavy.mean_reviews * SECONDS_PER_REVIEW / 60
+    assert 0 < light.recall_rate < 1 and light.backlog == 0
+    capped = simulate_workload(cards, FSRS6Scheduler(9.0), max_per_day=5, processes=1, **options)
+    assert max(capped.daily_reviews) == capped.p90_reviews == 5 and capped.backlog > 0
+    
+    # Calibration finds the intensity whose projected minutes fit the budget
+    budget = (light.mean_minutes + heavy.mean_minutes) / 2
+    intensity = calibrate_intensity(cards, budget, processes=1, **options)
+    assert 1.0 < intensity < 9.0
+    projected = simulate_workload(cards, FSRS6Scheduler(intensity), processes=1, **options)
+    assert abs(projected.mean_minutes - budget) < 0.2 * budget
+    
+    print("✓ Workload simulator tests passed")
+
+
+def test_load_balancer():
+    """Test that interval load balancing spreads cohorts over their fuzz windows."""
+    print("Testing load balancer...")
+    today = date(2025, 1, 1).toordinal()
+    assert [FSRS6Scheduler.fuzz_window(i) for i in (1, 2, 3, 10, 100)] == [
+        (1, 1), (2, 2), (2, 4), (8, 12), (93, 107)]
+    scheduler = FSRS6Scheduler()
+    load = {today + 9: 3, today + 10: 1, today + 11: 1, today + 12: 0}
+    assert scheduler.balance_interval(10, today, lambda day: load.get(day, 5)) == 12
+    load[today + 12] = 1
+    assert scheduler.balance_interval(10, today, lambda day: load.get(day, 5)) == 10
+    assert scheduler.balance_interval(2, today, lambda day: 0) == 2
+    
+    # A cohort learned in one session no longer comes due on a single day
+    def cohort(load_balance):
+        scheduler = FSRS6Scheduler()
+        scheduler.apply_parameters({'initial_stability_good': 8.0})
+        scheduler.load_balance = load_balance
+        cards = [Card(front=f"c{i}", back="b") for i in range(120)]
+        scheduler.index_cards(cards)
+        for card in cards:
+            scheduler.schedule_card(card, False, today=today)
+        return scheduler, cards
+    
+    scheduler, plain = cohort(False)
+    target = plain[0].interval_days
+    assert {card.interval_days for card in plain} == {target}
+    scheduler, balanced = cohort(True)
+    low, high = FSRS6Scheduler.fuzz_window(target)
+    per_day = Counter(card.next_due_day for card in balanced)
+    assert set(per_day) == {today + days for days in range(low, high + 1)}
+    assert max(per_day.values()) - min(per_day.values()) <= 1
+    assert all(scheduler.due_index.count_on(day) == n for day, n in per_day.items())
+    assert all(card.stability == plain[0].stability for card in balanced)
+    
+    # Batch scheduling balances the same way against a Counter of due days
+    cards = [Card(front=f"c{i}", back="b") for i in range(120)]
+    columns = deck_columns(cards)
+    batch = FSRS6Scheduler()
+    batch.apply_parameters({'initial_stability_good': 8.0})
+    batch.load_balance = True
+    due_counts = Counter(columns['next_due'])
+    batch.schedule_batch(columns['states'], columns['stabilities'], columns['difficulties'],
+                         columns['intervals'], columns['lapses'], [False] * len(cards),
+                         next_due=columns['next_due'], today=today, due_counts=due_counts)
+    assert list(columns['intervals']) == [card.interval_days for card in balanced]
+    assert +due_counts == per_day
+    
+    # The simulator flattens the busiest days without changing the mean load
+    cohorts = []
+    for day in range(6):
+        scheduler, cards = cohort(False)
+        for card in cards:
+            card.last_seen -= 2 * day
+            card.refresh_due_day()
+        cohorts.extend(cards)
+    plain_scheduler = FSRS6Scheduler()
+    plain_scheduler.apply_parameters({'initial_stability_good': 8.0})
+    balanced_scheduler = FSRS6Scheduler.from_log_parameters(plain_scheduler.log_parameters())
+    balanced_scheduler.load_balance = True
+    options = dict(days=60, trials=4, start_day=today, processes=1)
+    plain_report = simulate_workload(cohorts, plain_scheduler, **options)
+    balanced_report = simulate_workload(cohorts, balanced_scheduler, **options)
+    assert balanced_report.p90_reviews < plain_report.p90_reviews
+    mean = plain_report.mean_reviews
+    assert abs(balanced_report.mean_reviews - mean) < 0.1 * mean
+    
+    # Replay audits accept balanced intervals
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pm = PersistenceManager(base_dir=tmpdir)
+        cards = [Card(front=f"c{i}", back="b") for i in range(30)]
+        pm.save_card_metadata("u", "deck", cards)
+        scheduler = FSRS6Scheduler()
+        scheduler.apply_parameters({'initial_stability_good': 8.0})
+        scheduler.load_balance = True
+        scheduler.index_cards(cards)
+        for card in cards:
+            scheduler.schedule_card(card, False, today=today)
+            pm.append_review("u", "deck", card, False, params=scheduler.log_parameters())
+        assert len({card.interval_days for card in cards}) > 1
+        assert replay_deck(pm, "u", "deck").mismatch_count == 0
+        assert FSRS6Scheduler.from_log_parameters(scheduler.log_parameters()).load_balance
+        
+        # ...but only from reviews logged with load balancing on
+        scheduler.load_balance = False
+        card = cards[0]
+        scheduler.schedule_card(card, False, today=today)
+        low, high = FSRS6Scheduler.fuzz_window(card.interval_days)
+        assert low < high
+        card.interval_days = low if card.interval_days != low else high
+        pm.append_review("u", "deck", card, False, params=scheduler.log_parameters())
+        assert replay_deck(pm, "u", "deck").mismatched == [card.card_id]
+    
+    print("✓ Load balancer tests passed")
+
+
+def test_bulk_grading():
+    """Test that grade_many matches single grading and commits all or nothing."""
+    print("Testing bulk grading...")
+    start = datetime(2025, 3, 1, 12).timestamp()
+    rng = random.Random(7)
+    # Two days of grades; some cards are graded twice on the second day
+    grades = [(make_card_id(f"c{i}"), rng.random() < 0.2, start + i) for i in range(200)]
+    grades += [(make_card_id(f"c{i}"), rng.random() < 0.2, start + 86400 + i)
+               for i in range(0, 200, 3)]
+    grades += [(make_card_id(f"c{i}"), False, start + 90000 + i) for i in range(0, 200, 6)]
+    rng.shuffle(grades)
+    
+    # The same result as grading one card at a time, in timestamp order
+    expected = {card.card_id: card for card in (Card(front=f"c{i}", back="b")
+                                                for i in range(200))}
+    sequential = FSRS6Scheduler()
+    for card_id, grade_again, timestamp in sorted(grades, key=lambda g: g[2]):
+        sequential.schedule_card(expected[card_id], grade_again,
+                                 today=date.fromtimestamp(timestamp).toordinal())
+    
+    def state(card):
+        return (card.state, card.stability, card.difficulty, card.interval_days,
+                card.lapses, card.last_seen, card.next_due_day)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backends = [PersistenceManager(base_dir=tmpdir),
+                    SqlitePersistenceManager(os.path.join(tmpdir, "app.db"))]
+        for pm in backends:
+            for as_store in (False, True):
+                deck = f"deck{int(as_store)}"
+                cards = [Card(front=f"c{i}", back="b") for i in range(200)]
+                pm.save_card_metadata("u", deck, cards)
+                if as_store:
+                    cards = CardStore(cards)
+                scheduler = FSRS6Scheduler()
+                scheduler.index_cards(cards)
+                metadata = DeckMetadata()
+                revision = scheduler.revision
+                report = grade_many(pm, scheduler, cards, "u", deck, grades, metadata)
+                assert report.grades == len(grades) and report.cards == 200
+                assert report.batches == 3  # Day 1, then day 2 in two rounds
+                assert [state(card) for card in cards] == [state(expected[card.card_id])
+                                                           for card in cards]
+                assert not any(card.dirty for card in cards)
+                assert scheduler.revision > revision
+                stats, recount = scheduler.deck_stats, DeckStats.from_cards(cards)
+                assert stats.state_counts == recount.state_counts
+                assert stats.total_lapses == recount.total_lapses
+                assert abs(stats.stability_sum - recount.stability_sum) < 1e-6
+                assert scheduler.due_index.due_count() == sum(
+                    1 for card in cards if scheduler.is_card_due(card))
+                assert metadata.daily_counts.total() == len(grades) and not metadata.dirty
+                # The day counts are saved with the reviews
+                saved_metadata = pm.load_deck_metadata("u", deck)
+                assert saved_metadata.daily_counts.total() == len(grades)
+                
+                # Saved state and log agree, and the log replays exactly
+                saved = pm.load_card_metadata("u", deck)
+                assert all(saved[card.card_id]['stability'] == card.stability for card in cards)
+                assert sum(1 for _ in pm.iter_review_events("u", deck)) == len(grades)
+                assert replay_deck(pm, "u", deck).mismatch_count == 0
+        
+        # A bad grade anywhere changes nothing
+        pm = backends[0]
+        cards = [Card(front=f"c{i}", back="b") for i in range(5)]
+        pm.save_card_metadata("u", "bad", cards)
+        scheduler = FSRS6Scheduler()
+        scheduler.index_cards(cards)
+        before = [state(card) for card in cards]
+        for bad in [(make_card_id("missing"), False, None), (cards[0].card_id, False, "noon")]:
+            try:
+                grade_many(pm, scheduler, cards, "u", "bad",
+                           [(cards[1].card_id, True, None), bad])
+                assert False, "Should have raised GradingError"
+            except GradingError:
+                pass
+        assert [state(card) for card in cards] == before
+        assert pm.journal_size("u", "bad") == 0
+        
+        # A crash mid-commit tears the batch's single journal line: all of it
+        # is lost, day counts included
+        grade_many(pm, scheduler, cards, "u", "bad",
+                   [(card.card_id, False, start) for card in cards], DeckMetadata())
+        journal = pm.get_user_deck_dir("u", "bad") / "reviews.journal"
+        data = journal.read_bytes()
+        assert data.count(b"\n") == 1
+        assert pm.load_deck_metadata("u", "bad").daily_counts.total() == 5
+        journal.write_bytes(data[:len(data) // 2])
+        assert all(values['state'] == 0 for values in pm.load_card_metadata("u", "bad").values())
+        assert pm.load_deck_metadata("u", "bad").daily_counts.total() == 0
+        
+        # On JSON the day counts live in the batch's journal line, which wins
+        # over an older deck_metadata.json until a later save or the journal's
+        # archiving brings the file up to date
+        metadata = DeckMetadata()
+        grade_many(pm, scheduler, cards, "u", "json", [(cards[0].card_id, False, start)],
+                   metadata)
+        pm.save_deck_metadata("u", "json", DeckMetadata())  # A stale queued copy
+        assert pm.load_deck_metadata("u", "json").daily_counts.total() == 1
+        metadata.increment_today_count()
+        pm.save_deck_metadata("u", "json", metadata)
+        assert pm.load_deck_metadata("u", "json").daily_counts.total() == 2
+        grade_many(pm, scheduler, cards, "u", "json", [(cards[1].card_id, False, start)],
+                   metadata)
+        pm.save_card_metadata("u", "json", cards, full=True)  # Archives the journal
+        assert pm.journal_size("u", "json") == 0
+        with open(pm.get_user_deck_dir("u", "json") / "deck_metadata.json") as f:
+            assert DeckMetadata.from_dict(json.load(f)) == metadata
+        assert sum(1 for _ in pm.iter_review_events("u", "json")) == 2
+        
+        # On SQLite a failed metadata write rolls the reviews back with it
+        db = backends[1]
+        db._conn.execute("DROP TABLE decks")
+        try:
+            grade_many(db, scheduler, cards, "u", "gone", [(cards[0].card_id, False, start)],
+                       DeckMetadata())
+            assert False, "Expected sqlite3.Error"
+        except sqlite3.Error:
+            pass
+        assert sum(1 for _ in db.iter_review_events("u", "gone")) == 0
+        db.close()
+    
+    print("✓ Bulk grading tests passed")
+
+
+def test_api_server():
+    """Test the HTTP scheduling service end to end over real connections."""
+    print("Testing API server...")
+    
+    async def scenario(tmpdir):
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        write_synthetic_deck(csv_path, 30)
+        data_dir = os.path.join(tmpdir, "users")
+        pm = PersistenceManager(base_dir=data_dir)
+        service = SchedulingService(pm, data_dir, csv_path, "deck", max_sessions=1,
+                                    debounce_seconds=0.01)
+        server = ApiServer(service)
+        port = await server.start("127.0.0.1", 0)
+        client = ApiClient("127.0.0.1", port)
+        await client.connect()
+        try:
+            status, reply = await client.request('POST', '/login', {'user': "alice"})
+            assert status == 200 and reply['cards'] == 30 and reply['due'] == 30
+            status, reply = await client.request('GET', '/next?user=alice')
+            card = reply['card']
+            assert status == 200 and card['state'] == 0
+            
+            # Grading returns the new schedule and, on request, the next card
+            status, reply = await client.request('POST', '/grade', {
+                'user': "alice", 'card_id': card['id'], 'again': False, 'next': True})
+            assert status == 200 and reply['card']['state'] == 2
+            assert reply['reviewed_today'] == 1 and reply['next']['card']['id'] != card['id']
+            graded = reply['card']
+            status, stats = await client.request('GET', '/stats?user=alice')
+            assert stats['due'] == 29 and stats['state_counts'][2] == 1
+            status, reply = await client.request('GET', '/forecast?user=alice&days=7')
+            assert len(reply['forecast']) == 7 and reply['forecast'][0] == 29
+            
+            # The daily limit holds until the client chooses to go over it
+            for _ in range(19):
+                status, reply = await client.request('GET', '/next?user=alice')
+                await client.request('POST', '/grade', {
+                    'user': "alice", 'card_id': reply['card']['id'], 'again': True})
+            status, reply = await client.request('GET', '/next?user=alice')
+            assert reply == {'card': None, 'limit_reached': True}
+            status, reply = await client.request('GET', '/next?user=alice&over_limit=1')
+            assert reply['card'] is not None
+            
+            # Errors
+            for method, path, payload, expected in [
+                ('POST', '/grade', {'user': "alice", 'card_id': 1, 'again': False}, 404),
+                ('POST', '/grade', {'user': "alice"}, 400),
+                ('GET', '/next?user=nobody', None, 404),
+                ('POST', '/login', {'user': "../etc"}, 400),
+                ('GET', '/forecast?user=alice&days=0', None, 400),
+                ('GET', '/nowhere', None, 404),
+                ('GET', '/grade', None, 405),
+            ]:
+                status, reply = await client.request(method, path, payload)
+                assert status == expected and 'error' in reply, (path, status)
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /login HTTP/1.1\r\nConnection: close\r\n"
+                         b"Content-Length: 3\r\n\r\n{x}")
+            assert (await reader.read()).startswith(b"HTTP/1.1 400 ")
+            writer.close()
+            
+            # A second user evicts alice (max_sessions=1); her state is saved and reloaded
+            status, _ = await client.request('POST', '/login', {'user': "bob"})
+            assert status == 200 and list(service.sessions) == ["bob"]
+            status, stats = await client.request('GET', '/stats?user=alice')
+            assert stats['reviewed_today'] == 20 and stats['state_counts'][2] == 1
+            assert list(service.sessions) == ["alice"]
+            alice = service.sessions["alice"]
+            reloaded = alice.card(graded['id'])
+            assert (reloaded.stability, reloaded.next_due_day) == (graded['stability'],
+                                                                  graded['next_due_day'])
+            
+            # Several users at once through the load generator
+            report = await run_load("127.0.0.1", port, ["carol", "dave", "erin"], 40)
+            assert report.errors == 0 and report.grades == 90  # 30 new cards each
+        finally:
+            await client.close()
+            await server.close()
+        
+        for user in ("alice", "carol"):
+            assert replay_deck(pm, user, "deck").mismatch_count == 0
+        assert sum(1 for _ in pm.iter_review_events("carol", "deck")) == 30
+        assert pm.load_deck_metadata("alice", "deck").allow_over_limit_today
+    
+    async def failed_flush(tmpdir):
+        # Evicting a user whose reviews cannot be written keeps them queued,
+        # leaves the snapshot alone and does not hold up other users
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        write_synthetic_deck(csv_path, 10)
+        data_dir = os.path.join(tmpdir, "users")
+        pm = FailingPersistence(base_dir=data_dir)
+        pm.broken = False
+        service = SchedulingService(pm, data_dir, csv_path, "deck", max_sessions=1,
+                                    debounce_seconds=0.01)
+        server = ApiServer(service)
+        port = await server.start("127.0.0.1", 0)
+        client = ApiClient("127.0.0.1", port)
+        await client.connect()
+        try:
+            await client.request('POST', '/login', {'user': "alice"})
+            status, reply = await client.request('GET', '/next?user=alice')
+            pm.broken = True
+            await client.request('POST', '/grade', {
+                'user': "alice", 'card_id': reply['card']['id'], 'again': False})
+            deck_dir = pm.get_user_deck_dir("alice", "deck")
+            snapshot = (deck_dir / "deck.snapshot").read_bytes()
+            
+            status, _ = await client.request('POST', '/login', {'user': "bob"})
+            assert status == 200 and list(service.sessions) == ["bob"]
+            await asyncio.gather(*service._closing.values())
+            assert service.saver.has_pending()
+            assert (deck_dir / "deck.snapshot").read_bytes() == snapshot
+            assert not (deck_dir / "deck_header.json").exists()
+            
+            # Once writes work again, loading alice waits for her reviews
+            pm.broken = False
+            status, stats = await client.request('GET', '/stats?user=alice')
+            assert status == 200 and stats['state_counts'][2] == 1
+            assert not service.saver.has_pending()
+        finally:
+            await client.close()
+            await server.close()
+        assert sum(1 for _ in pm.iter_review_events("alice", "deck")) == 1
+    
+    async def close_while_loading(tmpdir):
+        # A session still loading when the service closes is saved and
+        # unmapped like the others; later requests are turned away
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        write_synthetic_deck(csv_path, 10)
+        data_dir = os.path.join(tmpdir, "users")
+        pm = PersistenceManager(base_dir=data_dir)
+        service = SchedulingService(pm, data_dir, csv_path, "deck")
+        login = asyncio.ensure_future(service.login({'user': "carol"}))
+        await asyncio.sleep(0)
+        assert "carol" in service._loading
+        await service.close()
+        assert (await login)['cards'] == 10
+        assert not service.sessions
+        assert (pm.get_user_deck_dir("carol", "deck") / "deck_header.json").exists()
+        try:
+            await service.login({'user': "dave"})
+            assert False, "Expected ApiError"
+        except ApiError as e:
+            assert e.status == HTTPStatus.SERVICE_UNAVAILABLE
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        asyncio.run(scenario(tmpdir))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        asyncio.run(failed_flush(tmpdir))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        asyncio.run(close_while_loading(tmpdir))
+    
+    print("✓ API server tests passed")
+
+
+def test_dirty_tracking():
+    """Test that saves only write cards changed since the last save."""
+    print("Testing dirty tracking...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pm = PersistenceManager(base_dir=tmpdir)
+        user, deck = "dirty_user", "deck"
+        cards = [Card(front=str(i), back=str(i)) for i in range(100)]
+        assert all(card.dirty for card in cards)
+        
+        # First save writes a full snapshot and cleans every card
+        stats = pm.save_card_metadata(user, deck, cards)
+        assert stats.records == 100 and stats.bytes > 0
+        assert not any(card.dirty for card in cards)
+        
+        # Later saves write only what changed
+        assert pm.save_card_metadata(user, deck, cards).records == 0
+        scheduler = FSRS6Scheduler()
+        for card in cards[:3]:
+            scheduler.schedule_card(card, grade_again=False)
+        stats = pm.save_card_metadata(user, deck, cards)
+        assert stats.records == 3
+        assert stats.bytes == pm.journal_size(user, deck)
+        assert pm.save_totals.records == 103
+        assert pm.load_card_metadata(user, deck) == {c.card_id: c.to_metadata() for c in cards}
+        
+        # Delta records are not reviews
+        journal = pm.get_user_deck_dir(user, deck) / "reviews.journal"
+        with open(journal, encoding='utf-8') as f:
+            assert all(json.loads(line)[2] is None for line in f)
+        
+        # Loaded cards start clean; deck metadata tracks its own changes
+        loaded = pm.load_deck_from_csv("hiragana.csv", user, deck)
+        assert not any(card.dirty for card in loaded)
+        deck_meta = pm.load_deck_metadata(user, deck)
+        assert not deck_meta.dirty
+        deck_meta.increment_today_count()
+        assert deck_meta.dirty
+        pm.save_deck_metadata(user, deck, deck_meta)
+        assert not deck_meta.dirty
+        
+        # CardStore views track dirtiness per row
+        store = CardStore(loaded[:5])
+        assert not store.dirty_rows
+        scheduler.schedule_card(store[2], grade_again=True)
+        assert store.dirty_rows == {2} and store[2].dirty
+    
+    print("✓ Dirty tracking tests passed")
+
+
+def test_sqlite_persistence():
+    """Test the SQLite backend and migration from the JSON layout."""
+    print("Testing SQLite persistence...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = SqlitePersistenceManager(os.path.join(tmpdir, "cards.db"))
+        user, deck = "sqlite_user", "deck"
+        assert not db.user_exists(user)
+        
+        cards = [Card(front="あ", back="a", state=2, last_seen=739000, stability=3.0,
+                      interval_days=3),
+                 Card(front="い", back="i")]
+        assert db.save_card_metadata(user, deck, cards).records == 2
+        assert db.user_exists(user) and db.list_users() == [user]
+        
+        # Only changed rows are written
+        assert db.save_card_metadata(user, deck, cards).records == 0
+        FSRS6Scheduler().schedule_card(cards[1], grade_again=False)
+        assert db.save_card_metadata(user, deck, cards).records == 1
+        assert db.save_card_metadata(user, deck, cards, full=True).records == 2
+        
+        db.append_review(user, deck, cards[0], grade_again=True)
+        db.close()
+        
+        reopened = SqlitePersistenceManager(os.path.join(tmpdir, "cards.db"))
+        loaded = reopened.load_card_metadata(user, deck)
+        assert loaded == {c.card_id: c.to_metadata() for c in cards}
+        
+        deck_meta = DeckMetadata(max_per_day=30)
+        reopened.save_deck_metadata(user, deck, deck_meta)
+        assert reopened.load_deck_metadata(user, deck).max_per_day == 30
+        assert reopened.load_deck_metadata(user, "other").max_per_day == 20
+        reopened.close()
+        
+        # Migrate a JSON layout, journal included
+        json_pm = PersistenceManager(base_dir=os.path.join(tmpdir, "users"))
+        json_pm.save_card_metadata("alice", deck, cards)
+        FSRS6Scheduler().schedule_card(cards[0], grade_again=False)
+        json_pm.append_review("alice", deck, cards[0], grade_again=False)
+        json_pm.save_deck_metadata("alice", deck, deck_meta)
+        
+        target = SqlitePersistenceManager(os.path.join(tmpdir, "migrated.db"))
+        counts = migrate_from_json(json_pm, target)
+        assert counts == {'users': 1, 'decks': 1, 'cards': 2, 'reviews': 1}
+        assert list(target.iter_review_events("alice", deck)) == list(
+            json_pm.iter_review_events("alice", deck))
+        assert target.load_card_metadata("alice", deck) == json_pm.load_card_metadata("alice", deck)
+        assert target.load_deck_metadata("alice", deck).max_per_day == 30
+        
+        # Running the migration again adds no duplicate reviews
+        counts = migrate_from_json(json_pm, target)
+        assert counts == {'users': 1, 'decks': 1, 'cards': 2, 'reviews': 0}
+        assert len(list(target.iter_review_events("alice", deck))) == 1
+        target.close()
+        
+        # A CardStore saves only its dirty rows
+        db = SqlitePersistenceManager(os.path.join(tmpdir, "store.db"))
+        store = CardStore(Card(front=f"c{i}", back="b") for i in range(50))
+        assert db.save_card_metadata(user, deck, store).records == 50
+        FSRS6Scheduler().schedule_card(store[7], grade_again=False)
+        assert db.save_card_metadata(user, deck, store).records == 1
+        assert not store.dirty_rows
+        db.close()
+        
+        # every_n checkpoints the WAL on every Nth logical save
+        db = SqlitePersistenceManager(os.path.join(tmpdir, "every_n.db"),
+                                      durability=DurabilityPolicy('every_n', every_n=3))
+        syncs = []
+        db.sync = lambda: syncs.append(True)
+        for _ in range(7):
+            db.append_review(user, deck, cards[0], grade_again=False)
+        with db.write_group():  # One logical save, however many writes
+            db.append_review(user, deck, cards[0], grade_again=False)
+            db.save_deck_metadata(user, deck, deck_meta)
+        assert len(syncs) == 2
+        db.close()
+    
+    print("✓ SQLite persistence tests passed")
+
+
+class FailingPersistence(PersistenceManager):
+    """PersistenceManager whose journal writes fail until fixed."""
+    broken = True
+    
+    def append_reviews(self, user, deck_name, records):
+        if self.broken:
+            raise IOError("disk full")
+        super().append_reviews(user, deck_name, records)
+
+
+def test_write_behind_saver():
+    """Test coalesced background saving, flush, error reporting and close."""
+    print("Testing write-behind saver...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pm = PersistenceManager(base_dir=tmpdir)
+        saver = WriteBehindSaver(pm, debounce_seconds=60)
+        scheduler = FSRS6Scheduler()
+        deck_meta = DeckMetadata()
+        cards = [Card(front=str(i), back=str(i)) for i in range(20)]
+        
+        for card in cards:
+            scheduler.schedule_card(card, grade_again=False)
+            deck_meta.increment_today_count()
+            saver.record_review("u", "d", card, False, deck_meta)
+        assert saver.has_pending()
+        
+        # Nothing is written until the debounce expires or a flush is requested
+        assert saver.flush(timeout=5)
+        assert saver.flush_count == 1
+        assert pm.load_card_metadata("u", "d") == {c.card_id: c.to_metadata() for c in cards}
+        assert pm.load_deck_metadata("u", "d").get_today_count() == 20
+        
+        # Close writes anything still queued
+        scheduler.schedule_card(cards[0], grade_again=True)
+        saver.record_review("u", "d", cards[0], True)
+        assert saver.close()
+        assert pm.load_card_metadata("u", "d")[cards[0].card_id] == cards[0].to_metadata()
+        
+        # Failed writes are reported and retried
+        failing = FailingPersistence(base_dir=tmpdir)
+        saver = WriteBehindSaver(failing, debounce_seconds=60)
+        saver.record_review("u", "d", cards[1], False)
+        assert not saver.flush(timeout=5)
+        assert isinstance(saver.errors.get_nowait(), IOError)
+        assert saver.has_pending()
+        failing.broken = False
+        assert saver.close()
+        assert not saver.has_pending()
+    
+    print("✓ Write-behind saver tests passed")
+
+
+def test_durable_writes():
+    """Test atomic replacement, write groups, durability levels and settings saves."""
+    print("Testing durable writes...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "state.json")
+        atomic_write_bytes(path, b'{"v": 1}')
+        atomic_write_bytes(path, b'{"v": 2}')
+        with open(path, 'rb') as f:
+            assert f.read() == b'{"v": 2}'
+        assert os.listdir(tmpdir) == ["state.json"]
+        
+        # A failed group leaves every target untouched
+        other = os.path.join(tmpdir, "other.json")
+        try:
+            with WriteGroup() as group:
+                group.write(path, b'{"v": 3}')
+                group.write(other, b'{}')
+                raise IOError("crash mid-save")
+        except IOError:
+            pass
+        with open(path, 'rb') as f:
+            assert f.read() == b'{"v": 2}'
+        assert os.listdir(tmpdir) == ["state.json"]
+        
+        # One barrier per group, not per file
+        with WriteGroup() as group:
+            group.write(path, b'{"v": 4}')
+            group.write(other, b'{}')
+        assert group.fsync_count == 3  # two files, one directory
+        
+        # Durability levels decide which saves sync
+        for level, expected in [(DurabilityPolicy.EVERY_GRADE, 10),
+                                (DurabilityPolicy.EVERY_N, 2),
+                                (DurabilityPolicy.SESSION_END, 0)]:
+            policy = DurabilityPolicy(level, every_n=5)
+            assert sum(policy.next_save_syncs() for _ in range(10)) == expected
+        try:
+            DurabilityPolicy('sometimes')
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+        
+        # Nested saves share the outer group; deferred syncs are tracked
+        pm = PersistenceManager(base_dir=tmpdir,
+                                durability=DurabilityPolicy(DurabilityPolicy.SESSION_END))
+        card = Card(front="あ", back="a")
+        FSRS6Scheduler().schedule_card(card, grade_again=False)
+        deck_meta = DeckMetadata()
+        deck_meta.increment_today_count()
+        with pm.write_group() as group:
+            pm.append_reviews("u", "d", [pm.review_record(card, False)])
+            pm.save_deck_metadata("u", "d", deck_meta)
+        assert not group.sync and len(group.paths) == 2
+        assert pm._unsynced == group.paths
+        pm.sync()
+        assert not pm._unsynced
+        assert pm.load_card_metadata("u", "d") == {card.card_id: card.to_metadata()}
+        assert pm.load_deck_metadata("u", "d").get_today_count() == 1
+        
+        # Settings are replaced atomically
+        settings = UserSettings("u", base_dir=tmpdir)
+        settings.minutes_per_day = 45
+        settings.save()
+        assert UserSettings("u", base_dir=tmpdir).minutes_per_day == 45
+        assert not [name for name in os.listdir(os.path.join(tmpdir, "u")) if name.endswith(".tmp")]
+    
+    print("✓ Durable write tests passed")
+
+
+def test_deck_snapshot():
+    """Test the memory-mapped binary deck snapshot."""
+    print("Testing deck snapshots...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write("front,back,state,lastSeen\n")
+            for i in range(50):
+                f.write(f"字{i},ji {i},0,\n")
+        pm = PersistenceManager(base_dir=os.path.join(tmpdir, "users"))
+        scheduler = FSRS6Scheduler()
+        cards = pm.load_deck_from_csv(csv_path, "u", "d")
+        scheduler.schedule_card(cards[3], grade_again=False)
+        pm.save_card_metadata("u", "d", cards)
+        
+        # First open builds the snapshot; it matches the CSV + metadata load
+        store = pm.open_deck_snapshot(csv_path, "u", "d")
+        assert isinstance(store, MappedCardStore)
+        assert len(store) == 50
+        assert [c.to_metadata() for c in store] == [c.to_metadata() for c in cards]
+        assert store[-1].front == "字49" and store[-1].back == "ji 49"
+        assert store[3].next_due_day == cards[3].next_due_day
+        snapshot_file = pm.get_user_deck_dir("u", "d") / "deck.snapshot"
+        with open(snapshot_file, 'rb') as f:
+            on_disk = f.read()
+        
+        # Edits stay in memory (copy-on-write); the file is untouched
+        scheduler.schedule_card(store[7], grade_again=False)
+        assert store[7].state == 2 and store[7].dirty
+        with open(snapshot_file, 'rb') as f:
+            assert f.read() == on_disk
+        try:
+            store.append(Card(front="x", back="x"))
+            assert False, "Expected TypeError"
+        except TypeError:
+            pass
+        
+        # Saved progress makes the snapshot stale, so it is rebuilt
+        pm.save_card_metadata("u", "d", store)
+        store.close()
+        store = pm.open_deck_snapshot(csv_path, "u", "d")
+        assert store[7].state == 2 and not store[7].dirty
+        
+        # Saving over the mapped file unmaps it for the replace and maps the
+        # new file, keeping in-memory edits and dirty rows
+        view = store[9]
+        scheduler.schedule_card(view, grade_again=False)
+        pm.save_deck_snapshot(csv_path, "u", "d", store)
+        assert view.state == 2 and store.dirty_rows == {9}
+        saved = MappedCardStore(snapshot_file)
+        assert saved[9].state == 2
+        saved.close()
+        
+        # A fresh snapshot is reused as-is
+        store.close()
+        with open(snapshot_file, 'rb') as f:
+            on_disk = f.read()
+        store = pm.open_deck_snapshot(csv_path, "u", "d")
+        with open(snapshot_file, 'rb') as f:
+            assert f.read() == on_disk
+        store.close()
+        
+        # A fresh fingerprint over a damaged body is rebuilt like a stale one
+        with open(snapshot_file, 'r+b') as f:
+            f.truncate(len(on_disk) - 3)
+        store = pm.open_deck_snapshot(csv_path, "u", "d")
+        assert len(store) == 50 and store[7].state == 2
+        store.close()
+        
+        # Corrupt files are rejected
+        bad_file = os.path.join(tmpdir, "bad.snapshot")
+        with open(bad_file, 'wb') as f:
+            f.write(encode_snapshot(cards)[:-3])
+        try:
+            MappedCardStore(bad_file)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+    
+    print("✓ Deck snapshot tests passed")
+
+
+def test_deck_header():
+    """Test the login-time deck header and its staleness checks."""
+    print("Testing deck headers...")
+    today = datetime.now().date().toordinal()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write("front,back,state,lastSeen\n")
+            for i in range(30):
+                f.write(f"w{i},b{i},0,\n")
+        
+        for pm in (PersistenceManager(base_dir=os.path.join(tmpdir, "json")),
+                   SqlitePersistenceManager(os.path.join(tmpdir, "test.db"),
+                                            base_dir=os.path.join(tmpdir, "sqlite"))):
+            scheduler = FSRS6Scheduler()
+            cards = pm.load_deck_from_csv(csv_path, "u", "d")
+            for card in cards[:10]:
+                scheduler.schedule_card(card, grade_again=False, today=today)
+            pm.save_card_metadata("u", "d", cards)
+            assert pm.load_deck_header(csv_path, "u", "d") is None
+            
+            pm.save_deck_header(csv_path, "u", "d", cards)
+            header = pm.load_deck_header(csv_path, "u", "d")
+            assert header == DeckHeader.from_cards(cards, header.source)
+            assert header.total_cards == 30
+            assert header.due_count(today) == scheduler.count_due_cards(cards) == 20
+            assert header.due_count(today + 400) == 30
+            
+            # Any later save makes it stale
+            scheduler.schedule_card(cards[20], grade_again=False, today=today)
+            pm.append_review("u", "d", cards[20], False)
+            assert pm.load_deck_header(csv_path, "u", "d") is None
+            
+            # Snapshots share the same freshness check on both backends
+            pm.save_deck_header(csv_path, "u", "d", cards)
+            store = pm.open_deck_snapshot(csv_path, "u", "d")
+            assert isinstance(store, MappedCardStore)
+            assert DeckHeader.from_cards(store) == DeckHeader.from_cards(cards)
+            assert pm.load_deck_header(csv_path, "u", "d") is not None
+            store.close()
+            if isinstance(pm, SqlitePersistenceManager):
+                pm.close()
+    
+    print("✓ Deck header tests passed")
+
+
+def test_card_ids():
+    """Test stable card IDs, duplicate fronts and migration from front-keyed data."""
+    print("Testing card IDs...")
+    assert make_card_id("あ") == make_card_id("あ") != make_card_id("あ", 1)
+    assert 0 <= make_card_id("あ") < 2 ** 63
+    assert Card(front="あ", back="a").card_id == make_card_id("あ")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write("front,back,state,lastSeen\nはし,bridge,0,\nはし,chopsticks,0,\nあ,a,0,\n")
+        
+        # Duplicate fronts are separate cards with separate progress
+        pm = PersistenceManager(base_dir=os.path.join(tmpdir, "users"))
+        cards = pm.load_deck_from_csv(csv_path, "u", "d")
+        assert [c.card_id for c in cards] == [
+            make_card_id("はし"), make_card_id("はし", 1), make_card_id("あ")]
+        FSRS6Scheduler().schedule_card(cards[1], grade_again=False)
+        pm.save_card_metadata("u", "d", cards)
+        reloaded = pm.load_deck_from_csv(csv_path, "u", "d")
+        assert [c.state for c in reloaded] == [0, 2, 0]
+        store = pm.load_card_store(csv_path, "u", "d")
+        assert [view.card_id for view in store] == [c.card_id for c in cards]
+        assert store.card(1).card_id == cards[1].card_id
+        
+        # Front-keyed JSON files and journals from older versions are migrated
+        deck_dir = pm.ensure_user_deck_dir("legacy", "d")
+        with open(deck_dir / "cards_metadata.json", 'w', encoding='utf-8') as f:
+            json.dump({"あ": {"stability": 2.0, "difficulty": 5.0, "interval_days": 1,
+                             "lapses": 0, "state": 2, "last_seen": "2025-01-01"}}, f)
+        with open(deck_dir / "reviews.journal", 'w', encoding='utf-8') as f:
+            f.write(json.dumps(["はし", 1.0, 0, 4.0, 5.0, 3, 0, 2, 739000]) + "\n")
+        legacy = pm.load_deck_from_csv(csv_path, "legacy", "d")
+        assert [c.state for c in legacy] == [2, 0, 2]
+        assert legacy[2].last_seen == date(2025, 1, 1).toordinal()
+        pm.compact("legacy", "d")
+        with open(deck_dir / "cards_metadata.json", encoding='utf-8') as f:
+            data = json.load(f)
+        assert data['format'] == 2
+        assert set(data['cards']) == {str(make_card_id("あ")), str(make_card_id("はし"))}
+        
+        # Front-keyed SQLite databases are re-keyed when opened
+        db_path = os.path.join(tmpdir, "legacy.db")
+        conn = sqlite3.connect(db_path)
+        conn.executescript("""
+            CREATE TABLE users (name TEXT PRIMARY KEY);
+            CREATE TABLE cards (user TEXT NOT NULL, deck TEXT NOT NULL, front TEXT NOT NULL,
+                stability REAL NOT NULL, difficulty REAL NOT NULL,
+                interval_days INTEGER NOT NULL, lapses INTEGER NOT NULL,
+                state INTEGER NOT NULL, last_seen INTEGER, next_due INTEGER NOT NULL,
+                PRIMARY KEY (user, deck, front)) WITHOUT ROWID;
+            CREATE INDEX cards_next_due ON cards (user, deck, next_due);
+            CREATE TABLE reviews (user TEXT NOT NULL, deck TEXT NOT NULL, front TEXT NOT NULL,
+                timestamp REAL NOT NULL, grade_again INTEGER NOT NULL);
+            CREATE INDEX reviews_user_deck ON reviews (user, deck, timestamp);
+            INSERT INTO users VALUES ('u');
+            INSERT INTO cards VALUES ('u', 'd', 'あ', 2.0, 5.0, 1, 0, 2, 739000, 739001);
+            INSERT INTO reviews VALUES ('u', 'd', 'あ', 1.0, 0);
+        """)
+        conn.close()
+        sqlite_pm = SqlitePersistenceManager(db_path, base_dir=tmpdir)
+        assert sqlite_pm.load_card_metadata("u", "d")[make_card_id("あ")]['stability'] == 2.0
+        with sqlite_pm._lock:
+            assert sqlite_pm._conn.execute(
+                "SELECT card_id FROM reviews").fetchall() == [(make_card_id("あ"),)]
+        sqlite_pm.close()
+    
+    print("✓ Card ID tests passed")
+
+
+def test_deck_import():
+    """Test streaming, validated, chunked deck CSV import into both backends."""
+    print("Testing deck import...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        deck_path = os.path.join(tmpdir, "deck.csv")
+        with open(deck_path, 'w', encoding='utf-8') as f:
+            f.write("front,back,state,lastSeen\n")
+            for i in range(250):
+                f.write(f"字{i},ji {i},0,\n")
+            f.write("字7,shichi,0,\n")
+            f.write('"quoted, front",back,0,\n')
+        csv_path = os.path.join(tmpdir, "big.csv")
+        with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write("front,back,state,lastSeen\n")
+            for i in range(250):
+                f.write(f"字{i},ji {i},2,2025-01-01\n")
+            f.write("字7,shichi,0,\n")
+            f.write("字8,ji 8,0,\n")
+            f.write("not in deck,x,0,\n")
+            f.write(",no front,0,\n")
+            f.write("bad state,x,9,\n")
+            f.write("bad date,x,2,not-a-date\n")
+            f.write("short row,x\n")
+            f.write('"quoted, front",back,0,\n')
+        
+        for pm in (PersistenceManager(base_dir=os.path.join(tmpdir, "users")),
+                   SqlitePersistenceManager(os.path.join(tmpdir, "test.db"),
+                                            base_dir=os.path.join(tmpdir, "users"))):
+            updates = []
+            report = import_deck_csv(pm, deck_path, csv_path, "u", "d", chunk_rows=100,
+                                     progress=lambda r: updates.append(r.imported))
+            assert report.rows == 258
+            assert report.imported == 252
+            assert report.duplicate_count == 1 and report.duplicates == [(253, "字8")]
+            assert report.unknown_count == 1 and report.unknown == [(254, "not in deck")]
+            assert report.error_count == 4
+            assert [line for line, _ in report.errors] == [255, 256, 257, 258]
+            assert updates == [100, 200, 252, 252]
+            assert report.fraction == 1.0
+            
+            # The repeated front matches the deck's second card by its back;
+            # rows matching no card are not stored
+            metadata = pm.load_card_metadata("u", "d")
+            assert len(metadata) == 252
+            assert metadata[make_card_id("字7")]['state'] == 2
+            assert metadata[make_card_id("字7")]['last_seen'] == date(2025, 1, 1).toordinal()
+            assert metadata[make_card_id("字7", 1)]['state'] == 0
+            assert metadata[make_card_id("字8")]['state'] == 2
+            assert metadata[make_card_id("quoted, front")]['state'] == 0
+            assert make_card_id("not in deck") not in metadata
+            if isinstance(pm, SqlitePersistenceManager):
+                pm.close()
+        
+        # Files that cannot be imported at all are rejected up front
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write("word,meaning\nあ,a\n")
+        try:
+            import_deck_csv(PersistenceManager(base_dir=tmpdir), deck_path, csv_path, "u", "d")
+            assert False, "Expected DeckImportError"
+        except DeckImportError:
+            pass
+        
+        # So are files that are not UTF-8 or not valid CSV; chunks written
+        # before the failing line stay imported
+        with open(csv_path, 'wb') as f:
+            f.write("front,back\nあ,a\n".encode('shift_jis'))
+        try:
+            import_deck_csv(PersistenceManager(base_dir=tmpdir), deck_path, csv_path, "u", "d")
+            assert False, "Expected DeckImportError"
+        except DeckImportError as e:
+            assert "line 2" in str(e)
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write("front,back,state,lastSeen\n")
+            for i in range(150):
+                f.write(f"字{i},ji {i},2,2025-01-01\n")
+            f.write("x" * 200_000 + ",y,0,\n")
+        pm = PersistenceManager(base_dir=os.path.join(tmpdir, "malformed"))
+        try:
+            import_deck_csv(pm, deck_path, csv_path, "u", "d", chunk_rows=100)
+            assert False, "Expected DeckImportError"
+        except DeckImportError as e:
+            assert "line 152" in str(e) and "100 rows" in str(e)
+        assert len(pm.load_card_metadata("u", "d")) == 100
+    
+    print("✓ Deck import tests passed")
+
+
 def test_csv_loading():
     """Test loading hiragana.csv."""
     print("Testing CSV loading...")
@@ -157,6 +1779,51 @@ def test_csv_loading():
     print(f"✓ CSV loading tests passed (loaded {len(cards)} cards)")
 
 
+def test_shared_deck_content():
+    """Test that deck CSVs are parsed once, never rewritten, and exported on demand."""
+    print("Testing shared deck content...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, "deck.csv")
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write("front,back,state,lastSeen\nあ,a,0,\nい,i,0,\n")
+        with open(csv_path, 'rb') as f:
+            original = f.read()
+        
+        pm = PersistenceManager(base_dir=os.path.join(tmpdir, "users"))
+        parses = deck_content_cache.parse_count
+        alice = pm.load_deck_from_csv(csv_path, "alice", "deck")
+        bob = pm.load_deck_from_csv(csv_path, "bob", "deck")
+        assert deck_content_cache.parse_count == parses + 1
+        assert alice[0].front is bob[0].front
+        
+        # Progress goes to the user's overlay only
+        FSRS6Scheduler().schedule_card(alice[0], grade_again=False)
+        pm.save_card_metadata("alice", "deck", alice)
+        with open(csv_path, 'rb') as f:
+            assert f.read() == original
+        assert pm.load_deck_from_csv(csv_path, "alice", "deck")[0].state == 2
+        assert pm.load_deck_from_csv(csv_path, "bob", "deck")[0].state == 0
+        
+        # Editing the file invalidates the cache
+        with open(csv_path, 'a', encoding='utf-8') as f:
+            f.write("う,u,0,\n")
+        assert len(pm.load_deck_from_csv(csv_path, "bob", "deck")) == 3
+        assert deck_content_cache.parse_count == parses + 2
+        
+        # Explicit export writes the merged view elsewhere
+        out_path = os.path.join(tmpdir, "alice.csv")
+        assert pm.export_deck_csv(csv_path, "alice", "deck", out_path) == 3
+        with open(out_path, encoding='utf-8') as f:
+            assert f.read().splitlines()[1].startswith("あ,a,2,")
+        try:
+            pm.export_deck_csv(csv_path, "alice", "deck", csv_path)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+    
+    print("✓ Shared deck content tests passed")
+
+
 def main():
     """Run all tests."""
     print("=" * 60)
@@ -166,9 +1833,34 @@ def main():
     try:
         test_card_model()
         test_deck_metadata()
+        test_daily_counts()
         test_fsrs_scheduler()
+        test_batch_scheduling_parity()
+        test_due_index()
+        test_due_forecast()
+        test_practice_queue()
+        test_deck_analytics()
+        test_deck_stats()
+        test_day_ordinals()
+        test_card_store()
         test_persistence()
+        test_review_journal()
+        test_review_replay()
+        test_parameter_optimizer()
+        test_workload_simulator()
+        test_load_balancer()
+        test_bulk_grading()
+        test_api_server()
+        test_dirty_tracking()
+        test_sqlite_persistence()
+        test_write_behind_saver()
+        test_durable_writes()
+        test_deck_snapshot()
+        test_deck_header()
+        test_card_ids()
+        test_deck_import()
         test_csv_loading()
+        test_shared_deck_content()
         
         print("=" * 60)
         print("✓ All tests passed!")
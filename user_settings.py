@@ -5,6 +5,8 @@ Handles intensity mapping, manual overrides, and settings persistence.
 from typing import Optional
 from pathlib import Path
 import json
+from durable import atomic_write_bytes
+from practice_queue import ORDERINGS
 
 
 class UserSettings:
@@ -21,11 +23,18 @@ class UserSettings:
         self.user = user
         self.base_dir = Path(base_dir)
         self.settings_file = self.base_dir / user / "settings.json"
+        # Scheduler constants fitted to the user's reviews (see optimizer.py)
+        self.params_file = self.base_dir / user / "fsrs_params.json"
         
         # Default settings
         self.minutes_per_day: int = 20  # Study time in minutes
         self.request_retention: float = 0.9  # Target retention (90%)
         self.manual_intensity_override: Optional[float] = None
+        # Which due cards a capped session keeps (see practice_queue.py)
+        self.practice_order: str = 'retrievability'
+        self.new_card_ratio: Optional[float] = None
+        # Spread intervals to flatten the daily review load (FSRS6Scheduler.load_balance)
+        self.load_balance: bool = False
         
         # Load existing settings if available
         self.load()
@@ -41,6 +50,9 @@ class UserSettings:
                 self.minutes_per_day = data.get('minutes_per_day', 20)
                 self.request_retention = data.get('request_retention', 0.9)
                 self.manual_intensity_override = data.get('manual_intensity_override')
+                self.practice_order = data.get('practice_order', 'retrievability')
+                self.new_card_ratio = data.get('new_card_ratio')
+                self.load_balance = data.get('load_balance', False)
         except (json.JSONDecodeError, IOError):
             # If file is corrupted, use defaults
             pass
@@ -53,11 +65,14 @@ class UserSettings:
         data = {
             'minutes_per_day': self.minutes_per_day,
             'request_retention': self.request_retention,
-            'manual_intensity_override': self.manual_intensity_override
+            'manual_intensity_override': self.manual_intensity_override,
+            'practice_order': self.practice_order,
+            'new_card_ratio': self.new_card_ratio,
+            'load_balance': self.load_balance
         }
         
-        with open(self.settings_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        # Atomic so a crash mid-save cannot reset the user's settings
+        atomic_write_bytes(self.settings_file, json.dumps(data, indent=2).encode('utf-8'))
     
     def minutes_to_intensity(self, minutes: int) -> float:
         """
@@ -142,6 +157,29 @@ class UserSettings:
         self.request_retention = max(0.5, min(1.0, retention))
         self.save()
     
+    def set_practice_order(self, ordering: str, new_ratio: Optional[float] = None):
+        """
+        Set how practice sessions choose among due cards.
+        
+        Args:
+            ordering: Name of a practice_queue.ORDERINGS entry
+            new_ratio: Share of a session reserved for new cards (0-1),
+                       or None to show them after review cards
+        
+        Raises:
+            ValueError: If the ordering is unknown
+        """
+        if ordering not in ORDERINGS:
+            raise ValueError(f"Unknown practice ordering '{ordering}'")
+        self.practice_order = ordering
+        self.new_card_ratio = None if new_ratio is None else max(0.0, min(1.0, new_ratio))
+        self.save()
+    
+    def set_load_balance(self, enabled: bool):
+        """Turn interval load balancing on or off."""
+        self.load_balance = bool(enabled)
+        self.save()
+    
     def is_manual_override_active(self) -> bool:
         """Check if manual intensity override is active."""
         return self.manual_intensity_override is not None
@@ -153,5 +191,8 @@ class UserSettings:
             'request_retention': self.request_retention,
             'manual_intensity_override': self.manual_intensity_override,
             'effective_intensity': self.effective_intensity(),
-            'is_manual_override': self.is_manual_override_active()
+            'is_manual_override': self.is_manual_override_active(),
+            'practice_order': self.practice_order,
+            'new_card_ratio': self.new_card_ratio,
+            'load_balance': self.load_balance
         }
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Monte Carlo simulation of the review workload a deck and scheduler produce.
+
+Each trial plays the deck forward day by day the way the practice screen
+does. The cards due that day are reviewed in the order that
+practice_queue.build_queue gives them under the user's practice order and
+new-card ratio, up to the daily limit, the rest carrying over. Each card
+is recalled with the probability the scheduler's own model gives,
+R = 0.9^(t/S), and the day's reviews are scheduled together with
+FSRS6Scheduler.schedule_batch. New cards are failed on first sight with
+probability FIRST_AGAIN_RATE. With the scheduler's load_balance on,
+intervals are balanced against the trial's own due-day histogram, as the
+app does against its due index.
+
+Averaging many trials gives the expected reviews (and minutes) per day for
+an intensity and retention, which is what minutes_to_intensity promises.
+Trials are independent and run in parallel by a process pool;
+calibrate_intensity searches for the intensity that fits a time budget.
+
+Usage:
+    python3 workload.py --user alice                 # project the current settings
+    python3 workload.py --user alice --calibrate     # minutes -> intensity table
+"""
+import argparse
+import random
+import sys
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterable, Optional
+from fsrs import FSRS6Scheduler
+from models import Card, CardStore, today_ordinal
+from persistence import PersistenceManager, deck_content_cache
+from practice_queue import build_queue
+from process_pool import map_in_workers, shared
+from user_settings import UserSettings
+
+
+# Share of new cards graded Again the first time they are shown
+FIRST_AGAIN_RATE = 0.3
+
+# Time one review takes, for converting reviews to minutes
+SECONDS_PER_REVIEW = 10.0
+
+# Minutes per day that --calibrate maps to intensities
+CALIBRATION_MINUTES = (5, 10, 20, 30, 40)
+
+# Bisection steps on intensity (0-10) in calibrate_intensity: 10 / 2^8 < 0.05
+CALIBRATION_STEPS = 8
+
+
+@dataclass
+class WorkloadReport:
+    """Projected workload for one deck and set of scheduler parameters."""
+    params: list  # FSRS6Scheduler.log_parameters() simulated
+    days: int
+    trials: int
+    seconds_per_review: float = SECONDS_PER_REVIEW
+    daily_reviews: list = field(default_factory=list)  # Mean reviews on each day
+    p90_reviews: float = 0.0  # 90th percentile of reviews on a day, over all trials
+    peak_reviews: float = 0.0  # Mean over trials of the busiest day's reviews
+    recall_rate: float = 0.0  # Share of reviews of seen cards that were recalled
+    backlog: float = 0.0  # Mean cards due but not reviewed at the end (daily limit)
+    seconds: float = 0.0
+    
+    @property
+    def mean_reviews(self) -> float:
+        """Average reviews per day."""
+        return sum(self.daily_reviews) / len(self.daily_reviews) if self.daily_reviews else 0.0
+    
+    @property
+    def mean_minutes(self) -> float:
+        """Average study minutes per day."""
+        return self.mean_reviews * self.seconds_per_review / 60
+
+
+def deck_columns(cards: Iterable[Card]) -> dict:
+    """Copy the scheduling fields of a card list or CardStore into columns."""
+    if isinstance(cards, CardStore):
+        return {
+            'states': array('b', cards.states),
+            'stabilities': array('d', cards.stabilities),
+            'difficulties': array('d', cards.difficulties),
+            'intervals': array('i', cards.intervals),
+            'lapses': array('i', cards.lapses),
+            'last_seen': array('i', cards.last_seen),
+            'next_due': array('i', cards.next_due),
+        }
+    columns = {
+        'states': array('b'), 'stabilities': array('d'), 'difficulties': array('d'),
+        'intervals': array('i'), 'lapses': array('i'), 'last_seen': array('i'),
+        'next_due': array('i'),
+    }
+    for card in cards:
+        columns['states'].append(card.state)
+        columns['stabilities'].append(card.stability)
+        columns['difficulties'].append(card.difficulty)
+        columns['intervals'].append(card.interval_days)
+        columns['lapses'].append(card.lapses)
+        columns['last_seen'].append(card.last_seen or CardStore.NO_DAY)
+        columns['next_due'].append(card.next_due_day)
+    return columns
+
+
+class _TrialDeck:
+    """A trial's columns under CardStore's names, for practice_queue.build_queue."""
+    __slots__ = ('states', 'stabilities', 'last_seen', 'next_due')
+    
+    def __init__(self, states: array, stabilities: array, last_seen: array, next_due: array):
+        self.states = states
+        self.stabilities = stabilities
+        self.last_seen = last_seen
+        self.next_due = next_due
+
+
+def simulate_trial(columns: dict, params: Optional[list], days: int, start_day: int,
+                   max_per_day: Optional[int] = None, seed: int = 0,
+                   load_balance: bool = False, ordering: str = 'retrievability',
+                   new_ratio: Optional[float] = None) -> tuple[list, int, int, int]:
+    """
+    Play a deck forward for one trial.
+    
+    Args:
+        columns: Deck columns from deck_columns (not modified)
+        params: log_parameters()-style scheduler parameters (None: the defaults)
+        days: Days to simulate
+        start_day: Day ordinal of the first simulated day
+        max_per_day: Daily review limit (None: review everything due)
+        seed: Random seed for the recall outcomes
+        load_balance: Balance intervals over the due-day histogram
+        ordering: Practice order (see practice_queue.ORDERINGS)
+        new_ratio: Share of each day's queue reserved for new cards, or None
+    
+    Returns:
+        (reviews on each day, reviews of seen cards, how many were recalled,
+        cards left due at the end)
+    """
+    rng = random.Random(seed)
+    scheduler = FSRS6Scheduler.from_log_parameters(params)
+    scheduler.load_balance = load_balance
+    states, stabilities = array('b', columns['states']), array('d', columns['stabilities'])
+    difficulties, intervals = array('d', columns['difficulties']), array('i', columns['intervals'])
+    lapses, last_seen = array('i', columns['lapses']), array('i', columns['last_seen'])
+    next_due = array('i', columns['next_due'])
+    deck = _TrialDeck(states, stabilities, last_seen, next_due)
+    
+    # Rows waiting for each future day, and rows due but not yet reviewed
+    upcoming: dict[int, list] = {}
+    due = []
+    for row, day in enumerate(next_due):
+        if day <= start_day:
+            due.append(row)
+        else:
+            upcoming.setdefault(day, []).append(row)
+    due_counts = Counter({day: len(rows) for day, rows in upcoming.items()})
+    
+    counts = []
+    seen = recalled = 0
+    for today in range(start_day, start_day + days):
+        due.extend(upcoming.pop(today, ()))
+        # The cards the practice screen would show, in its order
+        rows = build_queue(deck, due, max_per_day, ordering, new_ratio, today)
+        if len(rows) < len(due):
+            shown = set(rows)
+            due = [row for row in due if row not in shown]
+        else:
+            due = []
+        counts.append(len(rows))
+        if not rows:
+            continue
+        
+        # The day's cards as columns, scheduled in one pass
+        batch_states = array('b', [states[row] for row in rows])
+        batch_stabilities = array('d', [stabilities[row] for row in rows])
+        batch_difficulties = array('d', [difficulties[row] for row in rows])
+        batch_intervals = array('i', [0]) * len(rows)
+        batch_lapses = array('i', [lapses[row] for row in rows])
+        grades = []
+        for row, state, stability in zip(rows, batch_states, batch_stabilities):
+            if state == 0:
+                grades.append(rng.random() < FIRST_AGAIN_RATE)
+                continue
+            recall = 0.9 ** ((today - last_seen[row]) / stability) if stability > 0 else 0.0
+            grade_again = rng.random() >= recall
+            grades.append(grade_again)
+            seen += 1
+            recalled += not grade_again
+        scheduler.schedule_batch(batch_states, batch_stabilities, batch_difficulties,
+                                 batch_intervals, batch_lapses, grades, today=today,
+                                 due_counts=due_counts)
+        
+        for i, row in enumerate(rows):
+            states[row] = batch_states[i]
+            stabilities[row] = batch_stabilities[i]
+            difficulties[row] = batch_difficulties[i]
+            intervals[row] = batch_intervals[i]
+            lapses[row] = batch_lapses[i]
+            last_seen[row] = today
+            next_due[row] = today + batch_intervals[i]
+            upcoming.setdefault(next_due[row], []).append(row)
+    return counts, seen, recalled, len(due)
+
+
+def _run_trial(columns: dict, seed: int, params: Optional[list], days: int, start_day: int,
+               max_per_day: Optional[int], load_balance: bool, ordering: str,
+               new_ratio: Optional[float]) -> tuple[list, int, int, int]:
+    return simulate_trial(columns, params, days, start_day, max_per_day, seed, load_balance,
+                          ordering, new_ratio)
+
+
+def simulate_workload(cards: Iterable[Card], scheduler: Optional[FSRS6Scheduler] = None,
+                      days: int = 30, trials: int = 20, max_per_day: Optional[int] = None,
+                      seconds_per_review: float = SECONDS_PER_REVIEW,
+                      start_day: Optional[int] = None, seed: int = 0,
+                      ordering: str = 'retrievability', new_ratio: Optional[float] = None,
+                      processes: Optional[int] = None) -> WorkloadReport:
+    """
+    Project the daily review workload of a deck by Monte Carlo simulation.
+    
+    Args:
+        cards: Deck (card list or CardStore) in its current state
+        scheduler: Scheduler whose parameters and load_balance setting are
+                   simulated (default: defaults)
+        days: Days to simulate
+        trials: Independent trials to average
+        max_per_day: Daily review limit (None: review everything due)
+        seconds_per_review: Time one review takes, for minutes per day
+        start_day: Day ordinal of the first simulated day (default: today)
+        seed: Seed of the first trial; trial i uses seed + i
+        ordering: Practice order (UserSettings.practice_order)
+        new_ratio: Share of each day's queue reserved for new cards
+                   (UserSettings.new_card_ratio)
+        processes: Worker processes (default: one per CPU; 1 runs in-process)
+    """
+    start = time.perf_counter()
+    scheduler = scheduler or FSRS6Scheduler()
+    params = scheduler.log_parameters()
+    report = WorkloadReport(params, days, trials, seconds_per_review)
+    columns = deck_columns(cards)
+    if start_day is None:
+        start_day = today_ordinal()
+    
+    seeds = range(seed, seed + trials)
+    job = partial(_run_trial, params=params, days=days, start_day=start_day,
+                  max_per_day=max_per_day, load_balance=scheduler.load_balance,
+                  ordering=ordering, new_ratio=new_ratio)
+    # Each worker process receives the deck once
+    results = map_in_workers(job, seeds, shared, (columns,), processes)
+    
+    if results:
+        report.daily_reviews = [sum(day) / len(results) for day in zip(*(r[0] for r in results))]
+        everyday = sorted(count for r in results for count in r[0])
+        report.p90_reviews = float(everyday[int(0.9 * (len(everyday) - 1))]) if everyday else 0.0
+        report.peak_reviews = sum(max(r[0], default=0) for r in results) / len(results)
+        seen = sum(r[1] for r in results)
+        report.recall_rate = sum(r[2] for r in results) / seen if seen else 0.0
+        report.backlog = sum(r[3] for r in results) / len(results)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def calibrate_intensity(cards: Iterable[Card], minutes: float,
+                        scheduler: Optional[FSRS6Scheduler] = None, **options) -> float:
+    """
+    Find the intensity (0-10) whose projected workload fills a daily time budget.
+    
+    Every candidate is simulated with the same seeds, so the projected
+    minutes rise steadily with intensity and a bisection converges.
+    
+    Args:
+        cards: Deck in its current state
+        minutes: Study minutes per day to fill
+        scheduler: Scheduler supplying the retention and any fitted constants
+        **options: Passed on to simulate_workload
+    """
+    cards = cards if isinstance(cards, CardStore) else list(cards)
+    scheduler = scheduler or FSRS6Scheduler()
+    params = scheduler.log_parameters()
+    low, high = 0.0, 10.0
+    for _ in range(CALIBRATION_STEPS):
+        middle = (low + high) / 2
+        candidate = FSRS6Scheduler.from_log_parameters([middle, *params[1:]])
+        candidate.load_balance = scheduler.load_balance
+        if simulate_workload(cards, candidate, **options).mean_minutes < minutes:
+            low = middle
+        else:
+            high = middle
+    return round((low + high) / 2, 2)
+
+
+def main():
+    """Project a user's daily workload, or calibrate minutes against intensity."""
+    parser = argparse.ArgumentParser(description="Simulate FSRS-6 review workload")
+    parser.add_argument('--data', default="data/users",
+                        help="JSON user data directory (default: data/users)")
+    parser.add_argument('--csv', default="hiragana.csv", help="Deck CSV (default: hiragana.csv)")
+    parser.add_argument('--deck', default="hiragana", help="Deck name (default: hiragana)")
+    parser.add_argument('--user', help="User whose deck and settings to use "
+                                       "(default: a fresh deck and default settings)")
+    parser.add_argument('--days', type=int, default=30, help="Days to simulate (default: 30)")
+    parser.add_argument('--trials', type=int, default=20, help="Trials to average (default: 20)")
+    parser.add_argument('--max-per-day', type=int, default=None,
+                        help="Daily review limit (default: the deck's; none with --calibrate)")
+    parser.add_argument('--seconds-per-review', type=float, default=SECONDS_PER_REVIEW,
+                        help=f"Seconds per review (default: {SECONDS_PER_REVIEW:g})")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="Print the intensity that fills each daily time budget")
+    parser.add_argument('--load-balance', action=argparse.BooleanOptionalAction, default=None,
+                        help="Balance intervals to flatten daily load (default: user setting)")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Worker processes (default: one per CPU)")
+    args = parser.parse_args()
+    
+    persistence = PersistenceManager(args.data)
+    scheduler = FSRS6Scheduler()
+    if args.user:
+        settings = UserSettings(args.user, base_dir=args.data)
+        scheduler.set_intensity(settings.effective_intensity(), settings.request_retention)
+        scheduler.load_parameters(settings.params_file)
+        cards = persistence.load_card_store(args.csv, args.user, args.deck)
+        max_per_day = persistence.load_deck_metadata(args.user, args.deck).max_per_day
+    else:
+        settings = UserSettings("", base_dir=args.data)
+        cards = CardStore(Card(front=row['front'], back=row['back'])
+                          for row in deck_content_cache.rows(args.csv))
+        max_per_day = None
+    scheduler.load_balance = settings.load_balance
+    if args.load_balance is not None:
+        scheduler.load_balance = args.load_balance
+    if args.calibrate:
+        max_per_day = None  # A limit would cap the demand being matched to each budget
+    if args.max_per_day is not None:
+        max_per_day = args.max_per_day
+    options = dict(days=args.days, trials=args.trials, max_per_day=max_per_day,
+                   seconds_per_review=args.seconds_per_review, ordering=settings.practice_order,
+                   new_ratio=settings.new_card_ratio, processes=args.processes)
+    
+    if args.calibrate:
+        # Budgets the deck cannot fill map to 10 (or busier ones to 0)
+        print(f"{'minutes':>8} {'table':>6} {'simulated':>10} {'projected min':>14}")
+        for minutes in CALIBRATION_MINUTES:
+            fitted = calibrate_intensity(cards, minutes, scheduler, **options)
+            candidate = FSRS6Scheduler.from_log_parameters(
+                [fitted, *scheduler.log_parameters()[1:]])
+            candidate.load_balance = scheduler.load_balance
+            projected = simulate_workload(cards, candidate, **options)
+            print(f"{minutes:>8} {settings.minutes_to_intensity(minutes):6.2f} {fitted:10.2f} "
+                  f"{projected.mean_minutes:14.1f}")
+        return 0
+    
+    report = simulate_workload(cards, scheduler, **options)
+    print(f"{len(cards):,} cards, intensity {scheduler.intensity:.2f}, "
+          f"retention {scheduler.request_retention:.0%}, {args.days} days x {args.trials} trials "
+          f"({report.seconds:.2f}s){', load balanced' if scheduler.load_balance else ''}")
+    print(f"  {report.mean_reviews:.1f} reviews/day ({report.mean_minutes:.1f} min), "
+          f"90th percentile {report.p90_reviews:.0f}, busiest day {report.peak_reviews:.0f}, "
+          f"recall {report.recall_rate:.0%}")
+    if report.backlog:
+        print(f"  {report.backlog:.0f} cards still due at the end (daily limit {max_per_day})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
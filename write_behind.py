@@ -0,0 +1,200 @@
+"""
+Write-behind persistence worker.
+
+Grading only queues the review; a background thread coalesces queued
+reviews and deck metadata and writes them after a short debounce, so the
+Tk event loop never waits on disk I/O.
+"""
+import atexit
+import queue
+import threading
+from typing import Callable, Optional
+from models import Card, DeckMetadata
+from persistence import PersistenceManager
+
+
+class WriteBehindSaver:
+    """Coalesces dirty review state and flushes it on a background thread."""
+    
+    # Delay before retrying after a failed write
+    RETRY_SECONDS = 5.0
+    
+    def __init__(self, persistence: PersistenceManager, debounce_seconds: float = 0.5,
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        """
+        Start the background worker.
+        
+        Args:
+            persistence: Backend that performs the actual writes
+            debounce_seconds: How long to wait for more changes before writing
+            on_error: Optional callback run on the worker thread when a flush
+                      fails. Errors are also queued on self.errors for UIs
+                      that must handle them on their own thread.
+        """
+        self.persistence = persistence
+        self.debounce_seconds = debounce_seconds
+        self.on_error = on_error
+        self.errors: queue.Queue = queue.Queue()
+        
+        self._condition = threading.Condition()
+        self._pending_reviews: dict[tuple, list[list]] = {}
+        self._pending_metadata: dict[tuple, DeckMetadata] = {}
+        self._writing = False
+        self._writing_keys: set[tuple] = set()
+        self._flush_requested = False
+        self._closed = False
+        self._last_flush_failed = False
+        self.flush_count = 0
+        
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        # Guarantee durability if the process exits without calling close()
+        atexit.register(self.close)
+    
+    def record_review(self, user: str, deck_name: str, card: Card, grade_again: bool,
+                      deck_metadata: Optional[DeckMetadata] = None,
+                      params: Optional[list] = None):
+        """
+        Queue a graded review (and optionally the deck metadata) for writing. O(1).
+        
+        params are the scheduler's log_parameters(), logged so the review can
+        be replayed.
+        """
+        record = self.persistence.review_record(card, grade_again, params=params)
+        key = (user, deck_name)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("WriteBehindSaver is closed")
+            self._pending_reviews.setdefault(key, []).append(record)
+            if deck_metadata is not None:
+                self._pending_metadata[key] = deck_metadata.copy()
+                deck_metadata.dirty = False
+            self._condition.notify()
+        # The queued record now owns the card's unsaved state
+        card.dirty = False
+    
+    def has_pending(self) -> bool:
+        """Check whether any state is waiting to be written."""
+        with self._condition:
+            return self._has_pending()
+    
+    def _has_pending(self, key: Optional[tuple] = None) -> bool:
+        if key is not None:
+            return (key in self._pending_reviews or key in self._pending_metadata
+                    or key in self._writing_keys)
+        return bool(self._pending_reviews or self._pending_metadata or self._writing)
+    
+    def flush(self, timeout: Optional[float] = None, key: Optional[tuple] = None) -> bool:
+        """
+        Write all queued state now and wait for it to reach the backend.
+        
+        Args:
+            timeout: Most seconds to wait (None: no limit)
+            key: Only wait for this (user, deck_name)'s state; other queued
+                 state is written too, but its failures do not count
+        
+        Returns:
+            True if everything waited for was written, False on timeout or
+            write error
+        """
+        with self._condition:
+            if self._closed or not self._has_pending(key):
+                return not self._has_pending(key)
+            start = self.flush_count
+            self._flush_requested = True
+            self._condition.notify_all()
+            self._condition.wait_for(
+                lambda: not self._has_pending(key)
+                or (self.flush_count > start and self._last_flush_failed), timeout)
+            return not self._has_pending(key)
+    
+    def close(self) -> bool:
+        """
+        Flush remaining state and stop the worker.
+        
+        Returns:
+            True if all state was written
+        """
+        with self._condition:
+            if self._closed:
+                return not self._has_pending()
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        atexit.unregister(self.close)
+        # Final synchronous write, including anything a failed flush left behind
+        if self.has_pending():
+            self._write_pending()
+        return not self.has_pending()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._pending_reviews or self._pending_metadata or self._closed)
+                if self._closed:
+                    return
+                # Debounce: let more grades accumulate unless a flush is waiting
+                delay = self.RETRY_SECONDS if self._last_flush_failed else self.debounce_seconds
+                self._condition.wait_for(
+                    lambda: self._flush_requested or self._closed, delay)
+                if self._closed:
+                    return
+            self._write_pending()
+    
+    def _write_pending(self):
+        """Swap out pending state and write it outside the lock."""
+        with self._condition:
+            reviews, self._pending_reviews = self._pending_reviews, {}
+            metadata, self._pending_metadata = self._pending_metadata, {}
+            self._flush_requested = False
+            self._writing = True
+            self._writing_keys = set(reviews) | set(metadata)
+        
+        error = None
+        written_reviews = []
+        written_metadata = []
+        try:
+            # One flush is one logical save: its files share a sync barrier
+            with self.persistence.write_group():
+                for key in list(reviews):
+                    try:
+                        self.persistence.append_reviews(*key, reviews[key])
+                        del reviews[key]
+                        written_reviews.append(key)
+                    except Exception as e:
+                        error = e
+                for key in metadata:
+                    try:
+                        self.persistence.save_deck_metadata(*key, metadata[key])
+                        written_metadata.append(key)
+                    except Exception as e:
+                        error = e
+        except Exception as e:
+            # Staged files were discarded, so their metadata stays queued
+            error = e
+            written_metadata = []
+        for key in written_metadata:
+            del metadata[key]
+        for key in written_reviews:
+            try:
+                self.persistence.maybe_compact(*key)
+            except Exception as e:
+                error = e
+        
+        with self._condition:
+            # Requeue whatever failed ahead of newer changes
+            for key, records in reviews.items():
+                self._pending_reviews[key] = records + self._pending_reviews.get(key, [])
+            for key, deck_metadata in metadata.items():
+                self._pending_metadata.setdefault(key, deck_metadata)
+            self._writing = False
+            self._writing_keys = set()
+            self._last_flush_failed = error is not None
+            self.flush_count += 1
+            self._condition.notify_all()
+        
+        if error is not None:
+            self.errors.put(error)
+            if self.on_error is not None:
+                self.on_error(error)